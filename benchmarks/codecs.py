@@ -0,0 +1,153 @@
+"""
+Autotune chunk shape and compression codec on a sample of real data.
+
+A z-slab sample of the source array is written with every combination of
+chunk depth and Blosc settings. For each combination the write and read
+throughput (z-slab access) of the uncompressed data, the latency of reading
+a single z-slice and the compression ratio are recorded. Note that reads may
+be served from the page cache: the figures compare settings, they are not
+absolute disk throughput.
+
+Usage
+-----
+
+    python benchmarks/codecs.py data/sample.zarr --name metric/raw --slices 64
+    python benchmarks/codecs.py data/sample.zarr --cnames zstd lz4 --levels 1 3 5 \
+        --depths 8 16 32 --objective ratio --output codecs.json
+
+@Author: Jannik Stebani
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import zarr
+
+from woodtools.pipeline.storage import (
+    create_array, default_chunks, iter_slabs, Codec,
+    BLOSC_CNAMES, BLOSC_SHUFFLES, DEFAULT_TILE_SIZE
+)
+
+
+OBJECTIVES: dict[str, str] = {
+    'ratio': 'ratio', 'read': 'read_throughput', 'write': 'write_throughput'
+}
+
+
+def sample_slab(source: Path, name: str, slices: int) -> np.ndarray:
+    """The central `slices` z-slices of the array (all leading axes)."""
+    data = zarr.open(source, mode='r')[name]
+    D = data.shape[-3]
+    start = max(0, (D - slices) // 2)
+    return np.asarray(data[..., start:start + slices, :, :])
+
+
+def stored_bytes(path: Path) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, filename))
+        for root, _, filenames in os.walk(path) for filename in filenames
+    )
+
+
+def measure(sample: np.ndarray, workdir: Path, chunks: tuple[int, ...], codec: Codec) -> dict:
+    """Write and read back the sample with the given layout and report throughput and ratio."""
+    store = workdir / 'candidate.zarr'
+    start = time.perf_counter()
+    array = create_array(store, 'sample', sample.shape, sample.dtype, chunks=chunks, codec=codec)
+    for slab in iter_slabs(sample.shape[-3], chunks[-3]):
+        array[..., slab, :, :] = sample[..., slab, :, :]
+    write_time = time.perf_counter() - start
+
+    array = zarr.open(store, mode='r')['sample']
+    start = time.perf_counter()
+    for slab in iter_slabs(sample.shape[-3], chunks[-3]):
+        array[..., slab, :, :]
+    read_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    array[..., sample.shape[-3] // 2, :, :]
+    slice_time = time.perf_counter() - start
+
+    nbytes = stored_bytes(store)
+    shutil.rmtree(store)
+    return {
+        'chunks': list(chunks), 'codec': codec.asdict(),
+        'ratio': sample.nbytes / max(nbytes, 1),
+        'write_throughput': sample.nbytes / write_time / 2**20,
+        'read_throughput': sample.nbytes / read_time / 2**20,
+        'slice_latency': slice_time * 1e3
+    }
+
+
+def autotune(
+    sample: np.ndarray,
+    depths: list[int],
+    cnames: list[str],
+    levels: list[int],
+    shuffles: list[str],
+    tile: int = DEFAULT_TILE_SIZE
+) -> list[dict]:
+    """Measure all candidate settings (plus the uncompressed baseline) on the sample."""
+    candidates = [Codec(cname=None)] + [
+        Codec(cname=cname, clevel=level, shuffle=shuffle)
+        for cname, level, shuffle in itertools.product(cnames, levels, shuffles)
+    ]
+    results = []
+    with tempfile.TemporaryDirectory(prefix='woodtools-codecs-') as tmpdir:
+        for depth, codec in itertools.product(depths, candidates):
+            chunks = default_chunks(sample.shape, depth=depth, tile=tile)
+            results.append(measure(sample, Path(tmpdir), chunks, codec))
+    return results
+
+
+def format_result(result: dict) -> str:
+    codec = result['codec']
+    name = 'none' if codec['cname'] is None else f'{codec["cname"]}/{codec["clevel"]}/{codec["shuffle"]}'
+    return (f'{str(tuple(result["chunks"])):<24} {name:<24} {result["ratio"]:>7.2f} '
+            f'{result["write_throughput"]:>10.1f} {result["read_throughput"]:>10.1f} '
+            f'{result["slice_latency"]:>9.2f}')
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('source', type=Path, help='zarr store holding the sample data')
+    parser.add_argument('--name', default='metric/raw')
+    parser.add_argument('--slices', type=int, default=64,
+                        help='number of central z-slices used as the sample')
+    parser.add_argument('--depths', type=int, nargs='+', default=[1, 8, 16, 32])
+    parser.add_argument('--tile', type=int, default=DEFAULT_TILE_SIZE)
+    parser.add_argument('--cnames', nargs='+', default=['zstd', 'lz4'], choices=BLOSC_CNAMES)
+    parser.add_argument('--levels', type=int, nargs='+', default=[1, 3, 5])
+    parser.add_argument('--shuffles', nargs='+', default=['shuffle', 'bitshuffle'],
+                        choices=list(BLOSC_SHUFFLES))
+    parser.add_argument('--objective', choices=list(OBJECTIVES), default='read')
+    parser.add_argument('--output', type=Path, default=None)
+    args = parser.parse_args(argv)
+
+    sample = sample_slab(args.source, args.name, args.slices)
+    print(f'sample: shape={sample.shape} dtype={sample.dtype} size={sample.nbytes / 2**20:.1f} MiB')
+    results = autotune(sample, args.depths, args.cnames, args.levels, args.shuffles, args.tile)
+
+    results.sort(key=lambda result: result[OBJECTIVES[args.objective]], reverse=True)
+    print(f'{"chunks":<24} {"codec":<24} {"ratio":>7} {"write MiB/s":>10} '
+          f'{"read MiB/s":>10} {"slice ms":>9}')
+    for result in results:
+        print(format_result(result))
+    best = results[0]
+    print(f'best by {args.objective}: chunks={tuple(best["chunks"])} codec=Codec(**{best["codec"]})')
+
+    if args.output is not None:
+        with open(args.output, mode='w') as handle:
+            json.dump({'sample_shape': list(sample.shape), 'dtype': str(sample.dtype),
+                       'objective': args.objective, 'results': results}, handle, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
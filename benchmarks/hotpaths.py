@@ -0,0 +1,274 @@
+"""
+Benchmark suite for the volume-processing hot paths of woodtools.
+
+Every case runs in a fresh worker process on synthetic data and records
+wall time, peak resident set size and the bytes read and written by the
+process. Results are written to JSON so runs can be compared across commits.
+
+Usage
+-----
+
+    python benchmarks/hotpaths.py --shape 64 512 512 --dtype float32 --output bench.json
+    python benchmarks/hotpaths.py --output new.json --compare bench.json --tolerance 0.2
+
+@Author: Jannik Stebani
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+import numpy as np
+import zarr
+
+
+CASES: dict[str, Callable[[Path, dict], None]] = {}
+
+
+def case(fn: Callable[[Path, dict], None]) -> Callable[[Path, dict], None]:
+    CASES[fn.__name__] = fn
+    return fn
+
+
+def preload_torch() -> None:
+    """
+    Import torch and torchvision during case setup. The compute modules import
+    them lazily, so otherwise the first timed call would pay for the import.
+    """
+    import torch  # noqa: F401
+    import torchvision.transforms  # noqa: F401
+
+
+def roispec(shape: tuple[int, ...]) -> dict:
+    """Centered ROI of half the in-plane size over the central half of the z-axis."""
+    D, H, W = shape[-3:]
+    x0, y0, x1, y1 = W // 4, H // 4, 3 * W // 4, 3 * H // 4
+    return {
+        'top_left': [x0, y0], 'top_right': [x1, y0],
+        'bottom_left': [x0, y1], 'bottom_right': [x1, y1],
+        'z_range': [D // 4, 3 * D // 4]
+    }
+
+
+def create_data(workdir: Path, shape: tuple[int, int, int], dtype: str, tiff_slices: int) -> None:
+    """Synthetic source store and TIFF stack shared by all cases."""
+    import skimage.io
+
+    rng = np.random.default_rng(seed=0)
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        volume = rng.integers(0, np.iinfo(dtype).max, size=shape, dtype=dtype)
+    else:
+        volume = rng.random(shape, dtype=np.float32).astype(dtype)
+    root = zarr.open_group(workdir / 'source.zarr', mode='w')
+    root['metric/raw'] = volume
+    root['downsampled/half'] = volume[np.newaxis]
+    root['downsampled/sam-native'] = volume[np.newaxis]
+    np.save(workdir / 'volume.npy', volume)
+
+    tiffdir = workdir / 'tiffs'
+    tiffdir.mkdir()
+    for index in range(min(tiff_slices, shape[0])):
+        skimage.io.imsave(tiffdir / f'reko_{index:05d}.tif', volume[index], check_contrast=False)
+
+
+@case
+def downsample(workdir: Path, config: dict) -> Callable[[], None]:
+    preload_torch()
+    from woodtools.pipeline.transforms import downsample
+    volume = np.load(workdir / 'volume.npy')[np.newaxis]
+    return lambda: downsample(volume, volume.shape[-1] // 2)
+
+
+@case
+def downsample_zarr(workdir: Path, config: dict) -> Callable[[], None]:
+    preload_torch()
+    from woodtools.pipeline.transforms import downsample_zarr
+    shape = config['shape']
+    return lambda: downsample_zarr(workdir / 'source.zarr', workdir / 'ds.zarr', shape[-1] // 2)
+
+
+@case
+def downsample_zarr_streaming(workdir: Path, config: dict) -> Callable[[], None]:
+    preload_torch()
+    from woodtools.pipeline.transforms import downsample_zarr
+    shape = config['shape']
+    return lambda: downsample_zarr(workdir / 'source.zarr', workdir / 'ds-streaming.zarr',
+                                   shape[-1] // 2, memory_budget=config['memory_budget'])
+
+
+@case
+def datatransform(workdir: Path, config: dict) -> Callable[[], None]:
+    preload_torch()
+    from woodtools.pipeline.transforms import datatransform
+    image = np.load(workdir / 'volume.npy', mmap_mode='r')[0].copy()
+    return lambda: datatransform(image, angle=7.5, mode='bilinear')
+
+
+@case
+def rotate_zarr(workdir: Path, config: dict) -> Callable[[], None]:
+    preload_torch()
+    from woodtools.pipeline.rotations import rotate_zarr
+    return lambda: rotate_zarr(workdir / 'source.zarr', workdir / 'rotated.zarr',
+                               angle=7.5, mode='bilinear')
+
+
+@case
+def assemble_array(workdir: Path, config: dict) -> Callable[[], None]:
+    from woodtools.dataloading.regex import match_reko_file
+    from woodtools.pipeline.pathing import assemble_array, generate_path_mapping
+    mapping = generate_path_mapping(sorted((workdir / 'tiffs').iterdir()), match_reko_file)
+    return lambda: assemble_array(mapping, progress=False)
+
+
+@case
+def extract_roi(workdir: Path, config: dict) -> Callable[[], None]:
+    from woodtools.pipeline.roi import extract_roi
+    volume = np.load(workdir / 'volume.npy')
+    spec = roispec(volume.shape)
+    return lambda: extract_roi(volume, spec)
+
+
+@case
+def extract_roi_zarr(workdir: Path, config: dict) -> Callable[[], None]:
+    from woodtools.pipeline.roi import extract_roi
+    array = zarr.open(workdir / 'source.zarr', mode='r')['metric/raw']
+    spec = roispec(array.shape)
+    return lambda: extract_roi(array, spec)
+
+
+@case
+def load_volume(workdir: Path, config: dict) -> Callable[[], None]:
+    from woodtools.dataloading import load_volume
+    return lambda: load_volume(workdir / 'source.zarr')
+
+
+@case
+def workitem_copy(workdir: Path, config: dict) -> Callable[[], None]:
+    from woodtools.pipeline.state import WorkItem
+    item = WorkItem(ID='benchmark', volume=np.load(workdir / 'volume.npy'))
+    return lambda: item.copy()
+
+
+def read_io() -> dict[str, int]:
+    """Byte counters of the current process (Linux only)."""
+    try:
+        with open('/proc/self/io') as handle:
+            return {key: int(value) for key, value in
+                    (line.split(':') for line in handle if ':' in line)}
+    except OSError:
+        return {}
+
+
+def peak_rss() -> int:
+    """Peak resident set size of the current process in bytes."""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def run_case(name: str, workdir: Path, config: dict) -> dict:
+    """Worker process entry point: set up and time a single case."""
+    result = {'case': name}
+    try:
+        fn = CASES[name](workdir, config)
+        rss_before = peak_rss()
+        io_before = read_io()
+        start = time.perf_counter()
+        fn()
+        result['wall'] = time.perf_counter() - start
+        io_after = read_io()
+        result['peak_rss'] = peak_rss()
+        result['peak_rss_delta'] = result['peak_rss'] - rss_before
+        result['bytes_read'] = io_after.get('rchar', 0) - io_before.get('rchar', 0)
+        result['bytes_written'] = io_after.get('wchar', 0) - io_before.get('wchar', 0)
+    except Exception as error:
+        result['error'] = f'{type(error).__name__}: {error}'
+    return result
+
+
+def metadata(config: dict) -> dict:
+    import torch
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit, 'timestamp': time.time(), 'platform': platform.platform(),
+        'python': platform.python_version(), 'numpy': np.__version__,
+        'zarr': zarr.__version__, 'torch': torch.__version__, **config
+    }
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """Cases whose wall time or peak memory grew by more than the relative tolerance."""
+    previous = {entry['case']: entry for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        old = previous.get(entry['case'])
+        if old is None or 'error' in entry or 'error' in old:
+            continue
+        for metric in ('wall', 'peak_rss_delta'):
+            if old[metric] > 0 and entry[metric] > (1 + tolerance) * old[metric]:
+                regressions.append(
+                    f'{entry["case"]}: {metric} {old[metric]:.4g} -> {entry[metric]:.4g}'
+                )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--shape', type=int, nargs=3, default=[64, 512, 512],
+                        metavar=('D', 'H', 'W'))
+    parser.add_argument('--dtype', default='float32')
+    parser.add_argument('--tiff-slices', type=int, default=64)
+    parser.add_argument('--memory-budget', type=int, default=64 * 2**20)
+    parser.add_argument('--cases', nargs='*', default=list(CASES), choices=list(CASES))
+    parser.add_argument('--output', type=Path, default=Path('benchmark.json'))
+    parser.add_argument('--compare', type=Path, default=None,
+                        help='baseline JSON: exit with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    config = {
+        'shape': tuple(args.shape), 'dtype': args.dtype,
+        'tiff_slices': args.tiff_slices, 'memory_budget': args.memory_budget
+    }
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory(prefix='woodtools-bench-') as tmpdir:
+        datadir = Path(tmpdir) / 'data'
+        datadir.mkdir()
+        create_data(datadir, config['shape'], config['dtype'], config['tiff_slices'])
+        for name in args.cases:
+            # every case gets its own output directory next to the shared data
+            workdir = Path(tmpdir) / name
+            workdir.mkdir()
+            for item in datadir.iterdir():
+                (workdir / item.name).symlink_to(item)
+            with context.Pool(processes=1, maxtasksperchild=1) as pool:
+                result = pool.apply(run_case, (name, workdir, config))
+            results.append(result)
+            print(json.dumps(result))
+
+    report = {'meta': metadata(config), 'results': results}
+    with open(args.output, mode='w') as handle:
+        json.dump(report, handle, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as handle:
+            regressions = compare(results, json.load(handle), args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
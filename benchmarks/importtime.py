@@ -0,0 +1,131 @@
+"""
+Import-time benchmark for the woodtools modules.
+
+Every module is imported in a fresh interpreter; the best of several runs is
+recorded together with the heavy dependencies (GUI stack, torch) that the
+import pulled in. Headless compute modules must not load any of them.
+
+Usage
+-----
+
+    python benchmarks/importtime.py --output imports.json
+    python benchmarks/importtime.py --output new.json --compare imports.json --tolerance 0.5
+
+@Author: Jannik Stebani
+"""
+import argparse
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+
+HEAVY: tuple[str, ...] = ('torch', 'torchvision', 'matplotlib', 'ipywidgets', 'IPython')
+
+# module -> heavy dependencies it may load
+MODULES: dict[str, tuple[str, ...]] = {
+    'woodtools.pipeline': (),
+    'woodtools.pipeline.roi': (),
+    'woodtools.pipeline.storage': (),
+    'woodtools.pipeline.pathing': (),
+    'woodtools.pipeline.pyramid': (),
+    'woodtools.pipeline.transforms': (),
+    'woodtools.pipeline.rotations': (),
+    'woodtools.pipeline.replay': (),
+    'woodtools.pipeline.state': (),
+    'woodtools.pipeline.resultcache': (),
+    'woodtools.pipeline.lazy': (),
+    'woodtools.pipeline.previews': (),
+    'woodtools.dataloading': (),
+    'woodtools.dataloading.statistics': (),
+    'woodtools.instrumentation': (),
+    'woodtools.plotting': ('matplotlib',),
+    'woodtools.pipeline.rotationselector': HEAVY,
+}
+
+# absolute slack in seconds on top of the relative tolerance, against timer noise
+SLACK: float = 0.05
+
+PROBE: str = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{'seconds': seconds, 'heavy': heavy}}))
+'''
+
+
+def measure(module: str, repeats: int) -> dict:
+    """Best import time of the module over fresh interpreters and the heavy modules it loaded."""
+    runs = []
+    for _ in range(repeats):
+        completed = subprocess.run(
+            [sys.executable, '-c', PROBE.format(module=module, heavy=HEAVY)],
+            capture_output=True, text=True
+        )
+        if completed.returncode != 0:
+            return {'module': module, 'error': completed.stderr.strip().splitlines()[-1]}
+        runs.append(json.loads(completed.stdout))
+    best = min(runs, key=lambda run: run['seconds'])
+    return {'module': module, 'seconds': best['seconds'], 'heavy': best['heavy']}
+
+
+def violations(results: list[dict]) -> list[str]:
+    """Modules that failed to import or loaded heavy dependencies they must not load."""
+    problems = []
+    for entry in results:
+        if 'error' in entry:
+            problems.append(f'{entry["module"]}: {entry["error"]}')
+            continue
+        forbidden = set(entry['heavy']) - set(MODULES[entry['module']])
+        if forbidden:
+            problems.append(f'{entry["module"]}: imports {", ".join(sorted(forbidden))}')
+    return problems
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    """Modules whose import time grew by more than the relative tolerance (plus slack)."""
+    previous = {entry['module']: entry for entry in baseline['results']}
+    regressions = []
+    for entry in results:
+        old = previous.get(entry['module'])
+        if old is None or 'error' in entry or 'error' in old:
+            continue
+        if entry['seconds'] > (1 + tolerance) * old['seconds'] + SLACK:
+            regressions.append(
+                f'{entry["module"]}: {old["seconds"]:.3f}s -> {entry["seconds"]:.3f}s'
+            )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--modules', nargs='*', default=list(MODULES), choices=list(MODULES))
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--output', type=Path, default=Path('importtime.json'))
+    parser.add_argument('--compare', type=Path, default=None,
+                        help='baseline JSON: exit with 1 on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.5)
+    args = parser.parse_args(argv)
+
+    results = []
+    for module in args.modules:
+        result = measure(module, args.repeats)
+        results.append(result)
+        print(json.dumps(result))
+
+    with open(args.output, mode='w') as handle:
+        json.dump({'python': sys.version, 'results': results}, handle, indent=2)
+
+    problems = violations(results)
+    if args.compare is not None:
+        with open(args.compare) as handle:
+            problems.extend(compare(results, json.load(handle), args.tolerance))
+    for problem in problems:
+        print(f'REGRESSION {problem}')
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
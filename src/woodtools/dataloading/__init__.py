@@ -3,9 +3,86 @@ import numpy as np
 
 import zarr
 
+from woodtools import instrumentation
 
-def load_volume(source: Path) -> np.ndarray:
-    volume = zarr.open(source)['downsampled/sam-native'][...]
+PYRAMID_ATTRIBUTE: str = 'multiscale'
+PREVIEWS_ATTRIBUTE: str = 'previews'
+
+
+def read_levels(zarrfile: zarr.Group) -> list[dict]:
+    """
+    Resolution levels recorded by `woodtools.pipeline.pyramid.build_pyramid`,
+    ordered from finest (factor 1, the source array) to coarsest.
+    Empty if the store holds no pyramid.
+    """
+    metadata = zarrfile.attrs.get(PYRAMID_ATTRIBUTE)
+    if metadata is None:
+        return []
+    return sorted(metadata['levels'], key=lambda level: level['factor'])
+
+
+def select_level(zarrfile: zarr.Group, min_size: int) -> str | None:
+    """
+    Path of the cheapest pyramid level whose largest in-plane dimension
+    is at least `min_size`. Falls back to the finest level if no level is
+    large enough and returns None if the store holds no pyramid.
+    """
+    levels = read_levels(zarrfile)
+    if not levels:
+        return None
+    for level in reversed(levels):
+        if max(level['shape'][-2:]) >= min_size:
+            return level['path']
+    return levels[0]['path']
+
+
+def read_previews(zarrfile: zarr.Group) -> dict | None:
+    """
+    Preview metadata recorded by `woodtools.pipeline.previews.build_previews`
+    (source array, thumbnail factor and the path of every preview array),
+    or None if the store holds no previews.
+    """
+    return zarrfile.attrs.get(PREVIEWS_ATTRIBUTE)
+
+
+def load_preview(source: Path, kind: str = 'max/z') -> np.ndarray | None:
+    """
+    Load a single precomputed preview, e.g. the maximum projection along the
+    z-axis ('max/z'), a mean projection ('mean/y') or one of the upper, center
+    and lower slices ('slices/center'). Returns None if the store holds no previews.
+    """
+    zarrfile = zarr.open(source, mode='r')
+    metadata = read_previews(zarrfile)
+    if metadata is None:
+        return None
+    try:
+        path = metadata['arrays'][kind]
+    except KeyError:
+        raise KeyError(
+            f'unknown preview \'{kind}\', expected one of {sorted(metadata["arrays"])}'
+        ) from None
+    with instrumentation.span('load_preview', source=str(source), array=path) as span:
+        preview = zarrfile[path][...]
+        span.add(bytes_read=preview.nbytes)
+    return preview
+
+
+def load_volume(
+    source: Path,
+    name: str = 'downsampled/sam-native',
+    min_size: int | None = None
+) -> np.ndarray:
+    """
+    Load a 3D volume from the zarr store. If `min_size` is given and the store
+    holds a pyramid, the cheapest level that is large enough is loaded instead
+    of the array `name`.
+    """
+    zarrfile = zarr.open(source, mode='r')
+    if min_size is not None:
+        name = select_level(zarrfile, min_size) or name
+    with instrumentation.span('load_volume', source=str(source), array=name) as span:
+        volume = zarrfile[name][...]
+        span.add(bytes_read=volume.nbytes)
     volume = np.squeeze(volume)
     assert volume.ndim == 3, f'expected ndim == 3, got {volume.ndim}'
-    return volume
\ No newline at end of file
+    return volume
@@ -1,41 +1,36 @@
+import functools
 import re
 
-def match_acer_file(filename, subid: str):
-    # Pattern matches "acer_links" at the beginning followed by any characters,
-    # then a number at the end
-    pattern = r'^acer_' + str(subid) + r'.*?(\d+)$'
-    
-    match = re.match(pattern, filename)
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(prefix: str) -> re.Pattern:
+    # Pattern matches the prefix at the beginning followed by any characters,
+    # then a number at the end. Compiled once per prefix and cached.
+    return re.compile('^' + prefix + r'.*?(\d+)$')
+
+
+def _match(pattern: re.Pattern, filename: str) -> tuple[bool, int | None]:
+    match = pattern.match(filename)
     if match:
         # Extract the number and convert to integer
         number = int(match.group(1))
         return True, number
     else:
         return False, None
+
+
+def match_acer_file(filename, subid: str):
+    # Pattern matches "acer_links" at the beginning followed by any characters,
+    # then a number at the end
+    return _match(compile_pattern('acer_' + str(subid)), filename)
     
 def match_reko_file(filename, suffix: str = ''):
     # Pattern matches "reko" at the beginning followed by any characters,
     # then a number at the end
-    pattern = r'^reko' + str(suffix) + r'.*?(\d+)$'
-    
-    match = re.match(pattern, filename)
-    if match:
-        # Extract the number and convert to integer
-        number = int(match.group(1))
-        return True, number
-    else:
-        return False, None
+    return _match(compile_pattern('reko' + str(suffix)), filename)
     
     
 def match_reslice_file(filename, suffix: str = ''):
-    # Pattern matches "reko" at the beginning followed by any characters,
+    # Pattern matches "Reslice of Reslice" at the beginning followed by any characters,
     # then a number at the end
-    pattern = r'^Reslice of Reslice' + str(suffix) + r'.*?(\d+)$'
-    
-    match = re.match(pattern, filename)
-    if match:
-        # Extract the number and convert to integer
-        number = int(match.group(1))
-        return True, number
-    else:
-        return False, None
\ No newline at end of file
+    return _match(compile_pattern('Reslice of Reslice' + str(suffix)), filename)
@@ -0,0 +1,230 @@
+"""
+Streaming intensity statistics of zarr arrays for display windowing.
+
+A single chunk-parallel pass computes min/max, mean/std, a histogram and
+percentiles. Integer data of up to 16 bit is histogrammed exactly, all other
+data approximately by merging fine per-slab histograms. The result is cached
+in the array attributes together with a fingerprint of the chunk files, so it
+is recomputed automatically once the array has been rewritten.
+
+@Author: Jannik Stebani
+"""
+import hashlib
+import os
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+import zarr
+
+from woodtools.pipeline.parallel import run_threaded
+from woodtools.pipeline.storage import iter_slabs, slab_depth
+
+
+STATISTICS_ATTRIBUTE: str = 'statistics'
+STATISTICS_VERSION: int = 1
+DEFAULT_PERCENTILES: tuple[float, ...] = (0.1, 0.5, 1.0, 2.0, 5.0, 50.0, 95.0, 98.0, 99.0, 99.5, 99.9)
+# bins of the per-slab histograms of data that is not histogrammed exactly
+FINE_BINS: int = 4096
+# metadata files holding the attributes: rewriting them must not invalidate the cache
+ATTRIBUTE_FILES: frozenset[str] = frozenset(('zarr.json', '.zattrs'))
+
+
+def fingerprint(array: zarr.Array) -> str | None:
+    """
+    Fingerprint of the array content: shape, dtype and chunking plus name, size
+    and modification time of every chunk file. None for arrays that do not
+    live in a local directory store.
+    """
+    root = getattr(array.store, 'root', None)
+    if root is None:
+        return None
+    digest = hashlib.sha1(
+        f'{array.shape}|{np.dtype(array.dtype)}|{array.chunks}'.encode()
+    )
+    directory = Path(root) / array.path
+    for dirpath, dirnames, filenames in os.walk(directory):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if filename in ATTRIBUTE_FILES:
+                continue
+            stat = os.stat(os.path.join(dirpath, filename))
+            relpath = os.path.relpath(os.path.join(dirpath, filename), directory)
+            digest.update(f'{relpath}|{stat.st_size}|{stat.st_mtime_ns}'.encode())
+    return digest.hexdigest()
+
+
+def _is_exact(dtype: np.dtype) -> bool:
+    return np.issubdtype(dtype, np.integer) and np.dtype(dtype).itemsize <= 2
+
+
+def _slab_statistics(data: zarr.Array | np.ndarray, slab: slice) -> dict | None:
+    values = np.asarray(data[..., slab, :, :]).ravel()
+    if np.issubdtype(values.dtype, np.floating):
+        values = values[np.isfinite(values)]
+    if values.size == 0:
+        return None
+    result = {
+        'count': values.size,
+        'min': values.min(),
+        'max': values.max(),
+        'sum': values.sum(dtype=np.float64),
+        'sumsq': np.square(values, dtype=np.float64).sum()
+    }
+    if _is_exact(values.dtype):
+        offset = np.iinfo(values.dtype).min
+        result['counts'] = np.bincount(
+            (values.astype(np.int64) - offset), minlength=2**(8 * values.dtype.itemsize)
+        )
+    else:
+        result['counts'], result['edges'] = np.histogram(
+            values, bins=FINE_BINS, range=(float(result['min']), float(result['max']))
+        )
+    return result
+
+
+def _merge_histograms(partials: list[dict], dtype: np.dtype) -> tuple[np.ndarray, np.ndarray]:
+    """Histogram over all slabs: exact for small integers, re-binned otherwise."""
+    if _is_exact(dtype):
+        counts = np.sum([partial['counts'] for partial in partials], axis=0)
+        offset = np.iinfo(dtype).min
+        edges = np.arange(counts.size + 1, dtype=np.float64) + offset - 0.5
+        return counts, edges
+    lo = float(min(partial['min'] for partial in partials))
+    hi = float(max(partial['max'] for partial in partials))
+    counts = np.zeros(FINE_BINS, dtype=np.int64)
+    for partial in partials:
+        centers = 0.5 * (partial['edges'][:-1] + partial['edges'][1:])
+        rebinned, edges = np.histogram(
+            centers, bins=FINE_BINS, range=(lo, hi), weights=partial['counts']
+        )
+        counts += np.rint(rebinned).astype(np.int64)
+    return counts, edges
+
+
+def _histogram_percentiles(
+    counts: np.ndarray,
+    edges: np.ndarray,
+    percentiles: Sequence[float]
+) -> list[float]:
+    """Percentiles by linear interpolation of the cumulative histogram."""
+    cumulative = np.concatenate([[0], np.cumsum(counts)]).astype(np.float64)
+    targets = np.asarray(percentiles, dtype=np.float64) / 100 * cumulative[-1]
+    return [float(value) for value in np.interp(targets, cumulative, edges)]
+
+
+def _rebin(counts: np.ndarray, edges: np.ndarray, bins: int, lo: float, hi: float) -> tuple:
+    """Compact histogram of `bins` bins over [lo, hi] for storage in the attributes."""
+    centers = 0.5 * (edges[:-1] + edges[1:])
+    mask = counts > 0
+    compact, compact_edges = np.histogram(
+        centers[mask], bins=bins, range=(lo, hi if hi > lo else lo + 1), weights=counts[mask]
+    )
+    return np.rint(compact).astype(np.int64).tolist(), compact_edges.tolist()
+
+
+def compute_statistics(
+    data: zarr.Array | np.ndarray,
+    bins: int = 256,
+    percentiles: Sequence[float] = DEFAULT_PERCENTILES,
+    workers: int | None = None,
+    progress: bool = False
+) -> dict:
+    """
+    Intensity statistics of the (... x D x H x W) array from a single pass over
+    chunk-aligned z-slabs, processed in parallel. Non-finite values are ignored.
+
+    Returns
+    -------
+
+    statistics : dict
+        Count, min, max, mean, std, the percentiles (keyed by their string
+        representation) and a histogram of `bins` bins over [min, max].
+    """
+    dtype = np.dtype(data.dtype)
+    partials = run_threaded(
+        lambda slab: _slab_statistics(data, slab),
+        iter_slabs(data.shape[-3], slab_depth(data)),
+        workers=workers, progress=progress, unit='slab'
+    )
+    partials = [partial for partial in partials if partial is not None]
+    if not partials:
+        raise ValueError('cannot compute statistics: array holds no finite values')
+    count = sum(partial['count'] for partial in partials)
+    lo = min(partial['min'] for partial in partials).item()
+    hi = max(partial['max'] for partial in partials).item()
+    mean = sum(partial['sum'] for partial in partials) / count
+    variance = max(sum(partial['sumsq'] for partial in partials) / count - mean**2, 0.0)
+
+    counts, edges = _merge_histograms(partials, dtype)
+    values = _histogram_percentiles(counts, edges, percentiles)
+    histogram_counts, histogram_edges = _rebin(counts, edges, bins, lo, hi)
+    return {
+        'version': STATISTICS_VERSION,
+        'dtype': str(dtype),
+        'exact': _is_exact(dtype),
+        'count': int(count),
+        'min': lo,
+        'max': hi,
+        'mean': float(mean),
+        'std': float(np.sqrt(variance)),
+        # clamp the interpolated percentiles to the observed value range
+        'percentiles': {str(q): min(max(value, lo), hi) for q, value in zip(percentiles, values)},
+        'histogram': {'counts': histogram_counts, 'edges': histogram_edges}
+    }
+
+
+def intensity_statistics(
+    source: Path | zarr.Array,
+    name: str = 'metric/raw',
+    bins: int = 256,
+    workers: int | None = None,
+    progress: bool = False,
+    recompute: bool = False,
+    data: np.ndarray | None = None
+) -> dict:
+    """
+    Intensity statistics of the array `name` of the store (or of the given array),
+    served from the attribute cache if the array is unchanged since they were computed.
+    Fresh statistics are written to the attributes if the store is writable.
+    If the array content is already in memory, pass it as `data` to compute
+    fresh statistics without reading the array again.
+    """
+    if isinstance(source, zarr.Array):
+        array = source
+    else:
+        try:
+            array = zarr.open(source, mode='r+')[name]
+        except (OSError, ValueError):
+            array = zarr.open(source, mode='r')[name]
+    key = fingerprint(array)
+    cached = array.attrs.get(STATISTICS_ATTRIBUTE)
+    if (not recompute and key is not None and cached is not None
+            and cached.get('fingerprint') == key and cached.get('version') == STATISTICS_VERSION):
+        return cached
+
+    statistics = compute_statistics(array if data is None else data,
+                                    bins=bins, workers=workers, progress=progress)
+    statistics['fingerprint'] = key
+    if key is not None and not array.read_only:
+        try:
+            array.attrs[STATISTICS_ATTRIBUTE] = statistics
+        except OSError:
+            pass
+    return statistics
+
+
+def percentile(statistics: dict, q: float) -> float:
+    """Percentile `q` from precomputed statistics, interpolated from the histogram if not stored."""
+    stored = statistics['percentiles'].get(str(float(q)))
+    if stored is not None:
+        return stored
+    histogram = statistics['histogram']
+    return _histogram_percentiles(
+        np.asarray(histogram['counts']), np.asarray(histogram['edges']), [q]
+    )[0]
+
+
+def display_window(statistics: dict, lower: float = 1.0, upper: float = 99.0) -> tuple[float, float]:
+    """Robust (vmin, vmax) display window between the lower and upper percentile."""
+    return percentile(statistics, lower), percentile(statistics, upper)
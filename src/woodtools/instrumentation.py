@@ -0,0 +1,205 @@
+"""
+Lightweight per-stage timing and memory instrumentation for pipeline operations.
+
+Operations report into named spans:
+
+    with instrumentation.span('rotate_zarr.read', bytes_read=slab.nbytes):
+        ...
+
+Recording is off by default. While off, `span` returns a shared no-op object,
+so instrumented code pays a single function call and attribute check per span.
+Enable recording via `enable()` or the `recording()` context manager and
+export the recorded spans as JSON or as a Chrome trace file
+(viewable in chrome://tracing or Perfetto).
+
+@Author: Jannik Stebani
+"""
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+
+try:
+    import resource
+except ImportError:   # pragma: no cover - non-POSIX platforms
+    resource = None
+
+
+def peak_rss() -> int:
+    """Peak resident set size of the process in bytes (0 if unavailable)."""
+    if resource is None:
+        return 0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class Span:
+    """A timed stage with the bytes it moved and the process peak memory at its end."""
+    __slots__ = ('name', 'start', 'duration', 'bytes_read', 'bytes_written',
+                 'peak_rss', 'thread', 'pid', 'attrs', '_recorder')
+
+    def __init__(self, name: str, recorder: 'Recorder', bytes_read: int = 0,
+                 bytes_written: int = 0, **attrs) -> None:
+        self.name = name
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.attrs = attrs
+        self.start = 0.0
+        self.duration = 0.0
+        self.peak_rss = 0
+        self.thread = threading.get_ident()
+        self.pid = os.getpid()
+        self._recorder = recorder
+
+    def add(self, bytes_read: int = 0, bytes_written: int = 0, **attrs) -> None:
+        """Account additional bytes or attributes from inside the span."""
+        self.bytes_read += bytes_read
+        self.bytes_written += bytes_written
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> 'Span':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.duration = time.perf_counter() - self.start
+        self.peak_rss = peak_rss()
+        self._recorder.record(self)
+
+    def as_dict(self) -> dict:
+        return {
+            'name': self.name, 'start': self.start, 'duration': self.duration,
+            'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written,
+            'peak_rss': self.peak_rss, 'pid': self.pid, 'thread': self.thread,
+            **self.attrs
+        }
+
+
+class _NullSpan:
+    """Shared no-op stand-in for `Span` while recording is disabled."""
+    __slots__ = ()
+
+    def add(self, bytes_read: int = 0, bytes_written: int = 0, **attrs) -> None:
+        pass
+
+    def as_dict(self) -> dict:
+        return {}
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Recorder:
+    """Thread-safe collection of finished spans."""
+    def __init__(self, attach_to_items: bool = False) -> None:
+        self.attach_to_items = attach_to_items
+        self.spans: list[dict] = []
+        self._lock = threading.Lock()
+
+    def record(self, span: Span) -> None:
+        entry = span.as_dict()
+        with self._lock:
+            self.spans.append(entry)
+
+    def extend(self, spans: list[dict]) -> None:
+        """Merge spans recorded elsewhere, e.g. in worker processes."""
+        with self._lock:
+            self.spans.extend(spans)
+
+    def summary(self) -> dict[str, dict]:
+        """Aggregate count, total duration, bytes and maximum peak memory per span name."""
+        summary: dict[str, dict] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for entry in spans:
+            aggregate = summary.setdefault(entry['name'], {
+                'count': 0, 'duration': 0.0, 'bytes_read': 0, 'bytes_written': 0, 'peak_rss': 0
+            })
+            aggregate['count'] += 1
+            aggregate['duration'] += entry['duration']
+            aggregate['bytes_read'] += entry['bytes_read']
+            aggregate['bytes_written'] += entry['bytes_written']
+            aggregate['peak_rss'] = max(aggregate['peak_rss'], entry['peak_rss'])
+        return summary
+
+    def export_json(self, path: Path) -> None:
+        with open(path, mode='w') as handle:
+            json.dump({'spans': self.spans, 'summary': self.summary()}, handle, indent=2)
+
+    def export_chrome_trace(self, path: Path) -> None:
+        """Write the spans in the Chrome trace event format (complete events)."""
+        events = []
+        for entry in self.spans:
+            args = {key: value for key, value in entry.items()
+                    if key not in ('name', 'start', 'duration', 'pid', 'thread')}
+            events.append({
+                'name': entry['name'], 'ph': 'X', 'pid': entry['pid'], 'tid': entry['thread'],
+                'ts': entry['start'] * 1e6, 'dur': entry['duration'] * 1e6, 'args': args
+            })
+        with open(path, mode='w') as handle:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, handle)
+
+
+_recorder: Recorder | None = None
+
+
+def span(name: str, bytes_read: int = 0, bytes_written: int = 0, **attrs) -> Span | _NullSpan:
+    """Context manager timing the enclosed stage if recording is enabled."""
+    if _recorder is None:
+        return _NULL_SPAN
+    return Span(name, _recorder, bytes_read=bytes_read, bytes_written=bytes_written, **attrs)
+
+
+def is_enabled() -> bool:
+    return _recorder is not None
+
+
+def enable(attach_to_items: bool = False) -> Recorder:
+    """
+    Start recording into a fresh recorder. With `attach_to_items`, instrumented
+    widget actions append their span to `WorkItem.parameters['cost']`.
+    """
+    global _recorder
+    _recorder = Recorder(attach_to_items=attach_to_items)
+    return _recorder
+
+
+def disable() -> Recorder | None:
+    """Stop recording and return the recorder holding the recorded spans."""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def current() -> Recorder | None:
+    return _recorder
+
+
+@contextlib.contextmanager
+def recording(attach_to_items: bool = False) -> Iterator[Recorder]:
+    """Record all spans of the enclosed block, restoring the previous state afterwards."""
+    global _recorder
+    previous = _recorder
+    recorder = enable(attach_to_items=attach_to_items)
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+
+
+def attach(item, finished: Span | _NullSpan) -> None:
+    """Append the cost record of a finished span to the parameters of a work item."""
+    if _recorder is None or not _recorder.attach_to_items or isinstance(finished, _NullSpan):
+        return
+    item.parameters.setdefault('cost', []).append(finished.as_dict())
@@ -1,4 +1,41 @@
-from .dataselector import DatasetSelectorWidget
-from .roiselector import SynchronizedRectangleSelector, extract_roi
-from .rotations import RotationWidget
+"""
+Processing pipeline: headless compute functions and interactive widgets.
 
+The public names below are imported on first access, so scripts and worker
+processes that only use the compute modules (e.g. `woodtools.pipeline.roi`
+or `woodtools.pipeline.pathing`) do not load the GUI stack or torch.
+
+@Author: Jannik Stebani
+"""
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .dataselector import DatasetSelectorWidget
+    from .roi import extract_roi
+    from .roiselector import SynchronizedRectangleSelector
+    from .rotationselector import RotationWidget
+
+
+_LAZY_ATTRIBUTES: dict[str, str] = {
+    'DatasetSelectorWidget': '.dataselector',
+    'SynchronizedRectangleSelector': '.roiselector',
+    'extract_roi': '.roi',
+    'RotationWidget': '.rotationselector',
+}
+
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name: str):
+    try:
+        module = _LAZY_ATTRIBUTES[name]
+    except KeyError:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}') from None
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__() -> list[str]:
+    return sorted({*globals(), *__all__})
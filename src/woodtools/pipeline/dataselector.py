@@ -1,12 +1,20 @@
+import functools
 from pathlib import Path
 from typing import Sequence
 
 import ipywidgets as widgets
+import numpy as np
 import zarr
 
 from IPython.display import display
 
+from woodtools import instrumentation
+from woodtools.dataloading import read_levels, select_level
+from woodtools.dataloading.statistics import display_window, intensity_statistics
+from woodtools.pipeline.cache import ByteLRUCache
+from woodtools.pipeline.jobs import Job, JobRunner
 from woodtools.pipeline.state import WorkItem, StateManager
+from woodtools.pipeline.storage import iter_slabs, slab_depth
 
 
 class DatasetSelectorWidget:
@@ -21,16 +29,40 @@ class DatasetSelectorWidget:
         basepath: Path,
         classes: Sequence[str] = ('acer', 'pinus'),
         subidentifiers: Sequence[str] = ('center', 'left', 'right', 'upper', 'lower'),
+        preview_size: int | None = 512,
+        cache_bytes: int = 8 * 2**30,
+        runner: JobRunner | None = None,
+        window_percentiles: tuple[float, float] | None = (1.0, 99.0)
     ) -> None:
-        
+        """
+        Widget to select and load a dataset into the state manager.
+
+        If the store holds a pyramid and `preview_size` is set, the cheapest
+        level with an in-plane size of at least `preview_size` is shown right away
+        and the full-resolution 'metric/raw' volume is only read once an operation
+        materializes the work item. Read volumes are kept in an LRU cache bounded
+        by `cache_bytes`, so switching back to a recent dataset is instant.
+        With a `runner`, loading happens in the background with progress and
+        cancellation; a new load cancels a still running one.
+        Loaded items carry a display window (`parameters['window']`) between the
+        `window_percentiles` of the intensity statistics, which are cached in the
+        store attributes. Set `window_percentiles` to None to skip this.
+        """
         self.state_manager = state_manager
         self.classes = classes
         self.subidentifiers = subidentifiers
         self.basepath = basepath
+        self.preview_size = preview_size
+        self.cache = ByteLRUCache(cache_bytes)
+        self.runner = runner
+        self.window_percentiles = window_percentiles
         
         self.class_selector = widgets.Dropdown(options=self.classes, desc='Class Selection')
         self.subid_selector = widgets.Dropdown(options=self.subidentifiers, desc='Sub ID Selection')
         self.load_button = widgets.Button(description='Load', icon='database')
+        self.progress_bar = widgets.FloatProgress(value=0.0, min=0.0, max=1.0)
+        self.status_label = widgets.Label()
+        self.cancel_button = widgets.Button(description='Cancel', icon='stop')
         
         self.setup_widgets()
 
@@ -39,18 +71,91 @@ class DatasetSelectorWidget:
         return self.basepath / f'{class_}-{subidentifier}.zarr'
     
 
+    def read_array(self, path: Path, name: str, job: Job | None = None) -> np.ndarray:
+        """
+        Read the full array from the store, served from the cache if possible.
+        Reads slab-wise so that a job can report progress and be cancelled.
+        """
+        key = (str(path), name)
+        volume = self.cache.get(key)
+        if volume is None:
+            data = zarr.open(path, mode='r')[name]
+            volume = np.empty(data.shape, dtype=data.dtype)
+            depth = slab_depth(data)
+            with instrumentation.span('widget.read', array=name, bytes_read=volume.nbytes):
+                for slab in iter_slabs(data.shape[-3], depth):
+                    if job is not None:
+                        job.check()
+                        job.report(slab.start / data.shape[-3])
+                    volume[..., slab, :, :] = data[..., slab, :, :]
+            # cached volumes are shared between work items: copy-on-write only
+            volume.flags.writeable = False
+            self.cache.put(key, volume)
+        return volume
+
+
+    def build_item(self, job: Job | None, path: Path, ID: str) -> WorkItem:
+        with instrumentation.span('widget.load', path=str(path)) as span:
+            item = self._build_item(job, path, ID)
+            if self.window_percentiles is not None:
+                name = item.parameters.get('preview', {}).get('array', 'metric/raw')
+                statistics = intensity_statistics(path, name, data=item.volume)
+                vmin, vmax = display_window(statistics, *self.window_percentiles)
+                item.parameters['window'] = {'vmin': vmin, 'vmax': vmax}
+        instrumentation.attach(item, span)
+        return item
+
+
+    def _build_item(self, job: Job | None, path: Path, ID: str) -> WorkItem:
+        full_key = (str(path), 'metric/raw')
+
+        level = None
+        if self.preview_size is not None and full_key not in self.cache:
+            zarrfile = zarr.open(path, mode='r')
+            level = select_level(zarrfile, self.preview_size)
+
+        if level is None or level == 'metric/raw':
+            return WorkItem(ID=ID, volume=self.read_array(path, 'metric/raw', job))
+        factor = next(lvl['factor'] for lvl in read_levels(zarrfile) if lvl['path'] == level)
+        return WorkItem(
+            ID=ID,
+            volume=self.read_array(path, level, job),
+            parameters={'preview': {'array': level, 'factor': factor}},
+            loader=functools.partial(self.read_array, path, 'metric/raw')
+        )
+
+
     def load_file(self, *args, **kwargs):
         path = self.build_path(self.class_selector.value, self.subid_selector.value)
-        # This is evil global variable stuff >:[]
-        zarrfile = zarr.open(path, mode='r')
-        volume = zarrfile['metric/raw'][...]
         ID = f'{self.class_selector.value}-{self.subid_selector.value}'
+        if self.runner is not None:
+            self.runner.submit('load', self.build_item, path, ID, on_progress=self.show_progress,
+                               on_error=self.show_error)
+            return
+        self.state_manager.update(self.build_item(None, path, ID))
+
+
+    def show_progress(self, job: Job) -> None:
+        self.progress_bar.bar_style = ''
+        self.status_label.value = ''
+        self.progress_bar.value = job.progress
+
+
+    def show_error(self, job: Job, error: BaseException) -> None:
+        """Mark the failed job in the progress area instead of failing silently."""
+        self.progress_bar.bar_style = 'danger'
+        self.status_label.value = f'{job.key} failed: {type(error).__name__}: {error}'
+
 
-        work_item = WorkItem(ID=ID, volume=volume)
-        self.state_manager.update(work_item)
+    def cancel(self, *args, **kwargs):
+        if self.runner is not None:
+            self.runner.cancel('load')
 
 
     def setup_widgets(self):
         self.load_button.on_click(self.load_file)
-        display(widgets.HBox([self.class_selector, self.subid_selector, self.load_button]))
-    
\ No newline at end of file
+        children = [self.class_selector, self.subid_selector, self.load_button]
+        if self.runner is not None:
+            self.cancel_button.on_click(self.cancel)
+            children.extend([self.progress_bar, self.cancel_button, self.status_label])
+        display(widgets.HBox(children))
@@ -0,0 +1,163 @@
+"""
+Run heavy widget actions in the background with progress reporting and cancellation.
+
+@Author: Jannik Stebani
+"""
+import threading
+import warnings
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from woodtools.pipeline.state import StateManager, WorkItem
+
+
+class JobCancelled(Exception):
+    """Raised inside a job function when the job was cancelled or superseded."""
+
+
+class Job:
+    """
+    Handle passed to job functions. Long-running functions call `check` between
+    units of work to honour cancellation and `report` to publish progress.
+    """
+    def __init__(
+        self,
+        key: str = '',
+        on_progress: Callable[['Job'], None] | None = None
+    ) -> None:
+        self.key = key
+        self.progress = 0.0
+        self.error: BaseException | None = None
+        self.future: Future | None = None
+        self.on_progress = on_progress
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self) -> None:
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise JobCancelled(f'job \'{self.key}\' was cancelled')
+
+    def report(self, progress: float) -> None:
+        self.progress = progress
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+
+def warn_error(job: Job, error: BaseException) -> None:
+    """Default error handler: surface the failure of a background job as a warning."""
+    warnings.warn(f'job \'{job.key}\' failed: {type(error).__name__}: {error}', RuntimeWarning)
+
+
+class JobRunner:
+    """
+    Execute job functions on a worker pool and apply their resulting `WorkItem`
+    to the state manager on completion.
+
+    Submitting a job under a key that is still running cancels the stale job,
+    whose result is then discarded. A failing job leaves the state unchanged,
+    stores the exception as `job.error` and passes it to the error handler
+    (default: `warn_error`).
+
+    Notes
+    -----
+
+    Completion runs on the worker thread: `state_manager.update` and therefore
+    all observer callbacks (e.g. figure redraws and widget updates) as well as
+    the progress and error callbacks are called from there. ipywidgets traits
+    and `draw_idle` on matplotlib canvases tolerate this; observers that are
+    not thread-safe have to hand the work over to the kernel thread themselves.
+    """
+    def __init__(
+        self,
+        state_manager: StateManager,
+        workers: int = 1,
+        on_progress: Callable[[Job], None] | None = None,
+        on_error: Callable[[Job, BaseException], None] | None = warn_error
+    ) -> None:
+        self.state_manager = state_manager
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.jobs: dict[str, Job] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.RLock()
+
+    def submit(
+        self,
+        key: str,
+        fn: Callable[..., WorkItem],
+        *args,
+        on_progress: Callable[[Job], None] | None = None,
+        on_error: Callable[[Job, BaseException], None] | None = None,
+        **kwargs
+    ) -> Job:
+        """
+        Run `fn(job, *args, **kwargs)` in the background. The returned work item
+        replaces the current state item unless the job was cancelled meanwhile.
+        Progress and errors are reported to `on_progress` and `on_error`
+        or the runner-wide callbacks.
+        """
+        job = Job(key, on_progress=on_progress or self.on_progress)
+        on_error = on_error or self.on_error
+        with self._lock:
+            previous = self.jobs.get(key)
+            if previous is not None:
+                previous.cancel()
+            self.jobs[key] = job
+            job.future = self._executor.submit(self._run, job, fn, args, kwargs, on_error)
+        return job
+
+    def _run(
+        self,
+        job: Job,
+        fn: Callable[..., WorkItem],
+        args: tuple,
+        kwargs: dict,
+        on_error: Callable[[Job, BaseException], None] | None
+    ) -> None:
+        try:
+            result = fn(job, *args, **kwargs)
+        except JobCancelled:
+            self._deregister(job)
+            return
+        except BaseException as error:
+            self._deregister(job)
+            job.error = error
+            if on_error is None:
+                # only visible via `job.future.exception()`
+                raise
+            on_error(job, error)
+            return
+        with self._lock:
+            # deregistration, cancellation check and update form one critical section:
+            # a concurrent `cancel` or superseding `submit` either happens before
+            # (and the result is discarded) or finds the job already finished
+            self._deregister(job)
+            if job.cancelled:
+                return
+            self.state_manager.update(result)
+        job.report(1.0)
+
+    def _deregister(self, job: Job) -> None:
+        with self._lock:
+            if self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+
+    def cancel(self, key: str) -> None:
+        with self._lock:
+            job = self.jobs.get(key)
+        if job is not None:
+            job.cancel()
+
+    def shutdown(self) -> None:
+        with self._lock:
+            for job in self.jobs.values():
+                job.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,276 @@
+"""
+Lazy, chunk-wise evaluated chains of volume operations.
+
+Chaining `downsample`, in-plane `rotate`, ROI `crop` and `astype` on a
+`LazyArray` only builds an expression graph. Evaluation walks the output
+chunk grid and pulls every chunk through the graph: each node requests the
+source region its output region depends on from its parent, so no full-size
+intermediate is ever materialized and the working memory is proportional to
+the chunk size. Chunks are evaluated on a thread or process pool and written
+to a zarr target or an in-memory result.
+
+    volume = from_zarr(path, 'metric/raw')
+    chain = volume.rotate(12.5).crop(roispec).downsample(512).astype(np.uint8)
+    chain.to_zarr(target, 'downsampled/sam-native', workers=8)
+
+@Author: Jannik Stebani
+"""
+import functools
+import itertools
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+import zarr
+
+from woodtools import instrumentation
+from woodtools.pipeline.parallel import run_processes, run_threaded
+from woodtools.pipeline.roi import roi_slices
+from woodtools.pipeline.storage import create_array, default_chunks, iter_slabs, Codec
+from woodtools.pipeline.transforms import (
+    block_mean, _integer_factors, _linear_source_indices, _restore_dtype, _target_size
+)
+
+
+Region = tuple[slice, slice, slice]
+
+
+class LazyArray:
+    """
+    Node of a lazy expression graph over a (... x D x H x W) volume.
+    Leading axes are carried along; regions address the trailing (D, H, W) axes.
+    """
+    shape: tuple[int, ...]
+    dtype: np.dtype
+
+    @property
+    def ndim(self) -> int:
+        return len(self.shape)
+
+    @property
+    def nbytes(self) -> int:
+        return int(np.prod(self.shape)) * self.dtype.itemsize
+
+    @property
+    def chunks(self) -> tuple[int, ...]:
+        """Preferred evaluation chunk shape."""
+        return default_chunks(self.shape)
+
+    def region(self, zslice: slice, yslice: slice, xslice: slice) -> np.ndarray:
+        """Evaluate the region given by (resolved, non-negative) slices of the trailing axes."""
+        raise NotImplementedError
+
+    def downsample(self, in_plane_target: int) -> 'LazyArray':
+        return Downsampled(self, in_plane_target)
+
+    def rotate(self, angle: float, mode: str = 'bilinear') -> 'LazyArray':
+        return Rotated(self, angle, mode)
+
+    def crop(self, roispec: dict[str, Sequence[float]]) -> 'LazyArray':
+        return Cropped(self, roi_slices(roispec))
+
+    def astype(self, dtype: np.dtype) -> 'LazyArray':
+        return Cast(self, dtype)
+
+    def blocks(self, chunks: Sequence[int] | None = None) -> list[Region]:
+        """Regions of the chunk grid over the trailing axes."""
+        chunks = chunks or self.chunks
+        return list(itertools.product(
+            *(iter_slabs(size, depth) for size, depth in zip(self.shape[-3:], chunks[-3:]))
+        ))
+
+    def compute(
+        self,
+        chunks: Sequence[int] | None = None,
+        workers: int | None = None,
+        processes: bool = False,
+        progress: bool = False
+    ) -> np.ndarray:
+        """
+        Evaluate the graph into an in-memory array, chunk by chunk, on a thread pool
+        or (with `processes`) on a pool of spawned processes.
+        """
+        result = np.empty(self.shape, dtype=self.dtype)
+
+        def store(block: Region, data: np.ndarray) -> None:
+            result[(..., *block)] = data
+
+        if processes:
+            run_processes(functools.partial(_evaluate_block, self), self.blocks(chunks),
+                          workers=workers, progress=progress, unit='chunk', callback=store)
+        else:
+            run_threaded(lambda block: store(block, _evaluate_block(self, block)),
+                         self.blocks(chunks), workers=workers, progress=progress, unit='chunk')
+        return result
+
+    def to_zarr(
+        self,
+        target: Path | zarr.Group,
+        name: str,
+        chunks: tuple[int, ...] | None = None,
+        codec: Codec | None = None,
+        workers: int | None = None,
+        processes: bool = False,
+        progress: bool = False
+    ) -> zarr.Array:
+        """
+        Evaluate the graph into the new array `name` of the target store.
+        Every output chunk is evaluated and written by exactly one worker.
+        """
+        array = create_array(target, name, self.shape, self.dtype,
+                             chunks=chunks or self.chunks, codec=codec)
+        with instrumentation.span('lazy.to_zarr', array=name, nbytes=self.nbytes):
+            run = run_processes if processes else run_threaded
+            run(functools.partial(_store_block, self, array), self.blocks(array.chunks),
+                workers=workers, progress=progress, unit='chunk')
+        return array
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        result = self.compute()
+        return result if dtype is None else result.astype(dtype, copy=False)
+
+    def __repr__(self) -> str:
+        return f'{type(self).__name__}(shape={self.shape}, dtype={self.dtype})'
+
+
+def _evaluate_block(node: LazyArray, block: Region) -> np.ndarray:
+    with instrumentation.span('lazy.block') as span:
+        data = node.region(*block)
+        span.add(bytes_written=data.nbytes)
+    return data
+
+
+def _store_block(node: LazyArray, array: zarr.Array, block: Region) -> None:
+    array[(..., *block)] = _evaluate_block(node, block)
+
+
+class Source(LazyArray):
+    """Leaf node reading regions from a zarr or in-memory array."""
+    def __init__(self, data: zarr.Array | np.ndarray) -> None:
+        if data.ndim < 3:
+            raise ValueError(f'expecting (... x D x H x W) volumes, got {data.ndim}D')
+        self.data = data
+        self.shape = tuple(data.shape)
+        self.dtype = np.dtype(data.dtype)
+
+    @property
+    def chunks(self) -> tuple[int, ...]:
+        chunks = getattr(self.data, 'chunks', None)
+        return tuple(chunks) if chunks is not None else default_chunks(self.shape)
+
+    def region(self, zslice: slice, yslice: slice, xslice: slice) -> np.ndarray:
+        with instrumentation.span('lazy.read') as span:
+            data = np.asarray(self.data[..., zslice, yslice, xslice])
+            span.add(bytes_read=data.nbytes)
+        return data
+
+
+class Downsampled(LazyArray):
+    """
+    Downsampling as in `woodtools.pipeline.transforms.downsample`: block mean for
+    integer reduction factors, trilinear interpolation in float32 otherwise.
+    """
+    def __init__(self, parent: LazyArray, in_plane_target: int) -> None:
+        self.parent = parent
+        self.in_plane_target = in_plane_target
+        self.target_size = _target_size(parent.shape, in_plane_target)
+        self.factors = _integer_factors(parent.shape, self.target_size)
+        self.shape = (*parent.shape[:-3], *self.target_size)
+        self.dtype = parent.dtype
+
+    def region(self, zslice: slice, yslice: slice, xslice: slice) -> np.ndarray:
+        out_slices = (zslice, yslice, xslice)
+        if self.factors is not None:
+            source = self.parent.region(*(
+                slice(out.start * factor, out.stop * factor)
+                for out, factor in zip(out_slices, self.factors)
+            ))
+            return block_mean(source, self.factors)
+
+        # trilinear interpolation is separable: linear interpolation along each axis
+        indices = [
+            _linear_source_indices(np.arange(out.start, out.stop), in_size, out_size)
+            for out, in_size, out_size in zip(out_slices, self.parent.shape[-3:], self.target_size)
+        ]
+        starts = [lower.min() for lower, _, _ in indices]
+        source = self.parent.region(*(
+            slice(start, upper.max() + 1) for start, (_, upper, _) in zip(starts, indices)
+        ))
+        result = source.astype(np.float32)
+        for axis, start, (lower, upper, weights) in zip((-3, -2, -1), starts, indices):
+            shape = [1] * result.ndim
+            shape[axis] = -1
+            weights = weights.astype(np.float32).reshape(shape)
+            result = ((1 - weights) * np.take(result, lower - start, axis=axis)
+                      + weights * np.take(result, upper - start, axis=axis))
+        return _restore_dtype(result, self.dtype)
+
+
+class Rotated(LazyArray):
+    """
+    In-plane rotation as in `woodtools.pipeline.rotations.rotate_slab`. An output
+    region only reads the bounding box of its source pixels.
+    """
+    def __init__(self, parent: LazyArray, angle: float, mode: str = 'bilinear') -> None:
+        self.parent = parent
+        self.angle = angle
+        # kept by value: building the graph does not import torchvision
+        self.mode = mode if isinstance(mode, str) else mode.value
+        self.shape = parent.shape
+        self.dtype = parent.dtype
+
+    def region(self, zslice: slice, yslice: slice, xslice: slice) -> np.ndarray:
+        from woodtools.pipeline.rotations import (
+            interpolation_mode, resample_rotated, source_bounding_box
+        )
+        shape = self.parent.shape[-2:]
+        box = source_bounding_box(yslice, xslice, self.angle, shape)
+        if box is None:
+            return np.zeros(
+                (*self.shape[:-3], zslice.stop - zslice.start,
+                 yslice.stop - yslice.start, xslice.stop - xslice.start),
+                dtype=self.dtype
+            )
+        crop = self.parent.region(zslice, *box)
+        return resample_rotated(crop, box, yslice, xslice, self.angle,
+                                interpolation_mode(self.mode), shape)
+
+
+class Cropped(LazyArray):
+    """Region of interest given by (z, y, x) slices, see `woodtools.pipeline.roi.roi_slices`."""
+    def __init__(self, parent: LazyArray, slices: Region) -> None:
+        self.parent = parent
+        self.offsets = tuple(
+            slice(*roi.indices(size)[:2]) for roi, size in zip(slices, parent.shape[-3:])
+        )
+        self.shape = (*parent.shape[:-3],
+                      *(max(0, offset.stop - offset.start) for offset in self.offsets))
+        self.dtype = parent.dtype
+
+    def region(self, zslice: slice, yslice: slice, xslice: slice) -> np.ndarray:
+        return self.parent.region(*(
+            slice(offset.start + out.start, offset.start + out.stop)
+            for offset, out in zip(self.offsets, (zslice, yslice, xslice))
+        ))
+
+
+class Cast(LazyArray):
+    """Element-wise dtype conversion with the semantics of `numpy.ndarray.astype`."""
+    def __init__(self, parent: LazyArray, dtype: np.dtype) -> None:
+        self.parent = parent
+        self.shape = parent.shape
+        self.dtype = np.dtype(dtype)
+
+    def region(self, zslice: slice, yslice: slice, xslice: slice) -> np.ndarray:
+        return self.parent.region(zslice, yslice, xslice).astype(self.dtype, copy=False)
+
+
+def from_array(data: zarr.Array | np.ndarray) -> LazyArray:
+    """Lazy view of a zarr or in-memory (... x D x H x W) array."""
+    return Source(data)
+
+
+def from_zarr(source: Path | zarr.Group, name: str = 'metric/raw') -> LazyArray:
+    """Lazy view of the array `name` of the zarr store, opened read-only."""
+    group = source if isinstance(source, zarr.Group) else zarr.open_group(source, mode='r')
+    return Source(group[name])
@@ -0,0 +1,127 @@
+"""
+Persistent, resumable record of per-dataset job status for bulk operations.
+
+@Author: Jannik Stebani
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import time
+import warnings
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import tqdm
+
+from woodtools import instrumentation
+
+PENDING: str = 'pending'
+RUNNING: str = 'running'
+DONE: str = 'done'
+FAILED: str = 'failed'
+SKIPPED: str = 'skipped'
+
+
+class Manifest:
+    """
+    JSON file mapping dataset names to status, timings and result information.
+    Every change is written through atomically, so the file always reflects the
+    last finished state change, even after a crash of the controlling process.
+    """
+    def __init__(self, path: Path) -> None:
+        self.path = Path(path)
+        self.entries: dict[str, dict] = {}
+        if self.path.exists():
+            with open(self.path) as handle:
+                self.entries = json.load(handle).get('entries', {})
+
+    def status(self, name: str) -> str | None:
+        return self.entries.get(name, {}).get('status')
+
+    def mark(self, name: str, status: str, **fields) -> dict:
+        """Set the status of the dataset, merge in the fields and persist."""
+        entry = self.entries.setdefault(name, {})
+        entry.update(fields)
+        entry['status'] = status
+        entry['updated'] = time.time()
+        self.write()
+        return entry
+
+    def summary(self) -> dict:
+        """Machine-readable run summary: counts per status, total work time and all entries."""
+        counts: dict[str, int] = {}
+        for entry in self.entries.values():
+            counts[entry['status']] = counts.get(entry['status'], 0) + 1
+        duration = sum(entry.get('duration', 0.0) for entry in self.entries.values())
+        return {'counts': counts, 'duration': duration, 'entries': self.entries}
+
+    def write(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        with open(tmp_path, mode='w') as handle:
+            json.dump({'entries': self.entries}, handle, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _limit_memory(memory_limit: int | None) -> None:
+    """Process pool initializer: cap the data segment of the worker process."""
+    if memory_limit is None:
+        return
+    try:
+        import resource
+    except ImportError:
+        warnings.warn('per-worker memory limit is unsupported on this platform')
+        return
+    resource.setrlimit(resource.RLIMIT_DATA, (memory_limit, memory_limit))
+
+
+def run_tasks(
+    manifest: Manifest,
+    tasks: dict[str, tuple[Callable[..., dict], tuple, Path]],
+    workers: int = 1,
+    memory_limit: int | None = None
+) -> dict:
+    """
+    Execute per-dataset tasks on a pool of spawned worker processes and record
+    their outcome in the manifest.
+
+    Every task is a `(function, args, target)` triple. The function must be
+    importable (picklable) and return a JSON-serializable dict that is merged
+    into the manifest entry. The partial target of a failed task is removed.
+    Instrumentation spans returned under 'spans' are merged into the active
+    recorder instead of the manifest.
+
+    Returns
+    -------
+
+    summary : dict
+        The manifest summary after all tasks finished.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=_limit_memory, initargs=(memory_limit,)) as executor:
+        futures = {}
+        for dataset, (fn, args, _) in tasks.items():
+            future = executor.submit(fn, *args)
+            futures[future] = dataset
+            manifest.mark(dataset, RUNNING, started=time.time())
+
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures), unit='dset'):
+            dataset = futures[future]
+            try:
+                result = future.result()
+            except Exception as error:
+                target = tasks[dataset][2]
+                if target.exists():
+                    shutil.rmtree(target)
+                manifest.mark(dataset, FAILED, finished=time.time(),
+                              error=f'{type(error).__name__}: {error}')
+                continue
+            spans = result.pop('spans', None)
+            if spans and instrumentation.is_enabled():
+                instrumentation.current().extend(spans)
+            manifest.mark(dataset, DONE, finished=time.time(), **result)
+
+    return manifest.summary()
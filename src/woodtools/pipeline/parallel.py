@@ -0,0 +1,71 @@
+"""
+Small helpers to run per-slab work on a thread or process pool.
+
+@Author: Jannik Stebani
+"""
+import multiprocessing
+from collections.abc import Callable, Iterable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import tqdm
+
+
+def run_threaded(
+    fn: Callable,
+    items: Iterable,
+    workers: int | None = None,
+    progress: bool = True,
+    unit: str = 'it'
+) -> list:
+    """
+    Apply `fn` to every item on a thread pool and collect the results
+    in input order. The first exception raised by any worker cancels all
+    pending work and is re-raised in the calling thread.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return _collect(executor, fn, items, progress, unit)
+
+
+def run_processes(
+    fn: Callable,
+    items: Iterable,
+    workers: int | None = None,
+    progress: bool = True,
+    unit: str = 'it',
+    callback: Callable | None = None
+) -> list:
+    """
+    Like `run_threaded`, but on a pool of spawned worker processes.
+    `fn`, the items and the results must be picklable.
+    If given, `callback(item, result)` consumes every result in the calling
+    process as soon as it arrives, instead of collecting it.
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        return _collect(executor, fn, items, progress, unit, callback)
+
+
+def _collect(
+    executor: Executor,
+    fn: Callable,
+    items: Iterable,
+    progress: bool,
+    unit: str,
+    callback: Callable | None = None
+) -> list:
+    items = list(items)
+    results = [None] * len(items)
+    futures = {executor.submit(fn, item): index for index, item in enumerate(items)}
+    try:
+        for future in tqdm.tqdm(as_completed(futures), total=len(futures),
+                                unit=unit, disable=not progress):
+            index = futures.pop(future)
+            if callback is None:
+                results[index] = future.result()
+            else:
+                callback(items[index], future.result())
+    except BaseException:
+        for future in futures:
+            future.cancel()
+        raise
+    return results
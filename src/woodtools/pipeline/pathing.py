@@ -1,12 +1,27 @@
+import functools
+import hashlib
+import io
+import json
+import os
 from collections import OrderedDict
-from collections.abc import Callable, Sequence
+from collections.abc import Callable, Iterable, Iterator, Sequence
 from pathlib import Path
 
+import attrs
 import numpy as np
 import skimage.io
+import tifffile
+import zarr
+
+from woodtools.pipeline.parallel import run_threaded
+from woodtools.pipeline.storage import create_array, default_chunks, iter_slabs, slab_depth, Codec
+
+TIFF_SUFFIXES: tuple[str, ...] = ('.tif', '.tiff')
+INDEX_VERSION: int = 1
+
 
 def generate_path_mapping(
-    paths: Sequence[Path],
+    paths: Iterable[Path],
     match_fun: Callable[[str], tuple[bool, int | None]]
 ) -> OrderedDict[int, Path]:
     path_mapping = OrderedDict()
@@ -18,10 +33,342 @@ def generate_path_mapping(
     return path_mapping
 
 
+def scan_directory(
+    directory: Path,
+    match_fun: Callable[[str], tuple[bool, int | None]],
+    suffixes: Sequence[str] = TIFF_SUFFIXES
+) -> Iterator[tuple[int, Path]]:
+    """
+    Stream `(ID, path)` pairs of the matching files inside the directory.
+    Uses `os.scandir` so that no full listing is materialized and
+    no additional `stat` calls are issued on most filesystems.
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            stem, suffix = os.path.splitext(entry.name)
+            if suffixes and suffix.lower() not in suffixes:
+                continue
+            if not entry.is_file():
+                continue
+            is_match, ID = match_fun(stem)
+            if is_match:
+                yield ID, Path(entry.path)
+
+
+@attrs.define
+class SliceIndex:
+    """
+    Result of a directory scan: the index-ordered path mapping plus
+    missing indices (gaps) and indices claimed by multiple files.
+    """
+    mapping: OrderedDict[int, Path]
+    gaps: list[int] = attrs.field(factory=list)
+    duplicates: dict[int, list[Path]] = attrs.field(factory=dict)
+
+    @property
+    def is_complete(self) -> bool:
+        return not self.gaps and not self.duplicates
+
+
+def _matcher_key(match_fun: Callable) -> str | None:
+    """
+    Process-independent identification of a (possibly partial) matcher function.
+    None for lambdas and local closures: their name does not identify their behaviour.
+    """
+    if isinstance(match_fun, functools.partial):
+        inner = _matcher_key(match_fun.func)
+        if inner is None:
+            return None
+        kwargs = sorted(match_fun.keywords.items())
+        return f'{inner}{match_fun.args}{kwargs}'
+    qualname = getattr(match_fun, '__qualname__', None)
+    if qualname is None or '<lambda>' in qualname or '<locals>' in qualname:
+        return None
+    return f'{match_fun.__module__}.{qualname}'
+
+
+def default_index_path(directory: Path) -> Path:
+    """
+    Location of the on-disk index for the directory. Lives in the user cache
+    directory so that writing it does not modify the mtime of the indexed directory.
+    """
+    cachedir = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache'))
+    digest = hashlib.sha1(str(Path(directory).resolve()).encode()).hexdigest()
+    return cachedir / 'woodtools' / 'index' / f'{digest}.json'
+
+
+def _load_index(index_path: Path, key: str, mtime_ns: int) -> dict | None:
+    try:
+        with open(index_path) as handle:
+            content = json.load(handle)
+    except (OSError, ValueError):
+        return None
+    if (content.get('version') != INDEX_VERSION or content.get('key') != key
+            or content.get('mtime_ns') != mtime_ns):
+        return None
+    return content
+
+
+def _store_index(index_path: Path, content: dict) -> None:
+    try:
+        index_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = index_path.with_suffix('.tmp')
+        with open(tmp_path, mode='w') as handle:
+            json.dump(content, handle)
+        os.replace(tmp_path, index_path)
+    except OSError:
+        # the index is an optimization: unwritable cache locations are not an error
+        pass
+
+
+def index_directory(
+    directory: Path,
+    match_fun: Callable[[str], tuple[bool, int | None]],
+    suffixes: Sequence[str] = TIFF_SUFFIXES,
+    index_path: Path | None = None,
+    use_index: bool = True,
+    strict: bool = False,
+    key: str | None = None
+) -> SliceIndex:
+    """
+    Discover the slice files of a directory.
+
+    The scan result is persisted as a small JSON index that is validated
+    against the directory mtime, so re-scanning an unchanged directory only
+    costs a single `stat` call.
+
+    Parameters
+    ----------
+
+    directory : Path
+        Directory containing the slice files.
+
+    match_fun : Callable
+        Matcher from `woodtools.dataloading.regex`, e.g. bound via `functools.partial`.
+
+    suffixes : Sequence[str], optional
+        Accepted lowercase file suffixes. Empty sequence accepts all files.
+
+    index_path : Path, optional
+        Location of the on-disk index. Defaults to the user cache directory.
+
+    use_index : bool, optional
+        Read and write the on-disk index. Defaults to True.
+
+    strict : bool, optional
+        Raise a `ValueError` on gaps or duplicate slice indices.
+
+    key : str, optional
+        Identification of the matcher for the on-disk index. Derived from the
+        matcher function by default; lambdas and local closures cannot be
+        identified, so without an explicit key their scans are not persisted.
+
+    Returns
+    -------
+
+    index : SliceIndex
+    """
+    directory = Path(directory)
+    index_path = index_path or default_index_path(directory)
+    matcher_key = key if key is not None else _matcher_key(match_fun)
+    use_index = use_index and matcher_key is not None
+    key = f'{matcher_key}|{",".join(suffixes)}'
+    mtime_ns = os.stat(directory).st_mtime_ns
+
+    content = _load_index(index_path, key, mtime_ns) if use_index else None
+    if content is None:
+        entries: dict[int, list[str]] = {}
+        for ID, path in scan_directory(directory, match_fun, suffixes):
+            entries.setdefault(ID, []).append(path.name)
+        content = {
+            'version': INDEX_VERSION, 'key': key, 'mtime_ns': mtime_ns,
+            'entries': {str(ID): sorted(names) for ID, names in entries.items()}
+        }
+        if use_index:
+            _store_index(index_path, content)
+
+    entries = sorted((int(ID), names) for ID, names in content['entries'].items())
+    mapping = OrderedDict((ID, directory / names[0]) for ID, names in entries)
+    duplicates = {
+        ID: [directory / name for name in names] for ID, names in entries if len(names) > 1
+    }
+    gaps = []
+    if mapping:
+        present = set(mapping)
+        gaps = [ID for ID in range(entries[0][0], entries[-1][0]) if ID not in present]
+
+    index = SliceIndex(mapping=mapping, gaps=gaps, duplicates=duplicates)
+    if strict and not index.is_complete:
+        raise ValueError(
+            f'inconsistent slice indices in \'{directory}\': '
+            f'{len(gaps)} gaps {gaps[:5]}, {len(duplicates)} duplicates {list(duplicates)[:5]}'
+        )
+    return index
+
+
+def probe_slice(path: Path) -> tuple[tuple[int, ...], np.dtype]:
+    """Read a single slice to deduce the in-plane shape and the dtype of the stack."""
+    image = skimage.io.imread(path)
+    return image.shape, image.dtype
+
+
+def _read_slice(path: Path, shape: tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+    image = skimage.io.imread(path)
+    if image.shape != shape or image.dtype != dtype:
+        raise ValueError(
+            f'slice \'{path}\' has {image.shape}, {image.dtype}: expected {shape}, {dtype}'
+        )
+    return image
+
+
 def assemble_array(
-    path_mapping: OrderedDict
+    path_mapping: OrderedDict,
+    workers: int | None = None,
+    progress: bool = True
 ) -> np.ndarray:
-    slices = [
-        skimage.io.imread(p) for _, p in sorted(path_mapping.items())
-    ]
-    return np.stack(slices, axis=0)
\ No newline at end of file
+    """
+    Read the slices of the path mapping in index order into a single (D x H x W) array.
+    The result is preallocated from the first slice and filled by a thread pool,
+    so peak memory is the volume plus one slice per worker.
+    """
+    paths = [p for _, p in sorted(path_mapping.items())]
+    shape, dtype = probe_slice(paths[0])
+    volume = np.empty((len(paths), *shape), dtype=dtype)
+
+    def read(index: int) -> None:
+        volume[index] = _read_slice(paths[index], shape, dtype)
+
+    run_threaded(read, range(len(paths)), workers=workers, progress=progress, unit='slice')
+    return volume
+
+
+def assemble_zarr(
+    path_mapping: OrderedDict,
+    target: Path | zarr.Group,
+    name: str = 'metric/raw',
+    chunks: Sequence[int] | None = None,
+    workers: int | None = None,
+    progress: bool = True,
+    codec: Codec | None = None
+) -> zarr.Array:
+    """
+    Stream the slices of the path mapping into the zarr array `name` at `target`.
+    Every worker assembles one chunk-aligned z-slab and writes it directly,
+    so peak memory is one z-chunk slab per worker. The array is compressed
+    with `codec` (default: `woodtools.pipeline.storage.DEFAULT_CODEC`).
+    """
+    paths = [p for _, p in sorted(path_mapping.items())]
+    shape, dtype = probe_slice(paths[0])
+    full_shape = (len(paths), *shape)
+    chunks = tuple(chunks) if chunks is not None else default_chunks(full_shape)
+    array = create_array(target, name, full_shape, dtype, chunks=chunks, codec=codec)
+
+    def write(slab: slice) -> None:
+        data = np.empty((slab.stop - slab.start, *shape), dtype=dtype)
+        for offset, path in enumerate(paths[slab]):
+            data[offset] = _read_slice(path, shape, dtype)
+        array[slab] = data
+
+    run_threaded(write, iter_slabs(len(paths), chunks[0]),
+                 workers=workers, progress=progress, unit='slab')
+    return array
+
+
+def export_filename(index: int, prefix: str = 'reko', suffix: str = '', digits: int = 5) -> str:
+    """
+    File name of the slice with the given index. The default pattern
+    'reko{suffix}_{index:05d}.tif' is parsed back by
+    `woodtools.dataloading.regex.match_reko_file` with the same suffix.
+    """
+    return f'{prefix}{suffix}_{index:0{digits}d}.tif'
+
+
+def export_tiff_stack(
+    source: Path | zarr.Group | zarr.Array,
+    directory: Path,
+    name: str = 'metric/raw',
+    prefix: str = 'reko',
+    suffix: str = '',
+    compression: str | None = 'zlib',
+    level: int | None = None,
+    start: int = 0,
+    workers: int | None = None,
+    progress: bool = True
+) -> OrderedDict[int, Path]:
+    """
+    Export the (D x H x W) array `name` (or the given array) as one TIFF file
+    per z-slice. Every worker reads one chunk-aligned z-slab and writes its
+    slices, so peak memory is one z-chunk slab per worker.
+
+    Parameters
+    ----------
+
+    source : Path, zarr.Group or zarr.Array
+        The zarr store holding the array, or the array itself.
+
+    directory : Path
+        Output directory. Existing slice files are never overwritten.
+
+    name : str, optional
+        The exported array if a store is given. Defaults to 'metric/raw'.
+
+    prefix, suffix : str, optional
+        File names are '{prefix}{suffix}_{index:05d}.tif', see `export_filename`.
+
+    compression : str, optional
+        TIFF compression as understood by `tifffile`, e.g. 'zlib' or 'lzma'.
+        Other codecs (e.g. 'zstd', 'lzw', 'packbits') need the `imagecodecs`
+        package. None writes uncompressed files. Defaults to 'zlib'.
+
+    level : int, optional
+        Compression level, codec default if not given.
+
+    start : int, optional
+        Index of the first slice in the file names. Defaults to 0.
+
+    workers : int, optional
+        Number of threads writing slabs in parallel.
+
+    Returns
+    -------
+
+    path_mapping : OrderedDict[int, Path]
+        Index to path mapping of the written files, in the format of
+        `generate_path_mapping`.
+    """
+    compressionargs = {'level': level} if level is not None and compression is not None else None
+    try:
+        # fail before writing any slice if the codec is unknown or unavailable
+        tifffile.imwrite(io.BytesIO(), np.zeros((1, 1), dtype=np.uint8),
+                         compression=compression, compressionargs=compressionargs)
+    except (KeyError, ValueError) as error:
+        raise ValueError(f'unsupported TIFF compression \'{compression}\': {error}') from error
+    if isinstance(source, zarr.Array):
+        data = source
+    else:
+        group = source if isinstance(source, zarr.Group) else zarr.open_group(source, mode='r')
+        data = group[name]
+    *lead, D, H, W = data.shape
+    if any(size != 1 for size in lead):
+        raise ValueError(f'expecting (D x H x W) arrays, got shape {data.shape}')
+
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path_mapping = OrderedDict(
+        (start + index, directory / export_filename(start + index, prefix, suffix))
+        for index in range(D)
+    )
+    for path in path_mapping.values():
+        if path.exists():
+            raise FileExistsError(f'cannot write to: \'{path}\': would overwrite existing')
+    paths = list(path_mapping.values())
+
+    def write(slab: slice) -> None:
+        block = np.asarray(data[..., slab, :, :]).reshape(-1, H, W)
+        for path, image in zip(paths[slab], block):
+            tifffile.imwrite(path, image, compression=compression,
+                             compressionargs=compressionargs)
+
+    run_threaded(write, iter_slabs(D, slab_depth(data)),
+                 workers=workers, progress=progress, unit='slab')
+    return path_mapping
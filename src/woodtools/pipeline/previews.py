@@ -0,0 +1,167 @@
+"""
+Precompute small previews of a zarr array for browsing many datasets.
+
+A single chunk-parallel pass over the z-slabs computes the maximum and mean
+intensity projections along every axis. Together with the upper, center and
+lower slices (as shown by `woodtools.plotting.ucl_figure`) they are reduced to
+thumbnails and stored in the same store, so a gallery only reads kilobytes
+per dataset.
+
+@Author: Jannik Stebani
+"""
+import threading
+from pathlib import Path
+
+import numpy as np
+import zarr
+
+from woodtools import instrumentation
+from woodtools.dataloading import PREVIEWS_ATTRIBUTE, read_previews
+from woodtools.dataloading.statistics import fingerprint
+from woodtools.pipeline.parallel import run_threaded
+from woodtools.pipeline.storage import create_array, iter_slabs, slab_depth, Codec
+from woodtools.pipeline.transforms import block_mean
+
+
+PREVIEWS_VERSION: int = 1
+AXES: dict[str, int] = {'z': -3, 'y': -2, 'x': -1}
+
+
+def thumbnail_factor(shape: tuple[int, ...], size: int) -> int:
+    """Integer reduction factor bringing the largest trailing 3D extent down to at most `size`."""
+    return max(1, -(-max(shape[-3:]) // size))
+
+
+def _thumbnail(image: np.ndarray, factor: int) -> np.ndarray:
+    """Block mean over `factor` x `factor` blocks of the trailing image plane."""
+    if factor == 1:
+        return image
+    return block_mean(image, (factor, factor))
+
+
+def compute_projections(
+    data: zarr.Array | np.ndarray,
+    workers: int | None = None,
+    progress: bool = False
+) -> dict[str, np.ndarray]:
+    """
+    Maximum and mean intensity projections of the (... x D x H x W) array along
+    every trailing axis, keyed as '{max,mean}/{z,y,x}', from a single pass over
+    chunk-aligned z-slabs. Maxima keep the source dtype, means are float32.
+    """
+    *lead, D, H, W = data.shape
+    dtype = np.dtype(data.dtype)
+    projections = {
+        'max/z': None, 'mean/z': np.zeros((*lead, H, W), dtype=np.float64),
+        'max/y': np.empty((*lead, D, W), dtype=dtype), 'mean/y': np.empty((*lead, D, W), dtype=np.float32),
+        'max/x': np.empty((*lead, D, H), dtype=dtype), 'mean/x': np.empty((*lead, D, H), dtype=np.float32),
+    }
+    # the z-projections accumulate over slabs, all others are written per slab
+    lock = threading.Lock()
+
+    def process(slab: slice) -> None:
+        with instrumentation.span('previews.read') as span:
+            block = np.asarray(data[..., slab, :, :])
+            span.add(bytes_read=block.nbytes)
+        for axis in ('y', 'x'):
+            projections[f'max/{axis}'][..., slab, :] = block.max(axis=AXES[axis])
+            projections[f'mean/{axis}'][..., slab, :] = block.mean(axis=AXES[axis], dtype=np.float64)
+        slab_max = block.max(axis=-3)
+        slab_sum = block.sum(axis=-3, dtype=np.float64)
+        with lock:
+            if projections['max/z'] is None:
+                projections['max/z'] = slab_max
+            else:
+                np.maximum(projections['max/z'], slab_max, out=projections['max/z'])
+            projections['mean/z'] += slab_sum
+
+    run_threaded(process, iter_slabs(D, slab_depth(data)),
+                 workers=workers, progress=progress, unit='slab')
+    projections['mean/z'] = (projections['mean/z'] / D).astype(np.float32)
+    return projections
+
+
+def build_previews(
+    source: Path | zarr.Group,
+    name: str = 'metric/raw',
+    group: str = 'previews',
+    size: int = 256,
+    workers: int | None = None,
+    progress: bool = False,
+    codec: Codec | None = None,
+    recompute: bool = False
+) -> dict:
+    """
+    Compute the projections and upper/center/lower slices of the array `name`
+    and store them as thumbnails under '{group}/...' in the same store.
+
+    Previews that were computed from the unchanged source array are kept,
+    outdated ones are replaced.
+
+    Parameters
+    ----------
+
+    source : Path or zarr.Group
+        The zarr store holding the source array. Previews are written to it.
+
+    name : str, optional
+        The source array. Defaults to 'metric/raw'.
+
+    group : str, optional
+        The group receiving the preview arrays.
+
+    size : int, optional
+        Largest edge of the thumbnails. All previews are reduced by the same
+        integer factor, so projections along different axes stay to scale.
+
+    workers : int, optional
+        Number of threads processing z-slabs in parallel.
+
+    codec : Codec, optional
+        Compression of the previews, see `woodtools.pipeline.storage.Codec`.
+
+    recompute : bool, optional
+        Recompute even if the previews are up to date.
+
+    Returns
+    -------
+
+    metadata : dict
+        Preview metadata (source, fingerprint, factor, slice indices and the
+        path of every preview) as written to the store attributes under the
+        'previews' key.
+    """
+    root = source if isinstance(source, zarr.Group) else zarr.open_group(source, mode='a')
+    data = root[name]
+    key = fingerprint(data)
+    metadata = read_previews(root)
+    if (not recompute and metadata is not None and key is not None
+            and metadata.get('fingerprint') == key and metadata.get('source') == name
+            and metadata.get('version') == PREVIEWS_VERSION and metadata.get('size') == size):
+        return metadata
+    if group in root:
+        del root[group]
+
+    with instrumentation.span('build_previews', array=name):
+        previews = compute_projections(data, workers=workers, progress=progress)
+        D = data.shape[-3]
+        indices = {'upper': 0, 'center': D // 2, 'lower': D - 1}
+        for position, index in indices.items():
+            previews[f'slices/{position}'] = np.asarray(data[..., index, :, :])
+
+        factor = thumbnail_factor(data.shape, size)
+        arrays = {}
+        for kind, preview in previews.items():
+            thumbnail = _thumbnail(preview, factor)
+            path = f'{group}/{kind}'
+            array = create_array(root, path, thumbnail.shape, thumbnail.dtype,
+                                 chunks=thumbnail.shape, codec=codec)
+            array[...] = thumbnail
+            arrays[kind] = path
+
+    metadata = {
+        'version': PREVIEWS_VERSION, 'source': name, 'fingerprint': key,
+        'size': size, 'factor': factor, 'indices': indices, 'arrays': arrays
+    }
+    root.attrs[PREVIEWS_ATTRIBUTE] = metadata
+    return metadata
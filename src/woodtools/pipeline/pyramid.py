@@ -0,0 +1,108 @@
+"""
+Build a multiscale pyramid of a zarr array in a single chunk-streamed pass.
+
+@Author: Jannik Stebani
+"""
+from pathlib import Path
+
+import zarr
+
+from woodtools.dataloading import PYRAMID_ATTRIBUTE
+from woodtools.pipeline.parallel import run_threaded
+from woodtools.pipeline.storage import create_array, default_chunks, iter_slabs, Codec
+from woodtools.pipeline.transforms import block_mean
+
+
+def pyramid_shapes(shape: tuple[int, ...], min_size: int) -> list[tuple[int, ...]]:
+    """
+    Shapes of the successive 2x levels. Halving stops before the largest
+    in-plane dimension would drop below `min_size`.
+    """
+    shapes = []
+    *lead, D, H, W = shape
+    while max(H, W) // 2 >= min_size:
+        D, H, W = -(-D // 2), -(-H // 2), -(-W // 2)
+        shapes.append((*lead, D, H, W))
+    return shapes
+
+
+def _halve(
+    previous: zarr.Array,
+    current: zarr.Array,
+    workers: int | None,
+    progress: bool
+) -> None:
+    """Compute `current` from `previous` by 2x2x2 block averaging, one output z-chunk at a time."""
+    depth = current.chunks[-3]
+    D = previous.shape[-3]
+
+    def process(out_slab: slice) -> None:
+        source_slab = slice(2 * out_slab.start, min(2 * out_slab.stop, D))
+        block = previous[..., source_slab, :, :]
+        current[..., out_slab, :, :] = block_mean(block, (2, 2, 2))
+
+    run_threaded(process, iter_slabs(current.shape[-3], depth),
+                 workers=workers, progress=progress, unit='slab')
+
+
+def build_pyramid(
+    source: Path | zarr.Group,
+    name: str = 'metric/raw',
+    group: str = 'multiscale',
+    min_size: int = 256,
+    workers: int | None = None,
+    progress: bool = True,
+    codec: Codec | None = None
+) -> list[dict]:
+    """
+    Build a complete 2x, 4x, 8x, ... pyramid of the array `name`.
+    Every level is computed from the previous one chunk by chunk, so the
+    full-resolution array is read exactly once.
+
+    Parameters
+    ----------
+
+    source : Path or zarr.Group
+        The zarr store holding the source array. Levels are written to it.
+
+    name : str, optional
+        The full-resolution source array. Defaults to 'metric/raw'.
+
+    group : str, optional
+        The group receiving the levels as '{group}/{factor}'.
+
+    min_size : int, optional
+        Smallest admissible largest in-plane dimension of the coarsest level.
+
+    workers : int, optional
+        Number of threads processing chunks of a level in parallel.
+
+    codec : Codec, optional
+        Compression of the levels, see `woodtools.pipeline.storage.Codec`.
+
+    Returns
+    -------
+
+    levels : list[dict]
+        Level metadata (path, factor, shape, scale) as written to the
+        store attributes under the 'multiscale' key. Levels are edge-padded
+        block means, so level pixel i covers source pixels [i * factor, (i + 1) * factor)
+        along every axis, also for odd sizes.
+    """
+    root = source if isinstance(source, zarr.Group) else zarr.open_group(source, mode='a')
+    previous = root[name]
+    levels = [{'path': name, 'factor': 1, 'shape': list(previous.shape), 'scale': [1, 1, 1]}]
+    for shape in pyramid_shapes(previous.shape, min_size):
+        factor = 2 * levels[-1]['factor']
+        path = f'{group}/{factor}'
+        current = create_array(root, path, shape, previous.dtype,
+                               chunks=default_chunks(shape), codec=codec)
+        _halve(previous, current, workers=workers, progress=progress)
+        current.attrs['factor'] = factor
+        current.attrs['source'] = name
+        levels.append(
+            {'path': path, 'factor': factor, 'shape': list(shape), 'scale': [factor] * 3}
+        )
+        previous = current
+    root.attrs[PYRAMID_ATTRIBUTE] = {'source': name, 'levels': levels}
+    return levels
@@ -0,0 +1,251 @@
+"""
+Headless replay of the decisions recorded in `WorkItem.parameters` by the widgets.
+
+The interactive session records an in-plane rotation ('rotation' with angle
+and mode) and a region of interest ('roi' with corner points and optional
+'z_range') per dataset. The replay applies load -> rotate -> crop -> downsample
+to the full-resolution data, streamed slab-wise and datasets in parallel.
+The downsampling is not an interactive decision: unless given explicitly, it
+is derived from the 'downsampled/sam-native' array of the source store, which
+records the `in_plane_target` it was computed with.
+
+@Author: Jannik Stebani
+"""
+import json
+import shutil
+import time
+from pathlib import Path
+
+from typing import TYPE_CHECKING
+
+import numpy as np
+import zarr
+
+from woodtools.pipeline.manifest import (
+    Manifest, run_tasks, PENDING, RUNNING, DONE, FAILED, SKIPPED
+)
+from woodtools.pipeline.parallel import run_threaded
+from woodtools.pipeline.roi import resolve_box, roi_slices
+from woodtools.pipeline.rotations import interpolation_mode, rotate_slab, rotate_zarr
+from woodtools.pipeline.state import WorkItem
+from woodtools.pipeline.storage import create_array, default_chunks, iter_slabs, Codec
+from woodtools.pipeline.transforms import downsample_zarr_streaming
+
+if TYPE_CHECKING:
+    from torchvision.transforms import InterpolationMode
+
+
+def save_parameters(item: WorkItem, directory: Path) -> Path:
+    """Write the recorded parameters of the work item to '{ID}.json' in the directory."""
+    directory.mkdir(parents=True, exist_ok=True)
+    parameters = {key: value for key, value in item.parameters.items() if key != 'preview'}
+    path = directory / f'{item.ID}.json'
+    with open(path, mode='w') as handle:
+        json.dump(parameters, handle, indent=2)
+    return path
+
+
+def load_parameters(path: Path) -> dict:
+    with open(path) as handle:
+        return json.load(handle)
+
+
+def parse_mode(mode: str) -> 'InterpolationMode':
+    """
+    Parse interpolation modes given by value ('bilinear') or as recorded
+    by the rotation widget ('InterpolationMode.BILINEAR').
+    """
+    from torchvision.transforms import InterpolationMode
+
+    if mode.startswith('InterpolationMode.'):
+        return InterpolationMode[mode.split('.', 1)[1]]
+    return InterpolationMode(mode)
+
+
+def recorded_downsampling(source: Path, name: str = 'downsampled/sam-native') -> dict | None:
+    """The 'downsample' parameters the array `name` of the source store was computed with, if recorded."""
+    try:
+        array = zarr.open_group(source, mode='r')[name]
+    except KeyError:
+        return None
+    in_plane_target = array.attrs.get('in_plane_target')
+    return {'in_plane_target': in_plane_target} if in_plane_target is not None else None
+
+
+def crop_zarr(
+    data: zarr.Array,
+    target: Path | zarr.Group,
+    roispec: dict,
+    name: str = 'metric/raw',
+    workers: int | None = None,
+    progress: bool = False,
+    chunks: tuple[int, ...] | None = None,
+    codec: Codec | None = None,
+    angle: float | None = None,
+    mode: 'str | InterpolationMode' = 'bilinear'
+) -> zarr.Array:
+    """
+    Stream the ROI of the array into the array `name` at `target`, one z-slab at a time.
+    With an `angle`, the full planes of every slab are rotated first and the ROI is
+    cropped from the rotated slab, bit-identical to `extract_roi` on the volume rotated
+    by the rotation widget.
+    """
+    *lead, D, H, W = data.shape
+    zslice, yslice, xslice = resolve_box(roi_slices(roispec), (D, H, W))
+    shape = (*lead, zslice.stop - zslice.start,
+             yslice.stop - yslice.start, xslice.stop - xslice.start)
+    array = create_array(target, name, shape, data.dtype,
+                         chunks=chunks or default_chunks(shape), codec=codec)
+
+    def process(out_slab: slice) -> None:
+        zslab = slice(zslice.start + out_slab.start, zslice.start + out_slab.stop)
+        if angle is None:
+            array[..., out_slab, :, :] = data[..., zslab, yslice, xslice]
+            return
+        rotated = rotate_slab(data[..., zslab, :, :], angle, interpolation_mode(mode))
+        array[..., out_slab, :, :] = rotated[..., yslice, xslice]
+
+    run_threaded(process, iter_slabs(shape[-3], array.chunks[-3]),
+                 workers=workers, progress=progress, unit='slab')
+    return array
+
+
+def replay_dataset(
+    source: Path,
+    target: Path,
+    parameters: dict,
+    name: str = 'metric/raw',
+    threads: int | None = None,
+    memory_budget: int = 2**30,
+    codec: Codec | None = None
+) -> dict:
+    """
+    Apply the recorded parameters to the array `name` of the source store.
+
+    A rotation together with an ROI rotates the full planes slab by slab and crops
+    the ROI from them, so the result equals the interactive rotate-then-crop
+    exactly (see `crop_zarr`). The result is written under `name` into
+    the new target store. A 'downsample' entry with 'in_plane_target'
+    additionally writes 'downsampled/sam-native' computed from that result.
+    Without the entry, the downsampling recorded in the source store is
+    replayed (see `recorded_downsampling`), unless `name` is that array itself.
+    The replayed parameters are stored in the target attributes.
+    All outputs are compressed with `codec`.
+
+    Returns
+    -------
+
+    result : dict
+        Shape and dtype of the written array and the duration in seconds.
+    """
+    if target.exists():
+        raise FileExistsError(f'cannot write to: \'{target}\': would overwrite existing')
+    start = time.perf_counter()
+    rotation = parameters.get('rotation')
+    roispec = parameters.get('roi')
+    downsampling = parameters.get('downsample')
+    if rotation is None and roispec is None and downsampling is None:
+        raise ValueError('parameters specify neither rotation, roi nor downsample')
+    if downsampling is None and name != 'downsampled/sam-native':
+        downsampling = recorded_downsampling(source)
+        if downsampling is not None:
+            parameters = {**parameters, 'downsample': downsampling}
+
+    if rotation is not None and roispec is not None:
+        result = crop_zarr(zarr.open(source, mode='r')[name], target, roispec,
+                           name=name, workers=threads, codec=codec,
+                           angle=rotation['angle'], mode=parse_mode(rotation['mode']))
+    elif rotation is not None:
+        rotate_zarr(source, target, rotation['angle'], parse_mode(rotation['mode']),
+                    name=name, workers=threads, codec=codec)
+        result = zarr.open(target, mode='r')[name]
+    elif roispec is not None:
+        result = crop_zarr(zarr.open(source, mode='r')[name], target, roispec,
+                           name=name, workers=threads, codec=codec)
+    else:
+        result = zarr.open(source, mode='r')[name]
+
+    if downsampling is not None:
+        downsample_zarr_streaming(result, target, downsampling['in_plane_target'],
+                                  memory_budget, workers=threads or 1, progress=False,
+                                  codec=codec)
+
+    outfile = zarr.open_group(target, mode='a')
+    outfile.attrs['replay'] = {'source': str(source), 'array': name, 'parameters': parameters}
+    return {
+        'shape': list(result.shape), 'dtype': str(np.dtype(result.dtype)),
+        'duration': time.perf_counter() - start
+    }
+
+
+def _replay_task(
+    source: Path,
+    target: Path,
+    parameters: dict,
+    name: str,
+    threads: int | None,
+    memory_budget: int,
+    codec: Codec | None = None
+) -> dict:
+    """Worker process entry point."""
+    return replay_dataset(source, target, parameters, name=name,
+                          threads=threads, memory_budget=memory_budget, codec=codec)
+
+
+def replay_batch(
+    sourcedir: Path,
+    parameterdir: Path,
+    targetdir: Path,
+    name: str = 'metric/raw',
+    workers: int = 1,
+    threads: int | None = 1,
+    memory_limit: int | None = None,
+    memory_budget: int = 2**30,
+    manifest_path: Path | None = None,
+    codec: Codec | None = None
+) -> dict:
+    """
+    Replay every '{ID}.json' parameter file of the parameter directory on
+    the dataset '{ID}.zarr' of the source directory, on a process pool.
+
+    Progress is recorded in a resumable manifest (default: 'manifest.json' in the
+    target directory), see `woodtools.pipeline.rotations.bulk_rotate_zarr`.
+    Pre-existing targets that no previous run of the manifest started are
+    marked as skipped and left untouched.
+
+    Returns
+    -------
+
+    summary : dict
+        Counts per status, summed work time and the per-dataset entries.
+    """
+    targetdir.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(manifest_path or targetdir / 'manifest.json')
+
+    tasks = {}
+    for parameter_path in sorted(parameterdir.glob('*.json')):
+        ID = parameter_path.stem
+        source = sourcedir / f'{ID}.zarr'
+        target = targetdir / f'{ID}.zarr'
+        if manifest.status(ID) == DONE and target.exists():
+            continue
+        if not source.exists():
+            manifest.mark(ID, FAILED, error=f'missing source dataset \'{source}\'')
+            continue
+        if target.exists():
+            if manifest.status(ID) not in (PENDING, RUNNING, FAILED):
+                manifest.mark(ID, SKIPPED, reason='would overwrite data')
+                continue
+            # partial output of an interrupted or failed previous run
+            shutil.rmtree(target)
+
+        parameters = load_parameters(parameter_path)
+        manifest.mark(ID, PENDING, source=str(source), target=str(target),
+                      parameters=parameters, array=name)
+        tasks[ID] = (
+            _replay_task,
+            (source, target, parameters, name, threads, memory_budget, codec),
+            target
+        )
+
+    return run_tasks(manifest, tasks, workers=workers, memory_limit=memory_limit)
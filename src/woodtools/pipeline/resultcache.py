@@ -0,0 +1,222 @@
+"""
+Content-addressed on-disk cache for derived volumes.
+
+A result is keyed by the fingerprint of its source array (shape, dtype,
+chunking and the size and mtime of every chunk file), the operation, its
+parameters and the code version. Rewriting the source changes the key, so
+stale results are never served. Cached results are zarr stores that are
+materialized at a target location by hard-linking their files (copying across
+file systems). zarr (since 3.1.3) replaces files atomically instead of writing
+into them, so later writes to a materialized store do not alter the cache.
+
+@Author: Jannik Stebani
+"""
+import hashlib
+import importlib.metadata
+import json
+import os
+import shutil
+import time
+import uuid
+from collections.abc import Callable
+from pathlib import Path
+
+import zarr
+
+from woodtools.dataloading.statistics import fingerprint
+
+
+CACHE_VERSION: int = 1
+METADATA_SUFFIX: str = '.json'
+RESULT_SUFFIX: str = '.zarr'
+
+
+def code_version() -> str:
+    try:
+        return importlib.metadata.version('woodtools')
+    except importlib.metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def default_cache_dir() -> Path:
+    cachedir = Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache'))
+    return cachedir / 'woodtools' / 'results'
+
+
+def link_tree(source: Path, target: Path) -> None:
+    """Recreate the directory tree at `target` with hard links to the files of `source`."""
+    for dirpath, _, filenames in os.walk(source):
+        destination = target / os.path.relpath(dirpath, source)
+        destination.mkdir(parents=True, exist_ok=True)
+        for filename in filenames:
+            try:
+                os.link(os.path.join(dirpath, filename), destination / filename)
+            except OSError:
+                # e.g. cache and target on different file systems
+                shutil.copy2(os.path.join(dirpath, filename), destination / filename)
+
+
+def tree_nbytes(path: Path) -> int:
+    return sum(
+        os.path.getsize(os.path.join(dirpath, filename))
+        for dirpath, _, filenames in os.walk(path) for filename in filenames
+    )
+
+
+class ResultCache:
+    """
+    Directory of cached result stores '{key}.zarr' with their metadata '{key}.json'.
+    The least recently used results are evicted once the cache exceeds `max_bytes`.
+    """
+    def __init__(self, directory: Path | None = None, max_bytes: int = 64 * 2**30) -> None:
+        self.directory = Path(directory) if directory is not None else default_cache_dir()
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def key(self, source_fingerprint: str | None, operation: str, parameters: dict) -> str | None:
+        """
+        Cache key of the operation applied to the fingerprinted source array,
+        or None if the source has no fingerprint (non-local store).
+        """
+        if source_fingerprint is None:
+            return None
+        content = json.dumps({
+            'cache': CACHE_VERSION, 'code': code_version(), 'source': source_fingerprint,
+            'operation': operation, 'parameters': parameters
+        }, sort_keys=True, default=str)
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def _result_path(self, key: str) -> Path:
+        return self.directory / f'{key}{RESULT_SUFFIX}'
+
+    def _metadata_path(self, key: str) -> Path:
+        return self.directory / f'{key}{METADATA_SUFFIX}'
+
+    def _read_metadata(self, key: str) -> dict | None:
+        try:
+            with open(self._metadata_path(key)) as handle:
+                return json.load(handle)
+        except (OSError, ValueError):
+            return None
+
+    def _write_metadata(self, key: str, metadata: dict) -> None:
+        tmp_path = self._metadata_path(key).with_suffix(f'.{uuid.uuid4().hex}.tmp')
+        with open(tmp_path, mode='w') as handle:
+            json.dump(metadata, handle, indent=2)
+        os.replace(tmp_path, self._metadata_path(key))
+
+    def get(self, key: str | None) -> Path | None:
+        """Location of the cached result, or None on a miss. Marks the entry as recently used."""
+        if key is None:
+            return None
+        metadata = self._read_metadata(key)
+        if metadata is None or not self._result_path(key).exists():
+            return None
+        metadata['used'] = time.time()
+        self._write_metadata(key, metadata)
+        return self._result_path(key)
+
+    def materialize(self, key: str | None, target: Path) -> bool:
+        """Hard-link the cached result to the target location. Returns False on a miss."""
+        result = self.get(key)
+        if result is None:
+            return False
+        if target.exists():
+            raise FileExistsError(f'cannot write to: \'{target}\': would overwrite existing')
+        link_tree(result, target)
+        return True
+
+    def store(self, key: str | None, result: Path, **metadata) -> None:
+        """
+        Add the result store (e.g. a freshly written target) to the cache under the key.
+        The metadata (operation, parameters, source) is kept for inspection and pruning.
+        """
+        if key is None or self._result_path(key).exists():
+            return
+        # link into a private location first: concurrent writers never see partial entries
+        tmp_path = self.directory / f'{key}.{uuid.uuid4().hex}.partial'
+        link_tree(result, tmp_path)
+        try:
+            os.rename(tmp_path, self._result_path(key))
+        except OSError:
+            # stored concurrently by another process
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        now = time.time()
+        self._write_metadata(key, {
+            **metadata, 'key': key, 'nbytes': tree_nbytes(self._result_path(key)),
+            'created': now, 'used': now
+        })
+        self.evict()
+
+    def materialize_or_compute(
+        self,
+        source: Path,
+        name: str,
+        operation: str,
+        parameters: dict,
+        target: Path,
+        compute: Callable[[], object]
+    ) -> bool:
+        """
+        Materialize the cached result of the operation on the array `name` of the
+        source store at `target`. On a miss, `compute()` writes the target store,
+        which is then added to the cache. Returns True on a cache hit.
+        """
+        source_fingerprint = fingerprint(zarr.open(source, mode='r')[name])
+        key = self.key(source_fingerprint, operation, parameters)
+        if self.materialize(key, target):
+            return True
+        compute()
+        if fingerprint(zarr.open(source, mode='r')[name]) != source_fingerprint:
+            # source changed while computing: the result matches neither version reliably
+            return False
+        self.store(key, target, source=str(source), array=name, operation=operation,
+                   parameters=parameters, source_fingerprint=source_fingerprint)
+        return False
+
+    def remove(self, key: str) -> None:
+        shutil.rmtree(self._result_path(key), ignore_errors=True)
+        try:
+            os.remove(self._metadata_path(key))
+        except OSError:
+            pass
+
+    def entries(self) -> list[dict]:
+        """Metadata of all complete entries, least recently used first."""
+        entries = []
+        for path in self.directory.glob(f'*{METADATA_SUFFIX}'):
+            metadata = self._read_metadata(path.stem)
+            if metadata is not None and self._result_path(path.stem).exists():
+                entries.append(metadata)
+        return sorted(entries, key=lambda entry: entry['used'])
+
+    def nbytes(self) -> int:
+        return sum(entry['nbytes'] for entry in self.entries())
+
+    def evict(self) -> list[str]:
+        """Remove least recently used entries until the cache fits into `max_bytes`."""
+        entries = self.entries()
+        total = sum(entry['nbytes'] for entry in entries)
+        removed = []
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            self.remove(entry['key'])
+            total -= entry['nbytes']
+            removed.append(entry['key'])
+        return removed
+
+    def prune_stale(self) -> list[str]:
+        """Remove entries whose source array was rewritten or removed since they were computed."""
+        removed = []
+        for entry in self.entries():
+            try:
+                source = zarr.open(entry['source'], mode='r')[entry['array']]
+                current = fingerprint(source)
+            except (KeyError, OSError, ValueError, FileNotFoundError):
+                current = None
+            if current != entry.get('source_fingerprint'):
+                self.remove(entry['key'])
+                removed.append(entry['key'])
+        return removed
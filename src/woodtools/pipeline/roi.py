@@ -0,0 +1,196 @@
+"""
+Region-of-interest specifications and their extraction from in-memory and zarr volumes.
+GUI-free: the interactive selection lives in `woodtools.pipeline.roiselector`.
+
+@Author: Jannik Stebani
+"""
+from collections.abc import Sequence
+from typing import NamedTuple
+
+import numpy as np
+import zarr
+
+from woodtools.pipeline.parallel import run_threaded
+
+
+class Point(NamedTuple):
+    x: float
+    y: float
+
+
+
+def roi_slices(roispec: dict[str, Sequence[float]]) -> tuple[slice, slice, slice]:
+    """
+    Translate the roispec into (z, y, x) index slices.
+    Along the first z-axis, all slices are chosen if no 'z_range' is given.
+
+    Notes
+    -----
+    
+    Point scheme
+    p0 --- p1
+    |      |
+    p2 --- p3
+    """
+    p0 = Point(*roispec['top_left'])
+    p1 = Point(*roispec['top_right'])
+    p2 = Point(*roispec['bottom_left'])
+    p3 = Point(*roispec['bottom_right'])
+
+    dx = int(np.round(p1.x - p0.x))
+    assert np.isclose(dx, int(np.round(p3.x - p2.x)))
+    dy = int(np.round(p2.y - p0.y))
+    assert np.isclose(dy, int(np.round(p3.y - p1.y)))
+    x0 = int(np.round(p0.x))
+    y0 = int(np.round(p0.y))
+
+    try:
+        zstart, zend = roispec['z_range']
+        zslice = slice(zstart, zend)
+    except KeyError:
+        zslice = slice(None)
+    
+    return tuple(
+        (zslice, slice(y0, y0+dy), slice(x0, x0+dx))
+    )
+
+
+def scale_roispec(roispec: dict[str, Sequence[float]], factor: int) -> dict[str, list]:
+    """
+    Map a roispec selected on a pyramid level to the coordinates of the source array.
+    Level pixel i covers source pixels [i * factor, (i + 1) * factor) along every axis
+    (see `woodtools.pipeline.pyramid.build_pyramid`), so all coordinates scale by the factor.
+    """
+    return {name: [factor * c for c in coords] for name, coords in roispec.items()}
+
+
+def extract_roi(
+    volume: np.ndarray | zarr.Array,
+    roispec: dict[str, Sequence[float]],
+    copy: bool = True
+) -> np.ndarray:
+    """
+    Extract the subvolume that is specified by the roispec.
+    Along the first z-axis, all slices are chosen.
+    Returns a copy to avoid mutation of the source array.
+    
+    Parameters
+    ----------
+    
+    volume : np.ndarray or array-like
+        The source volume from which the data is extracted.
+        Chunked array-likes (e.g. zarr arrays) only read the chunks
+        intersecting the ROI and z_range.
+        
+    roispec : Mapping[str, Sequence[float]]
+        Specification of the region-of-interest.
+        Shoudl be given as a mapping of point names
+        {'top_left', 'top_right', 'bottom_left', 'bottom_right'}
+        to sequences of length 2 of coordinates.
+
+    copy : bool, optional
+        Return a copy for in-memory volumes. If False, a zero-copy view
+        of an `np.ndarray` volume is returned. Defaults to True.
+        
+    Returns
+    -------
+    
+    subvolume : np.ndarray
+        The subvolume selected by the roispec.    
+    
+    Notes
+    -----
+    
+    Point scheme
+    p0 --- p1
+    |      |
+    p2 --- p3
+    """
+    slices = roi_slices(roispec)
+    if isinstance(volume, np.ndarray):
+        subvolume = volume[..., *slices]
+        return np.copy(subvolume) if copy else subvolume
+    # indexing array-likes reads into fresh memory: no copy required
+    return np.asarray(volume[..., *slices])
+
+
+def resolve_box(slices: Sequence[slice], shape: Sequence[int]) -> tuple[slice, ...]:
+    """Clip the slices to the shape with numpy indexing semantics."""
+    resolved = []
+    for slc, size in zip(slices, shape):
+        start, stop, _ = slc.indices(size)
+        resolved.append(slice(start, max(start, stop)))
+    return tuple(resolved)
+
+
+def _chunk_ranges(box: Sequence[slice], chunks: Sequence[int]) -> list[range]:
+    return [
+        range(slc.start // chunk, -(-slc.stop // chunk)) for slc, chunk in zip(box, chunks)
+    ]
+
+
+def extract_rois(
+    volume: np.ndarray | zarr.Array,
+    roispecs: Sequence[dict[str, Sequence[float]]],
+    workers: int | None = None
+) -> list[np.ndarray]:
+    """
+    Extract many ROIs (e.g. a grid of training patches) from one volume.
+
+    For chunked array-likes the reads are coalesced per chunk: every chunk
+    touched by any ROI is read exactly once (restricted to the bounding box of
+    the ROI parts inside it) and distributed to all ROIs intersecting it.
+    Chunks are read on a thread pool.
+
+    Returns
+    -------
+
+    subvolumes : list[np.ndarray]
+        The subvolumes in the order of the roispecs.
+    """
+    chunks = getattr(volume, 'chunks', None)
+    if isinstance(volume, np.ndarray) or chunks is None:
+        return [extract_roi(volume, roispec) for roispec in roispecs]
+
+    *lead, D, H, W = volume.shape
+    chunks = chunks[-3:]
+    boxes = [resolve_box(roi_slices(roispec), (D, H, W)) for roispec in roispecs]
+    results = [
+        np.empty((*lead, *(slc.stop - slc.start for slc in box)), dtype=volume.dtype)
+        for box in boxes
+    ]
+    # mapping chunk grid index -> indices of the ROIs intersecting the chunk
+    users: dict[tuple[int, int, int], list[int]] = {}
+    for index, box in enumerate(boxes):
+        if any(slc.start == slc.stop for slc in box):
+            continue
+        zr, yr, xr = _chunk_ranges(box, chunks)
+        for key in ((zc, yc, xc) for zc in zr for yc in yr for xc in xr):
+            users.setdefault(key, []).append(index)
+
+    def process(key: tuple[int, int, int]) -> None:
+        chunk_box = [
+            (c * size, min((c + 1) * size, extent))
+            for c, size, extent in zip(key, chunks, (D, H, W))
+        ]
+        parts = {}
+        for index in users[key]:
+            parts[index] = [
+                (max(slc.start, lo), min(slc.stop, hi))
+                for slc, (lo, hi) in zip(boxes[index], chunk_box)
+            ]
+        read_box = [
+            (min(part[axis][0] for part in parts.values()),
+             max(part[axis][1] for part in parts.values()))
+            for axis in range(3)
+        ]
+        data = np.asarray(volume[..., *(slice(lo, hi) for lo, hi in read_box)])
+        for index, part in parts.items():
+            source = tuple(slice(lo - rlo, hi - rlo) for (lo, hi), (rlo, _) in zip(part, read_box))
+            target = tuple(
+                slice(lo - slc.start, hi - slc.start) for (lo, hi), slc in zip(part, boxes[index])
+            )
+            results[index][..., *target] = data[..., *source]
+
+    run_threaded(process, sorted(users), workers=workers, progress=False, unit='chunk')
+    return results
@@ -1,5 +1,4 @@
 from collections.abc import Sequence
-from typing import NamedTuple
 
 import matplotlib.pyplot as plt
 import numpy as np
@@ -9,18 +8,29 @@ from IPython.display import display
 from matplotlib.widgets import RectangleSelector
 from matplotlib.image import AxesImage
 
+from woodtools.pipeline.roi import (
+    Point, roi_slices, extract_roi, resolve_box, extract_rois, scale_roispec
+)
+from woodtools.pipeline.sliceprovider import SliceProvider
 from woodtools.pipeline.state import StateManager
 
 
+# the ROI helpers moved to `woodtools.pipeline.roi` and are re-exported here
+__all__ = [
+    'AxisSlider', 'create_axis_slider', 'SynchronizedRectangleSelector', 'run_synchronized_selector',
+    'Point', 'roi_slices', 'extract_roi', 'resolve_box', 'extract_rois',
+]
+
+
 class AxisSlider:
     def __init__(
         self,
         image: AxesImage,
-        volume: np.ndarray,
+        volume: np.ndarray | SliceProvider,
         name: str = ''
     ) -> None:
         self.image = image
-        self.volume = volume
+        self.volume = volume if isinstance(volume, SliceProvider) else SliceProvider(volume)
 
         desc = f'slice {name}' if name else 'slice'
 
@@ -42,15 +52,21 @@ class AxisSlider:
 
 def create_axis_slider(
     image: AxesImage,
-    volume: np.ndarray,
+    volume: np.ndarray | SliceProvider,
     name: str = '',
     init: str = 'lower'
 ) -> widgets.IntSlider:
+    """
+    Create a slider that displays the selected z-slice of the volume in the image.
+    Slices are served by a `SliceProvider` (cached and prefetched); pass a shared
+    provider to let several sliders use the same cache.
+    """
+    provider = volume if isinstance(volume, SliceProvider) else SliceProvider(volume)
     
     def update_slice(change):
         """Update the displayed slice based on the slider value"""
         slice_index = change['new']
-        image.set_array(volume[slice_index])
+        image.set_array(provider[slice_index])
         image.axes.figure.canvas.draw_idle()
     
     desc = f'slice {name}' if name else 'slice'
@@ -117,9 +133,13 @@ class SynchronizedRectangleSelector:
         self.img_plots = []
         self.selectors = []
         self.sliders = []
+        self.slice_provider = SliceProvider(self.state_manager.item.volume)
+        # display window recorded when the dataset was loaded, if any
+        window = self.state_manager.item.parameters.get('window', {})
         
         for i, (ax, init) in enumerate(zip(self.axes, ['lower', 'middle', 'upper'])):
-            img_plot = ax.imshow(self.images[i], cmap='viridis')
+            img_plot = ax.imshow(self.images[i], cmap='viridis',
+                                 vmin=window.get('vmin'), vmax=window.get('vmax'))
             self.img_plots.append(img_plot)
             
             # Create rectangle selector for each axis
@@ -136,7 +156,7 @@ class SynchronizedRectangleSelector:
 
             slider = create_axis_slider(
                 image=img_plot,
-                volume=self.state_manager.item.volume,
+                volume=self.slice_provider,
                 name=f'{i+1}',
                 init=init
             )
@@ -147,10 +167,16 @@ class SynchronizedRectangleSelector:
         
         # Setup widgets
         self.setup_widgets()
+        # stop the prefetch threads once the figure is discarded
+        self.fig.canvas.mpl_connect('close_event', lambda event: self.close())
         
         # Show the plot
         plt.tight_layout()
         
+    def close(self) -> None:
+        """Release the slice provider shared by the sliders."""
+        self.slice_provider.close()
+
     def deduce_images(self) -> np.ndarray:
         volume = self.state_manager.item.volume
         uidx, cidx, lidx = 0, volume.shape[0] //2, volume.shape[0] - 1
@@ -241,6 +267,10 @@ class SynchronizedRectangleSelector:
                 int(self.sliders[0].value),
                 int(self.sliders[2].value)
             ]
+        preview = self.state_manager.item.parameters.get('preview')
+        if preview is not None:
+            # selection was made on a preview level: store full-resolution coordinates
+            coords_dict = scale_roispec(coords_dict, preview['factor'])
         self.state_manager.item.parameters['roi'] = coords_dict
 
     
@@ -300,67 +330,3 @@ def run_synchronized_selector(images=None, num_axes=3):
     """
     tool = SynchronizedRectangleSelector(images, num_axes)
     return tool
-
-
-class Point(NamedTuple):
-    x: float
-    y: float
-
-
-
-def extract_roi(volume: np.ndarray, roispec: dict[str, Sequence[float]]) -> np.ndarray:
-    """
-    Extract the subvolume that is specified by the roispec.
-    Along the first z-axis, all slices are chosen.
-    Returns a copy to avoid mutation of the source array.
-    
-    Parameters
-    ----------
-    
-    volume : np.ndarray
-        The source volume from which the data is extracted.
-        
-    roispec : Mapping[str, Sequence[float]]
-        Specification of the region-of-interest.
-        Shoudl be given as a mapping of point names
-        {'top_left', 'top_right', 'bottom_left', 'bottom_right'}
-        to sequences of length 2 of coordinates.
-        
-    Returns
-    -------
-    
-    subvolume : np.ndarray
-        The subvolume selected by the roispec.    
-    
-    Notes
-    -----
-    
-    Point scheme
-    p0 --- p1
-    |      |
-    p2 --- p3
-    """
-    p0 = Point(*roispec['top_left'])
-    p1 = Point(*roispec['top_right'])
-    p2 = Point(*roispec['bottom_left'])
-    p3 = Point(*roispec['bottom_right'])
-
-    dx = int(np.round(p1.x - p0.x))
-    assert np.isclose(dx, int(np.round(p3.x - p2.x)))
-    dy = int(np.round(p2.y - p0.y))
-    assert np.isclose(dy, int(np.round(p3.y - p1.y)))
-    x0 = int(np.round(p0.x))
-    y0 = int(np.round(p0.y))
-
-    try:
-        zstart, zend = roispec['z_range']
-        zslice = slice(zstart, zend)
-    except KeyError:
-        zslice = slice(None)
-    
-    slices = tuple(
-        (zslice, slice(y0, y0+dy), slice(x0, x0+dx))
-    )
-    return np.copy(volume[*slices])
-    
-    
\ No newline at end of file
@@ -1,147 +1,494 @@
+import shutil
+import time
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import ipywidgets as widgets
 import numpy as np
-import torch
-import torchvision.transforms as vtransforms
-import tqdm
 import zarr
 
-from IPython.display import display
+from woodtools import instrumentation
+from woodtools.pipeline.manifest import (
+    Manifest, run_tasks, PENDING, RUNNING, DONE, FAILED, SKIPPED
+)
+from woodtools.pipeline.parallel import run_threaded
+from woodtools.pipeline.roi import resolve_box, roi_slices
+from woodtools.pipeline.storage import (
+    create_array, default_chunks, iter_slabs, slab_depth, Codec, DEFAULT_CODEC
+)
 
-from woodtools.pipeline.transforms import datatransform
-from woodtools.plotting import ucl_figure
+if TYPE_CHECKING:
+    from torchvision.transforms import InterpolationMode
+    from woodtools.pipeline.resultcache import ResultCache
 
-from woodtools.pipeline.state import StateManager
 
-class RotationWidget:
-    
-    def __init__(
-        self,
-        state_manager: StateManager,
-        volume: np.ndarray | None = None,
-        vmin: float | None = None,
-        vmax: float | None = None,
-        figsize: tuple[float, float] = (18, 6),
-        ID: str | None = None,
-        alpha_range: tuple[float, float] = (-20.0, 20.0)
-    ) -> None:
-        
-        self.state_manager = state_manager
-        self.volume = self.deduce_volume() if volume is None else volume
-        self.vmin = vmin
-        self.vmax = vmax
-        self.figsize = figsize
-        self.ID = ID or self.deduce_ID()
-        
-        self.fig, self.axes, self.mapping = ucl_figure(
-            self.volume, vmin=self.vmin, vmax=self.vmax, figsize=self.figsize, ID=self.ID
-        )
-        
-        alpha_min, alpha_max = alpha_range
-        self.angle_slider = widgets.FloatSlider(
-            value=0, min=alpha_min, max=alpha_max, step=0.1, desc='Angle Slider [deg]'
-        )
-        self.rotate_button = widgets.Button(description='Rotate', icon='gear')
-        self.interpolation_dropdown = widgets.Dropdown(options=['nearest', 'bilinear'])
-        
-        self.setup_widgets()
-        
-        
-    def deduce_ID(self) -> str:
-        return self.state_manager.item.ID
-    
-    def deduce_volume(self) -> np.ndarray:
-        return self.state_manager.item.volume
-    
-    def _callback(self, change):
-        angle = change['new']
-        for name, items in self.mapping.items():
-            ax = items['ax']   # noqa: F841
-            data = items['data']
-            transformed_data = datatransform(data, angle=angle, mode='nearest')
-            items['image'].set_data(transformed_data)
-
-        self.fig.suptitle(f'Angle: {angle:.2f} deg')
-        self.fig.canvas.draw_idle()
-        return
-    
-    def get_interpolation_mode(self) -> vtransforms.InterpolationMode:
-        return vtransforms.InterpolationMode(self.interpolation_dropdown.value)
-    
-    def rotate(self, *args, **kwargs):
-        volume = torch.as_tensor(self.volume)
-        angle = self.angle_slider.value
-        mode = self.get_interpolation_mode()
-        rotated_volume = vtransforms.functional.rotate(
-            volume, angle=angle, interpolation=mode
-        )
+# bump when the rotation results change, invalidates cached results
+ROTATE_VERSION: int = 1
 
-        rotation_paramters = {'angle' : angle, 'mode' : str(mode)}
-        workitem = self.state_manager.item.copy()
-        workitem.volume = np.asarray(rotated_volume)
-        workitem.parameters['rotation'] = rotation_paramters
 
-        self.state_manager.update(workitem)    
+def __getattr__(name: str):
+    # the rotation widget moved to `woodtools.pipeline.rotationselector`
+    if name == 'RotationWidget':
+        from woodtools.pipeline.rotationselector import RotationWidget
+        return RotationWidget
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
-    
-    def setup_widgets(self):
-        self.angle_slider.observe(self._callback, names='value')
-        self.rotate_button.on_click(self.rotate)
-        display(widgets.HBox([self.angle_slider, self.rotate_button]))
+def interpolation_mode(mode: 'str | InterpolationMode') -> 'InterpolationMode':
+    """Interpolation mode given by value (e.g. 'bilinear') as torchvision enum member."""
+    from torchvision.transforms import InterpolationMode
+    return InterpolationMode(mode) if isinstance(mode, str) else mode
+
+
+def rotate_slab(
+    data: np.ndarray,
+    angle: float,
+    mode: 'InterpolationMode'
+) -> np.ndarray:
+    """
+    In-plane rotation of all slices of the array in a single batched call.
+    The last two axes are the image plane, the dtype is preserved.
+    """
+    import torch
+    import torchvision.transforms.functional
+
+    *lead, H, W = data.shape
+    data = np.ascontiguousarray(data)
+    if not data.flags.writeable:
+        # shared read-only buffers are not handed to torch
+        data = data.copy()
+    volume = torch.as_tensor(data.reshape(-1, H, W))
+    rotated_volume = torchvision.transforms.functional.rotate(
+        volume, angle=angle, interpolation=mode
+    )
+    return np.asarray(rotated_volume).reshape(data.shape)
+
+
+def rotate_array(
+    data: zarr.Array,
+    target: Path | zarr.Group,
+    angle: float,
+    mode: 'str | InterpolationMode',
+    name: str = 'downsampled/sam-native',
+    workers: int | None = None,
+    progress: bool = False,
+    chunks: tuple[int, ...] | None = None,
+    codec: Codec | None = None
+) -> zarr.Array:
+    """
+    Stream the in-plane rotation of the array into the array `name` at `target`.
+    The z-axis (axis -3) is processed in batches of slices matched to the
+    target chunking. The target keeps the source dtype and, unless `chunks`
+    is given, the source chunk layout, so peak memory is one z-chunk slab
+    per worker.
+    """
+    mode = interpolation_mode(mode)
+    array = create_array(target, name, data.shape, data.dtype,
+                         chunks=chunks or data.chunks, codec=codec)
 
+    def process(slab: slice) -> None:
+        with instrumentation.span('rotate.read') as span:
+            chunk = data[..., slab, :, :]
+            span.add(bytes_read=chunk.nbytes)
+        with instrumentation.span('rotate.compute'):
+            chunk = rotate_slab(chunk, angle, mode)
+        with instrumentation.span('rotate.write', bytes_written=chunk.nbytes):
+            array[..., slab, :, :] = chunk
+
+    run_threaded(process, iter_slabs(data.shape[-3], array.chunks[-3]),
+                 workers=workers, progress=progress, unit='slab')
+    return array
 
 
 def rotate_zarr(
     source: Path,
     target: Path,
     angle: float,
-    mode: str
+    mode: str,
+    name: str = 'downsampled/sam-native',
+    workers: int | None = None,
+    progress: bool = False,
+    chunks: tuple[int, ...] | None = None,
+    codec: Codec | None = None,
+    cache: 'ResultCache | None' = None
 ) -> None:
+    """
+    Rotate the array `name` of the source store in-plane and write it under
+    the same name into the new target store. Works slab-wise, so volumes
+    larger than memory (e.g. 'metric/raw') can be rotated.
+    Chunk shape and codec of the output are configurable, see `rotate_array`.
+    With a result cache, an unchanged source rotated with the same parameters
+    before is materialized from the cache instead.
+    """
     if target.exists():
         raise FileExistsError(f'connot write to pre-existing location \'{target}\'')
-    mode = vtransforms.transforms.InterpolationMode(mode) if isinstance(mode, str) else mode
-    data = zarr.open(source)['downsampled/sam-native'][...]
-    volume = torch.as_tensor(data)
-    rotated_volume = vtransforms.functional.rotate(
-        volume, angle=angle, interpolation=mode
-    )
-    outfile = zarr.open(target)
-    outfile['downsampled/sam-native'] = np.asarray(rotated_volume)
-    
+    if cache is not None:
+        parameters = {
+            'version': ROTATE_VERSION, 'angle': angle, 'mode': interpolation_mode(mode).value,
+            'chunks': chunks, 'codec': codec.asdict() if codec is not None else None
+        }
+        cache.materialize_or_compute(
+            source, name, 'rotate', parameters, target,
+            lambda: rotate_zarr(source, target, angle, mode, name=name, workers=workers,
+                                progress=progress, chunks=chunks, codec=codec)
+        )
+        return
+    data = zarr.open(source, mode='r')[name]
+    with instrumentation.span('rotate_zarr', source=str(source), angle=angle):
+        rotate_array(data, target, angle, mode, name=name, workers=workers,
+                     progress=progress, chunks=chunks, codec=codec)
     
 
+def _inverse_rotation(angle: float) -> np.ndarray:
+    """
+    2x2 matrix mapping centered output coordinates (x, y) of an in-plane rotation
+    by `angle` degrees to centered source coordinates, following the convention
+    of `torchvision.transforms.functional.rotate`.
+    """
+    rot = np.radians(-angle)
+    return np.array([[np.cos(rot), np.sin(rot)], [-np.sin(rot), np.cos(rot)]])
+
+
+def _source_coordinates(
+    ys: np.ndarray,
+    xs: np.ndarray,
+    angle: float,
+    shape: tuple[int, int]
+) -> tuple[np.ndarray, np.ndarray]:
+    """Source pixel coordinates of the output pixel grid spanned by `ys` and `xs`."""
+    H, W = shape
+    yy, xx = np.meshgrid(ys + 0.5 - H / 2, xs + 0.5 - W / 2, indexing='ij')
+    matrix = _inverse_rotation(angle)
+    source_x = matrix[0, 0] * xx + matrix[0, 1] * yy + W / 2 - 0.5
+    source_y = matrix[1, 0] * xx + matrix[1, 1] * yy + H / 2 - 0.5
+    return source_y, source_x
+
+
+def source_bounding_box(
+    yslice: slice,
+    xslice: slice,
+    angle: float,
+    shape: tuple[int, int],
+    margin: int = 1
+) -> tuple[slice, slice] | None:
+    """
+    In-plane bounding box of the source region that a rotated ROI depends on,
+    including a margin for the interpolation neighbourhood.
+    Returns None if the ROI lies completely outside of the source image.
+    """
+    H, W = shape
+    ys = np.array([yslice.start, yslice.stop - 1], dtype=np.float64)
+    xs = np.array([xslice.start, xslice.stop - 1], dtype=np.float64)
+    source_y, source_x = _source_coordinates(ys, xs, angle, shape)
+    y0 = max(int(np.floor(source_y.min())) - margin, 0)
+    y1 = min(int(np.ceil(source_y.max())) + margin + 1, H)
+    x0 = max(int(np.floor(source_x.min())) - margin, 0)
+    x1 = min(int(np.ceil(source_x.max())) + margin + 1, W)
+    if y0 >= y1 or x0 >= x1:
+        return None
+    return slice(y0, y1), slice(x0, x1)
+
+
+def _rotate_roi_slab(
+    data: zarr.Array | np.ndarray,
+    zslab: slice,
+    yslice: slice,
+    xslice: slice,
+    angle: float,
+    mode: 'InterpolationMode'
+) -> np.ndarray:
+    """
+    Rotated ROI of the z-slab: reads only the source bounding box and
+    resamples only the output voxels, with the sampling grid and dtype
+    handling of `torchvision.transforms.functional.rotate`.
+    """
+    *lead, _, H, W = data.shape
+    out_shape = (*lead, zslab.stop - zslab.start,
+                 yslice.stop - yslice.start, xslice.stop - xslice.start)
+    box = source_bounding_box(yslice, xslice, angle, (H, W)) if 0 not in out_shape else None
+    if box is None:
+        return np.zeros(out_shape, dtype=data.dtype)
+    by, bx = box
+    crop = np.asarray(data[..., zslab, by, bx])
+    return resample_rotated(crop, box, yslice, xslice, angle, mode, (H, W))
+
+
+def resample_rotated(
+    crop: np.ndarray,
+    box: tuple[slice, slice],
+    yslice: slice,
+    xslice: slice,
+    angle: float,
+    mode: 'InterpolationMode',
+    shape: tuple[int, int]
+) -> np.ndarray:
+    """
+    Output pixels (`yslice`, `xslice`) of the in-plane rotation of a (... x H x W)
+    image, given only its source bounding box `box` (see `source_bounding_box`)
+    as the (... x h x w) `crop`. Leading axes are kept.
+    """
+    import torch
+
+    by, bx = box
+    *lead, h, w = crop.shape
+    out_shape = (*lead, yslice.stop - yslice.start, xslice.stop - xslice.start)
+    tensor = torch.as_tensor(np.ascontiguousarray(crop).reshape(-1, 1, h, w))
+    is_float = torch.is_floating_point(tensor)
+    if not is_float:
+        tensor = tensor.to(torch.float32)
+
+    source_y, source_x = _source_coordinates(
+        np.arange(yslice.start, yslice.stop), np.arange(xslice.start, xslice.stop),
+        angle, shape
+    )
+    grid = np.stack(
+        [(2 * (source_x - bx.start) + 1) / w - 1, (2 * (source_y - by.start) + 1) / h - 1],
+        axis=-1
+    )
+    grid = torch.as_tensor(grid, dtype=tensor.dtype).expand(tensor.shape[0], *grid.shape)
+    resampled = torch.nn.functional.grid_sample(
+        tensor, grid, mode=mode.value, padding_mode='zeros', align_corners=False
+    )
+    if not is_float:
+        resampled = torch.round(resampled)
+    return np.asarray(resampled.to(torch.as_tensor(crop[..., :0, :0]).dtype)).reshape(out_shape)
+
+
+def _resolve_roi(data, roispec: dict) -> tuple[slice, slice, slice]:
+    """ROI slices clipped to the volume, as `woodtools.pipeline.roi.extract_roi` does."""
+    return resolve_box(roi_slices(roispec), data.shape[-3:])
+
+
+def rotate_roi(
+    data: zarr.Array | np.ndarray,
+    angle: float,
+    roispec: dict,
+    mode: 'str | InterpolationMode' = 'bilinear',
+    workers: int | None = None,
+    progress: bool = False
+) -> np.ndarray:
+    """
+    Fused in-plane rotation and ROI extraction.
+
+    The ROI is specified in the coordinates of the rotated volume (as selected
+    by the widgets after a rotation). It is mapped back to a source bounding box,
+    so only the chunks touched by that box are read and only the output voxels
+    are interpolated. Equivalent to `extract_roi(rotate(volume), roispec)`
+    without the full-volume rotation and copy: the ROI is clipped to the
+    volume alike, values agree up to the float precision of the sampling grid
+    (integer results may differ by one where the interpolation rounds at .5).
+    """
+    mode = interpolation_mode(mode)
+    zslice, yslice, xslice = _resolve_roi(data, roispec)
+    *lead, _, _, _ = data.shape
+    result = np.empty(
+        (*lead, zslice.stop - zslice.start,
+         yslice.stop - yslice.start, xslice.stop - xslice.start),
+        dtype=data.dtype
+    )
+
+    def process(zslab: slice) -> None:
+        out_slab = slice(zslab.start - zslice.start, zslab.stop - zslice.start)
+        result[..., out_slab, :, :] = _rotate_roi_slab(data, zslab, yslice, xslice, angle, mode)
+
+    slabs = [slice(zslice.start + s.start, zslice.start + s.stop)
+             for s in iter_slabs(zslice.stop - zslice.start, slab_depth(data))]
+    run_threaded(process, slabs, workers=workers, progress=progress, unit='slab')
+    return result
+
+
+def rotate_roi_zarr(
+    source: Path,
+    target: Path,
+    angle: float,
+    roispec: dict,
+    mode: str = 'bilinear',
+    name: str = 'metric/raw',
+    workers: int | None = None,
+    progress: bool = False,
+    chunks: tuple[int, ...] | None = None,
+    codec: Codec | None = None
+) -> zarr.Array:
+    """
+    Stream the fused rotation and ROI extraction of the array `name`
+    into the same array name of the new target store, one z-slab at a time.
+    The output uses the given chunk shape (default: z-slab chunks) and codec.
+    """
+    if target.exists():
+        raise FileExistsError(f'connot write to pre-existing location \'{target}\'')
+    mode = interpolation_mode(mode)
+    data = zarr.open(source, mode='r')[name]
+    zslice, yslice, xslice = _resolve_roi(data, roispec)
+    *lead, _, _, _ = data.shape
+    shape = (*lead, zslice.stop - zslice.start,
+             yslice.stop - yslice.start, xslice.stop - xslice.start)
+    array = create_array(target, name, shape, data.dtype,
+                         chunks=chunks or default_chunks(shape), codec=codec)
+
+    def process(out_slab: slice) -> None:
+        zslab = slice(zslice.start + out_slab.start, zslice.start + out_slab.stop)
+        array[..., out_slab, :, :] = _rotate_roi_slab(data, zslab, yslice, xslice, angle, mode)
+
+    run_threaded(process, iter_slabs(shape[-3], array.chunks[-3]),
+                 workers=workers, progress=progress, unit='slab')
+    return array
+
+
+def _rotate_task(
+    source: Path,
+    target: Path,
+    angle: float,
+    mode: str,
+    name: str,
+    threads: int,
+    chunks: tuple[int, ...] | None = None,
+    codec: Codec | None = None,
+    instrument: bool = False,
+    cache: 'ResultCache | None' = None
+) -> dict:
+    """
+    Worker process entry point: rotate a single dataset and report the result.
+    With `instrument`, the spans recorded in the worker are returned under 'spans'.
+    """
+    start = time.perf_counter()
+    if instrument:
+        recorder = instrumentation.enable()
+    rotate_zarr(source=source, target=target, angle=angle, mode=mode,
+                name=name, workers=threads, chunks=chunks, codec=codec, cache=cache)
+    result = zarr.open(target, mode='r')[name]
+    report = {
+        'shape': list(result.shape), 'dtype': str(result.dtype),
+        'duration': time.perf_counter() - start
+    }
+    if instrument:
+        instrumentation.disable()
+        report['spans'] = recorder.spans
+    return report
+
+
 def bulk_rotate_zarr(
     sourcedir: Path,
     targetdir: Path,
     angle_mapping: dict[str, float],
-    mode: str
-) -> None:
-    mode = vtransforms.transforms.InterpolationMode(mode)
-    src_paths = list(sourcedir.iterdir())
-    for item in tqdm.tqdm(src_paths, unit='dset'):
-        name = item.name
-        
-        trgt_path = targetdir / name
-        
-        if trgt_path.exists():
-            print(f'skipping item \'{item}\': would overwrite data')
-            continue
-        
+    mode: str,
+    name: str = 'downsampled/sam-native',
+    workers: int = 1,
+    threads: int = 1,
+    memory_limit: int | None = None,
+    manifest_path: Path | None = None,
+    chunks: tuple[int, ...] | None = None,
+    codec: Codec | None = None,
+    cache: 'ResultCache | None' = None
+) -> dict:
+    """
+    Rotate all zarr datasets of the source directory on a process pool.
+
+    Progress is recorded per dataset in a JSON manifest (default: 'manifest.json'
+    in the target directory). Re-running the same job skips datasets that were
+    completed with the same parameters, redoes completed datasets whose angle,
+    mode, array or codec changed, and removes and redoes partial outputs of
+    failed or interrupted ones.
+
+    Parameters
+    ----------
+
+    sourcedir : Path
+        Directory of '{stem}.zarr' datasets.
+
+    targetdir : Path
+        Directory receiving the rotated datasets under the same name.
+
+    angle_mapping : dict[str, float]
+        Rotation angle in degrees per dataset stem.
+
+    mode : str
+        Interpolation mode.
+
+    name : str, optional
+        The array that is rotated. Defaults to 'downsampled/sam-native'.
+
+    workers : int, optional
+        Number of worker processes. Defaults to 1.
+
+    threads : int, optional
+        Number of slab threads inside each worker process. Defaults to 1.
+
+    memory_limit : int, optional
+        Per-worker memory cap in bytes. A worker exceeding the cap fails
+        its dataset with a `MemoryError` instead of exhausting the host.
+
+    manifest_path : Path, optional
+        Location of the manifest file.
+
+    chunks : tuple[int, ...], optional
+        Chunk shape of the outputs. Defaults to the source chunk layout.
+
+    codec : Codec, optional
+        Compression of the outputs, see `woodtools.pipeline.storage.Codec`.
+
+    cache : ResultCache, optional
+        Result cache shared by the workers: datasets rotated with the same
+        parameters before are materialized from it instead of recomputed.
+
+    Returns
+    -------
+
+    summary : dict
+        Counts per status, summed work time and the per-dataset entries.
+    """
+    mode = interpolation_mode(mode).value
+    targetdir.mkdir(parents=True, exist_ok=True)
+    manifest = Manifest(manifest_path or targetdir / 'manifest.json')
+
+    codec_spec = (codec or DEFAULT_CODEC).asdict()
+    tasks = {}
+    for item in sorted(sourcedir.iterdir()):
+        dataset = item.name
+        trgt_path = targetdir / dataset
+
         try:
-            stem, suffix = name.split('.')
+            stem, suffix = dataset.split('.')
         except ValueError:
-            print(f'skipping malformed item: \'{item}\'')
+            manifest.mark(dataset, SKIPPED, reason='malformed item')
             continue
         
         if not suffix.endswith('zarr') and not item.is_file():
-            print(f'skipping invalid item: \'{item}\'')
+            manifest.mark(dataset, SKIPPED, reason='invalid item')
             continue
         try:
             angle = angle_mapping[stem]
         except KeyError:
-            print(f'could not rotate item \'{item}\': missing angle specification')
+            if manifest.status(dataset) == DONE and trgt_path.exists():
+                continue
+            manifest.mark(dataset, SKIPPED, reason='missing angle specification')
             continue
-            
-        rotate_zarr(source=item, target=trgt_path, angle=angle, mode=mode)        
\ No newline at end of file
+
+        requested = {'angle': angle, 'mode': mode, 'array': name, 'codec': codec_spec}
+        if manifest.status(dataset) == DONE and trgt_path.exists():
+            entry = manifest.entries[dataset]
+            if all(entry.get(field) == value for field, value in requested.items()):
+                continue
+            # completed with different parameters: the output is outdated
+            shutil.rmtree(trgt_path)
+        elif trgt_path.exists():
+            if manifest.status(dataset) in (RUNNING, FAILED):
+                # partial output of an interrupted or failed previous run
+                shutil.rmtree(trgt_path)
+            else:
+                manifest.mark(dataset, SKIPPED, reason='would overwrite data')
+                continue
+
+        manifest.mark(dataset, PENDING, source=str(item), target=str(trgt_path),
+                      **requested)
+        tasks[dataset] = (item, trgt_path, angle)
+
+    instrument = instrumentation.is_enabled()
+    tasks = {
+        dataset: (
+            _rotate_task,
+            (item, trgt_path, angle, mode, name, threads, chunks, codec, instrument, cache),
+            trgt_path
+        )
+        for dataset, (item, trgt_path, angle) in tasks.items()
+    }
+    with instrumentation.span('bulk_rotate_zarr', datasets=len(tasks), workers=workers):
+        return run_tasks(manifest, tasks, workers=workers, memory_limit=memory_limit)
@@ -0,0 +1,200 @@
+"""
+Interactive widget to choose and apply an in-plane rotation.
+
+@Author: Jannik Stebani
+"""
+import time
+from collections import deque
+
+import ipywidgets as widgets
+import numpy as np
+import torchvision.transforms as vtransforms
+
+from IPython.display import display
+
+from woodtools import instrumentation
+from woodtools.pipeline.cache import ByteLRUCache
+from woodtools.pipeline.jobs import Job, JobRunner
+from woodtools.pipeline.rotations import rotate_slab
+from woodtools.pipeline.state import StateManager, WorkItem
+from woodtools.pipeline.storage import iter_slabs, slab_depth
+from woodtools.pipeline.transforms import block_mean
+from woodtools.plotting import ucl_figure
+
+class RotationWidget:
+    
+    def __init__(
+        self,
+        state_manager: StateManager,
+        volume: np.ndarray | None = None,
+        vmin: float | None = None,
+        vmax: float | None = None,
+        figsize: tuple[float, float] = (18, 6),
+        ID: str | None = None,
+        alpha_range: tuple[float, float] = (-20.0, 20.0),
+        preview_factor: int = 1,
+        cache_bytes: int = 2**30,
+        runner: JobRunner | None = None
+    ) -> None:
+        """
+        Widget to interactively choose and apply an in-plane rotation.
+
+        The preview rotates the upper, center and lower slice in a single batched
+        call and caches the results per (angle, mode) in an LRU cache bounded
+        by `cache_bytes`. With `preview_factor` > 1
+        the preview runs on a block-averaged copy of the slices to keep large
+        slices responsive. Per-frame latencies are recorded in `frame_times`.
+        With a `runner`, the full-volume rotation runs in the background with
+        progress and cancellation; a new rotation cancels a still running one.
+        """
+        self.state_manager = state_manager
+        self.base_item = state_manager.item
+        self.runner = runner
+        self.volume = self.deduce_volume() if volume is None else volume
+        # fall back to the display window recorded when the dataset was loaded
+        window = self.base_item.parameters.get('window', {})
+        self.vmin = window.get('vmin') if vmin is None else vmin
+        self.vmax = window.get('vmax') if vmax is None else vmax
+        self.figsize = figsize
+        self.ID = ID or self.deduce_ID()
+        
+        self.fig, self.axes, self.mapping = ucl_figure(
+            self.volume, vmin=self.vmin, vmax=self.vmax, figsize=self.figsize, ID=self.ID
+        )
+
+        self.preview_factor = preview_factor
+        self.preview_stack = np.stack([
+            block_mean(items['data'], (preview_factor, preview_factor)) if preview_factor > 1
+            else items['data']
+            for items in self.mapping.values()
+        ])
+        self.preview_cache = ByteLRUCache(cache_bytes)
+        self.frame_times: deque[dict] = deque(maxlen=1000)
+        
+        alpha_min, alpha_max = alpha_range
+        self.angle_slider = widgets.FloatSlider(
+            value=0, min=alpha_min, max=alpha_max, step=0.1, desc='Angle Slider [deg]'
+        )
+        self.rotate_button = widgets.Button(description='Rotate', icon='gear')
+        self.interpolation_dropdown = widgets.Dropdown(options=['nearest', 'bilinear'])
+        self.progress_bar = widgets.FloatProgress(value=0.0, min=0.0, max=1.0)
+        self.status_label = widgets.Label()
+        self.cancel_button = widgets.Button(description='Cancel', icon='stop')
+        
+        self.setup_widgets()
+        
+        
+    def deduce_ID(self) -> str:
+        return self.state_manager.item.ID
+    
+    def deduce_volume(self) -> np.ndarray:
+        return self.state_manager.item.volume
+    
+    def preview(self, angle: float, mode: str) -> np.ndarray:
+        """Rotated (3 x H x W) preview stack, served from the cache if possible."""
+        key = (round(angle, 6), mode)
+        rotated = self.preview_cache.get(key)
+        if rotated is None:
+            rotated = rotate_slab(
+                self.preview_stack, angle, vtransforms.InterpolationMode(mode)
+            )
+            self.preview_cache.put(key, rotated)
+        return rotated
+
+    def _callback(self, change):
+        start = time.perf_counter()
+        angle = self.angle_slider.value
+        mode = self.interpolation_dropdown.value
+        cached = (round(angle, 6), mode) in self.preview_cache
+        rotated = self.preview(angle, mode)
+        rotated_time = time.perf_counter()
+        for items, transformed_data in zip(self.mapping.values(), rotated):
+            items['image'].set_data(transformed_data)
+
+        self.fig.suptitle(f'Angle: {angle:.2f} deg')
+        self.fig.canvas.draw_idle()
+        end = time.perf_counter()
+        self.frame_times.append({
+            'angle': angle, 'mode': mode, 'cached': cached,
+            'rotate': rotated_time - start, 'update': end - rotated_time, 'total': end - start
+        })
+        return
+
+    def latency_summary(self) -> dict[str, float]:
+        """Mean and 95th percentile of the recorded preview frame latencies in seconds."""
+        if not self.frame_times:
+            return {}
+        totals = np.array([frame['total'] for frame in self.frame_times])
+        return {
+            'frames': len(totals),
+            'cached': sum(frame['cached'] for frame in self.frame_times),
+            'mean': float(totals.mean()),
+            'p95': float(np.percentile(totals, 95)),
+            'max': float(totals.max())
+        }
+    
+    def get_interpolation_mode(self) -> vtransforms.InterpolationMode:
+        return vtransforms.InterpolationMode(self.interpolation_dropdown.value)
+    
+    def build_rotated_item(
+        self,
+        job: Job | None,
+        angle: float,
+        mode: vtransforms.InterpolationMode
+    ) -> WorkItem:
+        # rotate the item the widget was created for (not a previous rotation result);
+        # the widget may display a preview: rotate the full-resolution volume
+        with instrumentation.span('widget.rotate', angle=angle, mode=str(mode)) as span:
+            workitem = self.base_item.copy().materialize()
+            volume = workitem.volume
+            # beyond the RAM budget of the state manager, the result is memory-mapped
+            rotated_volume = self.state_manager.allocate(volume.shape, volume.dtype)
+            D = volume.shape[-3]
+            for slab in iter_slabs(D, slab_depth(volume)):
+                if job is not None:
+                    job.check()
+                    job.report(slab.start / D)
+                rotated_volume[..., slab, :, :] = rotate_slab(
+                    volume[..., slab, :, :], angle=angle, mode=mode
+                )
+
+        rotation_paramters = {'angle' : angle, 'mode' : str(mode)}
+        workitem.volume = rotated_volume
+        workitem.parameters['rotation'] = rotation_paramters
+        instrumentation.attach(workitem, span)
+        return workitem
+    
+    def rotate(self, *args, **kwargs):
+        angle = self.angle_slider.value
+        mode = self.get_interpolation_mode()
+        if self.runner is not None:
+            self.runner.submit(
+                'rotate', self.build_rotated_item, angle, mode, on_progress=self.show_progress,
+                on_error=self.show_error
+            )
+            return
+        self.state_manager.update(self.build_rotated_item(None, angle, mode))
+
+    def show_progress(self, job: Job) -> None:
+        self.progress_bar.bar_style = ''
+        self.status_label.value = ''
+        self.progress_bar.value = job.progress
+
+    def show_error(self, job: Job, error: BaseException) -> None:
+        """Mark the failed job in the progress area instead of failing silently."""
+        self.progress_bar.bar_style = 'danger'
+        self.status_label.value = f'{job.key} failed: {type(error).__name__}: {error}'
+
+    def cancel(self, *args, **kwargs):
+        if self.runner is not None:
+            self.runner.cancel('rotate')
+
+    def setup_widgets(self):
+        self.angle_slider.observe(self._callback, names='value')
+        self.interpolation_dropdown.observe(self._callback, names='value')
+        self.rotate_button.on_click(self.rotate)
+        children = [self.angle_slider, self.interpolation_dropdown, self.rotate_button]
+        if self.runner is not None:
+            self.cancel_button.on_click(self.cancel)
+            children.extend([self.progress_bar, self.cancel_button, self.status_label])
+        display(widgets.HBox(children))
@@ -0,0 +1,109 @@
+"""
+Slice access with an LRU cache and read-ahead prefetching for interactive sliders.
+
+@Author: Jannik Stebani
+"""
+import threading
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from woodtools.pipeline.cache import ByteLRUCache
+
+
+class SliceProvider:
+    """
+    Serve z-slices of a (possibly zarr- or memmap-backed) volume.
+
+    Recently used slices are kept in an LRU cache of at most `cache_bytes`.
+    After every access the next `prefetch` slices in the direction of travel are
+    read in the background, so scrubbing through a stack hits the cache instead of blocking on disk reads.
+    Hit, miss and wait counters are exposed via `statistics`; a wait is a request
+    for a slice whose prefetch was still in flight.
+    """
+    def __init__(
+        self,
+        volume: np.ndarray,
+        cache_bytes: int = 256 * 2**20,
+        prefetch: int = 4,
+        workers: int = 2
+    ) -> None:
+        self.volume = volume
+        self.prefetch = prefetch
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.prefetched = 0
+        self._cache = ByteLRUCache(cache_bytes)
+        self._pending: dict[int, Future] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        # does not reference self: the worker threads stop with the provider
+        self._finalizer = weakref.finalize(
+            self, self._executor.shutdown, wait=False, cancel_futures=True
+        )
+        self._last_index: int | None = None
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self.volume.shape
+
+    def __len__(self) -> int:
+        return self.volume.shape[0]
+
+    def _read(self, index: int) -> np.ndarray:
+        return np.asarray(self.volume[index])
+
+    def _fetch(self, index: int) -> np.ndarray:
+        data = self._read(index)
+        self._cache.put(index, data)
+        with self._lock:
+            self._pending.pop(index, None)
+        return data
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        index = range(len(self))[index]
+        with self._lock:
+            data = self._cache.get(index)
+            future = self._pending.get(index)
+        if data is not None:
+            self.hits += 1
+        elif future is not None:
+            # prefetch in flight: waiting is still cheaper than a second read
+            self.waits += 1
+            data = future.result()
+        else:
+            self.misses += 1
+            data = self._fetch(index)
+
+        direction = 1 if self._last_index is None or index >= self._last_index else -1
+        self._last_index = index
+        self._schedule_prefetch(index, direction)
+        return data
+
+    def _schedule_prefetch(self, index: int, direction: int) -> None:
+        if not self._finalizer.alive:
+            return
+        for step in range(1, self.prefetch + 1):
+            neighbour = index + direction * step
+            if not 0 <= neighbour < len(self):
+                break
+            with self._lock:
+                if neighbour in self._cache or neighbour in self._pending:
+                    continue
+                self._pending[neighbour] = self._executor.submit(self._fetch, neighbour)
+            self.prefetched += 1
+
+    @property
+    def statistics(self) -> dict[str, float]:
+        requests = self.hits + self.misses + self.waits
+        return {
+            'hits': self.hits, 'misses': self.misses, 'waits': self.waits,
+            'prefetched': self.prefetched,
+            'hit_rate': self.hits / requests if requests else 0.0
+        }
+
+    def close(self) -> None:
+        """Cancel pending prefetches and stop the worker threads."""
+        self._finalizer()
@@ -1,24 +1,125 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import weakref
+from collections.abc import Callable
 from copy import deepcopy
+from pathlib import Path
 
 import numpy as np
 import attrs
 
 
+def readonly(volume: np.ndarray) -> np.ndarray:
+    """Read-only view of the volume that shares its buffer."""
+    view = volume.view()
+    view.flags.writeable = False
+    return view
+
+
+def buffer_root(volume: np.ndarray) -> object:
+    """The object owning the memory of the (possibly viewed) volume."""
+    root = volume
+    while isinstance(root, np.ndarray) and root.base is not None:
+        root = root.base
+    return root
+
+
+def _view_key(volume: np.ndarray) -> tuple:
+    """Identity of the memory a volume view covers: views with equal keys hold the same data."""
+    return (id(buffer_root(volume)), volume.__array_interface__['data'][0],
+            volume.shape, volume.strides, volume.dtype.str)
+
+
+def spill_volume(volume: np.ndarray, directory: Path) -> np.memmap:
+    """Write the volume to a .npy file in the directory and return a read-only memory map of it."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{uuid.uuid4().hex}.npy'
+    np.save(path, volume)
+    return np.load(path, mmap_mode='r')
+
+
+def scratch_volume(shape: tuple[int, ...], dtype: np.dtype, directory: Path) -> np.memmap:
+    """Writable memory-mapped .npy volume in the directory, e.g. for intermediates beyond the RAM budget."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    path = directory / f'{uuid.uuid4().hex}.npy'
+    return np.lib.format.open_memmap(path, mode='w+', shape=tuple(shape), dtype=dtype)
+
+
 @attrs.define
 class WorkItem:
     ID: str | None = None
     volume: np.ndarray | None = None
     parameters: dict = attrs.field(factory=dict)
+    loader: Callable[[], np.ndarray] | None = attrs.field(default=None, repr=False)
+    # set once a copy shares the (still writable) volume buffer of this item
+    _shared: bool = attrs.field(default=False, init=False, repr=False, eq=False)
+
+    @property
+    def is_preview(self) -> bool:
+        """True if the volume is a low-resolution preview of a lazily loadable volume."""
+        return self.loader is not None
+
+    def materialize(self) -> 'WorkItem':
+        """
+        Replace a preview volume by the full-resolution volume from the loader.
+        No-op for items that already hold the full volume.
+        """
+        if self.loader is not None:
+            self.volume = self.loader()
+            self._shared = False
+            self.loader = None
+            self.parameters.pop('preview', None)
+        return self
 
     def copy(self) -> 'WorkItem':
         """
-        Create a copy of the current WorkItem instance.
+        Create a copy-on-write copy of the current WorkItem instance.
+        The copy holds a read-only view of the volume buffer, parameters are
+        copied. This item keeps its volume unchanged, so in-place modifications
+        of either volume must go through `mutable_volume`.
         """
+        if self.volume is not None:
+            self._shared = True
         return WorkItem(
             ID=self.ID,
-            volume=self.volume.copy() if self.volume is not None else None,
-            parameters=deepcopy(self.parameters)
+            volume=readonly(self.volume) if self.volume is not None else None,
+            parameters=deepcopy(self.parameters),
+            loader=self.loader
         )
+
+    def mutable_volume(self) -> np.ndarray:
+        """
+        Writable volume of this item. Shared or read-only buffers are copied
+        on the first call, so other items are never affected.
+        """
+        if self.volume is not None and (self._shared or not self.volume.flags.writeable):
+            self.volume = np.array(self.volume)
+            self._shared = False
+        return self.volume
+
+    @property
+    def nbytes(self) -> int:
+        return self.volume.nbytes if self.volume is not None else 0
+
+    @property
+    def is_spilled(self) -> bool:
+        """True if the volume lives in a memory-mapped scratch file instead of RAM."""
+        return isinstance(self.volume, np.memmap)
+
+    def spill(self, directory: Path) -> 'WorkItem':
+        """
+        Move the volume to a read-only memory-mapped file in the directory.
+        The memory map is a `np.ndarray` subclass, so consumers work unchanged
+        while the page cache keeps hot regions in memory.
+        """
+        if self.volume is not None and not self.is_spilled:
+            self.volume = spill_volume(self.volume, directory)
+        return self
     
 
     def __repr__(self):
@@ -39,17 +140,214 @@ class WorkItem:
 class StateManager:
     """
     Manage the state across multiple widgets.
+
+    Replaced items are kept in an undo/redo history. Volumes of history items
+    count against `history_bytes` (buffers shared with other items only once).
+    Over budget, the oldest history volumes are spilled to memory-mapped files
+    in `spill_dir` if given, otherwise the oldest history items are dropped.
+
+    With a `ram_budget`, the in-memory volumes of the current item and the
+    history together are kept below the budget by spilling history volumes
+    (oldest first) and finally the current volume to memory-mapped files in
+    `spill_dir` (default: a temporary directory). `allocate` hands out
+    memory-mapped scratch volumes for intermediates that would exceed it.
+    The files of items dropped from the history are deleted; the temporary
+    directory is removed by `close` or when the manager is garbage collected.
+
+    State changes are serialized by a lock and observers are notified while it
+    is held, so updates from background jobs are applied atomically and
+    observers always see a fully constructed `WorkItem`.
     """
     def __init__(
         self,
         initial_item: WorkItem = WorkItem(),
+        history_bytes: int = 4 * 2**30,
+        history_length: int = 32,
+        spill_dir: Path | None = None,
+        ram_budget: int | None = None
     ) -> None:
         self.item = initial_item
         self.observers: list = []
+        self.history_bytes = history_bytes
+        self.history_length = history_length
+        self.spill_dir = spill_dir
+        self.ram_budget = ram_budget
+        # created on demand for the RAM budget, does not enable history spilling
+        self._temp_spill_dir: Path | None = None
+        self.undo_stack: list[WorkItem] = []
+        self.redo_stack: list[WorkItem] = []
+        self.lock = threading.RLock()
+        self._finalizer: weakref.finalize | None = None
 
     def update(self, new_item: WorkItem) -> None:
-        self.item = new_item
-        self.notify_observers()
+        with self.lock:
+            self.undo_stack.append(self.item)
+            dropped, self.redo_stack = self.redo_stack, []
+            self.item = new_item
+            for item in dropped:
+                self._discard(item)
+            self.enforce_history_budget()
+            self.enforce_ram_budget()
+            self.notify_observers()
+
+    def undo(self) -> bool:
+        """Step back to the previous item. Returns False if there is no history."""
+        with self.lock:
+            if not self.undo_stack:
+                return False
+            self.redo_stack.append(self.item)
+            self.item = self.undo_stack.pop()
+            self.notify_observers()
+            return True
+
+    def redo(self) -> bool:
+        """Re-apply the last undone item. Returns False if there is nothing to redo."""
+        with self.lock:
+            if not self.redo_stack:
+                return False
+            self.undo_stack.append(self.item)
+            self.item = self.redo_stack.pop()
+            self.notify_observers()
+            return True
+
+    def history_nbytes(self) -> int:
+        """In-memory bytes held only by the history, counting shared buffers once."""
+        seen = {id(buffer_root(self.item.volume))} if self.item.volume is not None else set()
+        total = 0
+        for item in (*self.undo_stack, *self.redo_stack):
+            if item.volume is None or item.is_spilled:
+                continue
+            root = id(buffer_root(item.volume))
+            if root not in seen:
+                seen.add(root)
+                total += item.volume.nbytes
+        return total
+
+    def resident_nbytes(self) -> int:
+        """In-memory bytes of the current item and the history, counting shared buffers once."""
+        seen = set()
+        total = 0
+        for item in (self.item, *self.undo_stack, *self.redo_stack):
+            if item.volume is None or item.is_spilled:
+                continue
+            root = id(buffer_root(item.volume))
+            if root not in seen:
+                seen.add(root)
+                total += item.volume.nbytes
+        return total
+
+    def spill_directory(self) -> Path:
+        """The user-supplied `spill_dir`, otherwise a temporary directory."""
+        if self.spill_dir is not None:
+            return self.spill_dir
+        if self._temp_spill_dir is None:
+            self._temp_spill_dir = Path(tempfile.mkdtemp(prefix='woodtools-spill-'))
+            # does not reference self: the directory goes away with the manager
+            self._finalizer = weakref.finalize(
+                self, shutil.rmtree, self._temp_spill_dir, ignore_errors=True
+            )
+        return self._temp_spill_dir
+
+    def close(self) -> None:
+        """Remove the temporary spill directory, if one was created. Spilled volumes become invalid."""
+        if self._finalizer is not None:
+            self._finalizer()
+
+    def enforce_ram_budget(self) -> None:
+        """Spill history volumes (oldest first), then the current volume, until within the RAM budget."""
+        if self.ram_budget is None:
+            return
+        items = (*self.undo_stack, *reversed(self.redo_stack), self.item)
+        for item in items:
+            if self.resident_nbytes() <= self.ram_budget:
+                return
+            if item.volume is None or item.is_spilled:
+                continue
+            self._spill_shared(item, items, self.spill_directory())
+
+    def _spill_shared(self, item: WorkItem, items: tuple[WorkItem, ...], directory: Path) -> None:
+        """
+        Spill the volume of the item to a single file that also replaces the
+        identical (same buffer, offset, shape and strides) volumes of the other
+        items, so a copy-on-write buffer is written once and actually leaves RAM.
+        """
+        volume = item.volume
+        key = _view_key(volume)
+        item.spill(directory)
+        for other in items:
+            if other.volume is not None and not other.is_spilled and _view_key(other.volume) == key:
+                other.volume = item.volume
+
+    def allocate(self, shape: tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        """
+        Empty volume for an intermediate result: in RAM if it fits into the
+        remaining RAM budget, otherwise a writable memory-mapped scratch file.
+        """
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if self.ram_budget is None or self.resident_nbytes() + nbytes <= self.ram_budget:
+            return np.empty(shape, dtype=dtype)
+        return scratch_volume(shape, dtype, self.spill_directory())
+
+    def _discard(self, item: WorkItem) -> None:
+        """Release an item dropped from the history and delete its spill file unless still in use."""
+        if not item.is_spilled:
+            return
+        filename = item.volume.filename
+        item.volume = None
+        in_use = any(
+            other.is_spilled and other.volume.filename == filename
+            for other in (self.item, *self.undo_stack, *self.redo_stack)
+        )
+        if not in_use:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+
+    def _history_holders(self, item: WorkItem) -> list[WorkItem] | None:
+        """
+        History items holding the buffer of the item in memory, or None if the
+        current item holds it as well, so releasing them would free nothing.
+        """
+        root = buffer_root(item.volume)
+        if (self.item.volume is not None and not self.item.is_spilled
+                and buffer_root(self.item.volume) is root):
+            return None
+        return [
+            other for other in (*self.undo_stack, *self.redo_stack)
+            if other.volume is not None and not other.is_spilled
+            and buffer_root(other.volume) is root
+        ]
+
+    def enforce_history_budget(self) -> None:
+        """
+        Spill or drop the oldest history items until within `history_bytes`.
+        A buffer is only released together with all history items holding it,
+        items sharing it with the current item are kept as they cost nothing.
+        """
+        while len(self.undo_stack) > self.history_length:
+            self._discard(self.undo_stack.pop(0))
+        for item in list(self.undo_stack):
+            if self.history_nbytes() <= self.history_bytes:
+                return
+            if item.volume is None or item.is_spilled:
+                continue
+            holders = self._history_holders(item)
+            if holders is None:
+                continue
+            if self.spill_dir is not None:
+                history = (*self.undo_stack, *self.redo_stack)
+                for holder in holders:
+                    if not holder.is_spilled:
+                        self._spill_shared(holder, history, self.spill_dir)
+            elif all(any(holder is other for other in self.undo_stack) for holder in holders):
+                # compared by identity: WorkItem equality would compare volumes
+                self.undo_stack = [
+                    other for other in self.undo_stack
+                    if not any(other is holder for holder in holders)
+                ]
+                for holder in holders:
+                    self._discard(holder)
     
     def register_observer(self, observer) -> None:
         # Register an observer to be notified on state changes
@@ -0,0 +1,119 @@
+"""
+Helpers to create zarr targets and to iterate over them in z-slabs.
+
+Writers accept a chunk shape and a `Codec` describing the Blosc compression.
+The defaults (16-slice z-slabs of 1024 x 1024 tiles, zstd level 3 with byte
+shuffle) favour z-slab access of integer CT data.
+
+@Author: Jannik Stebani
+"""
+from collections.abc import Iterator, Sequence
+from pathlib import Path
+
+import attrs
+import numcodecs
+import numpy as np
+import zarr
+from zarr.codecs import BloscCodec
+
+
+DEFAULT_SLAB_DEPTH: int = 16
+DEFAULT_TILE_SIZE: int = 1024
+
+BLOSC_CNAMES: tuple[str, ...] = ('zstd', 'lz4', 'lz4hc', 'blosclz', 'zlib')
+BLOSC_SHUFFLES: dict[str, int] = {
+    'noshuffle': numcodecs.Blosc.NOSHUFFLE,
+    'shuffle': numcodecs.Blosc.SHUFFLE,
+    'bitshuffle': numcodecs.Blosc.BITSHUFFLE
+}
+
+
+@attrs.define(frozen=True)
+class Codec:
+    """
+    Blosc compression settings for zarr writers.
+    A `cname` of None writes uncompressed chunks.
+    """
+    cname: str | None = attrs.field(
+        default='zstd', validator=attrs.validators.optional(attrs.validators.in_(BLOSC_CNAMES))
+    )
+    clevel: int = attrs.field(default=3, validator=attrs.validators.in_(range(10)))
+    shuffle: str = attrs.field(default='shuffle', validator=attrs.validators.in_(BLOSC_SHUFFLES))
+
+    def compressors(self, zarr_format: int) -> tuple:
+        """
+        Compressor specification for arrays of the zarr format: numcodecs
+        codecs for format 2 and bytes-to-bytes codecs for format 3.
+        """
+        if self.cname is None:
+            return ()
+        if zarr_format == 2:
+            return (numcodecs.Blosc(cname=self.cname, clevel=self.clevel,
+                                    shuffle=BLOSC_SHUFFLES[self.shuffle]),)
+        return (BloscCodec(cname=self.cname, clevel=self.clevel, shuffle=self.shuffle),)
+
+    def asdict(self) -> dict:
+        return attrs.asdict(self)
+
+
+DEFAULT_CODEC: Codec = Codec()
+
+
+def default_chunks(
+    shape: Sequence[int],
+    depth: int = DEFAULT_SLAB_DEPTH,
+    tile: int = DEFAULT_TILE_SIZE
+) -> tuple[int, ...]:
+    """
+    Chunk shape for z-slab access: `depth` slices along the z-axis (axis -3)
+    and in-plane tiles of at most `tile` x `tile` pixels.
+    Leading axes (e.g. channels) are chunked with size 1.
+    """
+    *lead, D, H, W = shape
+    return (*(1 for _ in lead), min(depth, D), min(tile, H), min(tile, W))
+
+
+def iter_slabs(length: int, depth: int) -> Iterator[slice]:
+    """Iterate over consecutive slices of (at most) `depth` elements covering `length`."""
+    for start in range(0, length, depth):
+        yield slice(start, min(start + depth, length))
+
+
+def slab_depth(array) -> int:
+    """Depth of the z-chunks of a zarr array or the default depth for plain arrays."""
+    chunks = getattr(array, 'chunks', None)
+    if chunks is None:
+        return DEFAULT_SLAB_DEPTH
+    return chunks[-3]
+
+
+def create_array(
+    target: Path | zarr.Group,
+    name: str,
+    shape: Sequence[int],
+    dtype: np.dtype,
+    chunks: Sequence[int] | None = None,
+    codec: Codec | None = None
+) -> zarr.Array:
+    """
+    Create an empty array `name` inside the zarr group at `target`.
+    Refuses to overwrite an already existing array.
+
+    Parameters
+    ----------
+
+    chunks : Sequence[int], optional
+        Chunk shape. Defaults to `default_chunks(shape)`.
+
+    codec : Codec, optional
+        Compression settings. Defaults to `DEFAULT_CODEC`.
+    """
+    group = target if isinstance(target, zarr.Group) else zarr.open_group(target, mode='a')
+    if name in group:
+        raise FileExistsError(f'cannot write to: \'{name}\' in \'{target}\': would overwrite existing')
+    chunks = tuple(chunks) if chunks is not None else default_chunks(shape)
+    codec = codec or DEFAULT_CODEC
+    return group.create_array(
+        name=name, shape=tuple(shape), chunks=chunks, dtype=dtype, fill_value=0,
+        compressors=codec.compressors(group.metadata.zarr_format)
+    )
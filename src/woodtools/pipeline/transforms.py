@@ -1,55 +1,329 @@
-import warnings
 from pathlib import Path
 
+from typing import TYPE_CHECKING
+
 import numpy as np
-import torch
-import torchvision.transforms as vtransforms
 import zarr
 
+from woodtools import instrumentation
+from woodtools.pipeline.parallel import run_threaded
+from woodtools.pipeline.storage import (
+    create_array, default_chunks, iter_slabs, Codec, DEFAULT_SLAB_DEPTH
+)
+
+if TYPE_CHECKING:
+    import torch
+    from woodtools.pipeline.resultcache import ResultCache
+
+
+# bump when the downsampling results change, invalidates cached results
+DOWNSAMPLE_VERSION: int = 2
+
+
+def _target_size(shape: tuple[int, ...], in_plane_target: int) -> tuple[int, int, int]:
+    """
+    Output size of the trailing (D x H x W) axes: the longer in-plane edge is
+    scaled to `in_plane_target` and the other axes by the same factor.
+    Leading axes (e.g. channels) are kept as they are.
+    """
+    if len(shape) < 3:
+        raise ValueError(f'expecting (... x D x H x W) volumes, got {len(shape)}D')
+    D, H, W = shape[-3:]
+    factor = in_plane_target / max(H, W)
+    return tuple(max(1, int(np.round(factor * size))) for size in (D, H, W))
+
+
+def _integer_factors(
+    shape: tuple[int, ...],
+    target_size: tuple[int, int, int]
+) -> tuple[int, int, int] | None:
+    """Per-axis reduction factors if every trailing axis shrinks by an integer factor."""
+    factors = []
+    for size, target in zip(shape[-3:], target_size):
+        if size % target:
+            return None
+        factors.append(size // target)
+    return tuple(factors)
+
+
+def _accumulator_dtype(dtype: np.dtype) -> np.dtype:
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.unsignedinteger):
+        return np.dtype(np.uint64)
+    if np.issubdtype(dtype, np.integer):
+        return np.dtype(np.int64)
+    return np.dtype(np.float64)
+
+
+def block_mean(data: np.ndarray, factors: tuple[int, ...]) -> np.ndarray:
+    """
+    Average non-overlapping blocks of the trailing `len(factors)` axes.
+    Axes that are not a multiple of their factor are edge-padded, so the output
+    size is the ceiling of the input size over the factor. Accumulation happens in
+    a wide type (64 bit integer or float) and the result has the source dtype,
+    with integer results rounded half up.
+    """
+    lead = data.ndim - len(factors)
+    pad = [(0, 0)] * lead + [(0, -size % factor) for size, factor in zip(data.shape[lead:], factors)]
+    if any(after for _, after in pad):
+        data = np.pad(data, pad, mode='edge')
+    blocked_shape = list(data.shape[:lead])
+    for size, factor in zip(data.shape[lead:], factors):
+        blocked_shape.extend((size // factor, factor))
+    sum_axes = tuple(lead + 2 * i + 1 for i in range(len(factors)))
+    accumulator = _accumulator_dtype(data.dtype)
+    total = data.reshape(blocked_shape).sum(axis=sum_axes, dtype=accumulator)
+    count = int(np.prod(factors))
+    if np.issubdtype(accumulator, np.integer):
+        return ((total + count // 2) // count).astype(data.dtype)
+    return (total / count).astype(data.dtype)
+
+
+def _restore_dtype(result: np.ndarray, dtype: np.dtype) -> np.ndarray:
+    """Cast a float32 result back to the source dtype, rounding and clipping integers."""
+    dtype = np.dtype(dtype)
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        result = np.clip(np.rint(result), info.min, info.max)
+    return result.astype(dtype, copy=False)
+
+
+def _linear_source_indices(
+    out_indices: np.ndarray,
+    in_size: int,
+    out_size: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Source indices and weights of linear interpolation along one axis,
+    following the `align_corners=False` convention of `torch.nn.functional.interpolate`.
+    """
+    scale = in_size / out_size
+    coords = np.maximum(scale * (out_indices + 0.5) - 0.5, 0.0)
+    lower = np.floor(coords).astype(np.int64)
+    upper = lower + (lower < in_size - 1)
+    return lower, upper, coords - lower
+
+
+def _downsample_slab(
+    data: np.ndarray | zarr.Array,
+    out_slab: slice,
+    target_size: tuple[int, int, int]
+) -> np.ndarray:
+    """
+    Downsampling of the output z-slab `out_slab` in the source dtype.
+    Only the source slices the slab depends on are read.
+
+    If every axis shrinks by an integer factor, the slab is the block mean of the
+    source blocks, accumulated in a wide type. Otherwise it is computed in float32
+    by trilinear interpolation, which is separable: the in-plane part is a
+    bilinear interpolation of every source slice (including the interpolation
+    halo), followed by a linear interpolation along the z-axis.
+    """
+    *lead, D, H, W = data.shape
+    factors = _integer_factors(data.shape, target_size)
+    if factors is not None:
+        z_factor = factors[0]
+        with instrumentation.span('downsample.read') as span:
+            slab = np.asarray(data[..., out_slab.start * z_factor:out_slab.stop * z_factor, :, :])
+            span.add(bytes_read=slab.nbytes)
+        return block_mean(slab, factors)
+
+    import torch
+
+    z_target, *in_plane_size = target_size
+    lower, upper, weights = _linear_source_indices(
+        np.arange(out_slab.start, out_slab.stop), D, z_target
+    )
+    start, stop = lower.min(), upper.max() + 1
+    with instrumentation.span('downsample.read') as span:
+        slab = np.asarray(data[..., start:stop, :, :])
+        span.add(bytes_read=slab.nbytes)
+    # leading axes are folded into a single channel axis: (d x C x H x W)
+    slab = torch.as_tensor(
+        slab.reshape(-1, *slab.shape[-3:]).astype(np.float32, copy=False)
+    ).transpose(0, 1)
+    planes = torch.nn.functional.interpolate(slab, size=tuple(in_plane_size), mode='bilinear')
+    weights = torch.as_tensor(weights, dtype=planes.dtype).reshape(-1, 1, 1, 1)
+    lower_planes = planes[torch.as_tensor(lower - start)]
+    upper_planes = planes[torch.as_tensor(upper - start)]
+    result = ((1 - weights) * lower_planes + weights * upper_planes).transpose(0, 1).numpy()
+    return _restore_dtype(result.reshape(*lead, *result.shape[-3:]), data.dtype)
+
+
+def downsample(volume: np.ndarray, in_plane_target: int) -> np.ndarray:
+    """
+    Downsample the (... x D x H x W) volume such that its longer in-plane edge
+    is `in_plane_target` and the z-axis is scaled by the same factor.
+    Leading (e.g. channel) axes are kept.
+
+    Integer reduction factors take the block-mean fast path, other factors are
+    interpolated trilinearly in float32. The result has the source dtype and
+    is computed in z-slabs, so the float32 working memory stays small.
+    """
+    target_size = _target_size(volume.shape, in_plane_target)
+    downsampled_volume = np.empty((*volume.shape[:-3], *target_size), dtype=volume.dtype)
+    for out_slab in iter_slabs(target_size[0], DEFAULT_SLAB_DEPTH):
+        downsampled_volume[..., out_slab, :, :] = _downsample_slab(volume, out_slab, target_size)
+    return downsampled_volume
+
+
+def _slab_depth_for_budget(
+    shape: tuple[int, ...],
+    target_size: tuple[int, int, int],
+    itemsize: int,
+    memory_budget: int,
+    workers: int
+) -> int:
+    """Number of output slices per slab such that all workers together stay within the budget."""
+    *lead, D, H, W = shape
+    C = int(np.prod(lead))
+    z_target, H_target, W_target = target_size
+    source_slices_per_output = D / z_target + 1
+    # source planes and their float32 copy + bilinear planes of the halo + output
+    cost = C * (
+        (itemsize + 4) * source_slices_per_output * H * W
+        + 4 * (source_slices_per_output + 2) * H_target * W_target
+    )
+    return max(1, int(memory_budget // (workers * cost)))
+
+
+def downsample_zarr_streaming(
+    data: zarr.Array,
+    target: Path,
+    in_plane_target: int,
+    memory_budget: int,
+    workers: int = 1,
+    name: str = 'downsampled/sam-native',
+    progress: bool = True,
+    chunks: tuple[int, ...] | None = None,
+    codec: Codec | None = None
+) -> zarr.Array:
+    """
+    Downsampling of the (... x D x H x W) zarr array, see `downsample`, that
+    processes chunk-aligned output z-slabs and writes each one as soon as it
+    is finished. The output has the source dtype and records the
+    `in_plane_target` in its attributes.
+
+    Parameters
+    ----------
 
-def downsample(volume: np.ndarray, in_plane_target: int):
-    if not volume.ndim == 4:
-        raise ValueError(f'expecting 4D (C x D x H x W) images, got {volume.ndim}')
-    C, D, H, W = volume.shape
-    if C != 1:
-        warnings.warn(f'encountered non-unit channel dimension: {C}')
-    if not H == W:
-        raise ValueError(f'in-plane dim mismatch: not square {H=} {W=}')
-    
-    factor = in_plane_target / H
-    z_target = int(np.round(factor * D))
-    target_size = tuple((z_target, in_plane_target, in_plane_target))
-    
-    downsampled_volume = torch.nn.functional.interpolate(
-        torch.as_tensor(volume[np.newaxis, ...]), size=target_size, mode='trilinear'
+    data : zarr.Array
+        The source array.
+
+    target : Path
+        The zarr group that receives the result as array `name`.
+
+    in_plane_target : int
+        Target in-plane size, see `downsample`.
+
+    memory_budget : int
+        Approximate upper bound of working memory in bytes across all workers.
+        Determines the depth of the processed output z-slabs.
+
+    workers : int, optional
+        Number of slabs processed in parallel. Defaults to 1.
+
+    chunks : tuple[int, ...], optional
+        Chunk shape of the output. Defaults to z-slab chunks no deeper
+        than the slab depth the budget allows.
+
+    codec : Codec, optional
+        Compression of the output, see `woodtools.pipeline.storage.Codec`.
+
+    Returns
+    -------
+
+    array : zarr.Array
+        The written output array.
+    """
+    target_size = _target_size(data.shape, in_plane_target)
+    out_shape = (*data.shape[:-3], *target_size)
+    depth = _slab_depth_for_budget(
+        data.shape, target_size, np.dtype(data.dtype).itemsize, memory_budget, workers
     )
-    return downsampled_volume[0, ...]
+    if chunks is None:
+        chunks = default_chunks(out_shape, depth=min(DEFAULT_SLAB_DEPTH, depth))
+    # slabs cover whole output chunks, so no chunk is written by two workers
+    chunk_depth = chunks[-3]
+    depth = max(1, depth // chunk_depth) * chunk_depth
+    array = create_array(target, name, out_shape, data.dtype, chunks=chunks, codec=codec)
+    array.attrs['in_plane_target'] = in_plane_target
+
+    def process(out_slab: slice) -> None:
+        with instrumentation.span('downsample.slab'):
+            result = _downsample_slab(data, out_slab, target_size)
+        with instrumentation.span('downsample.write', bytes_written=result.nbytes):
+            array[..., out_slab, :, :] = result
+
+    run_threaded(process, iter_slabs(target_size[0], depth),
+                 workers=workers, progress=progress, unit='slab')
+    return array
 
 
 def downsample_zarr(
     source: Path,
     target: Path,
-    in_plane_target: int
+    in_plane_target: int,
+    memory_budget: int | None = None,
+    workers: int = 1,
+    chunks: tuple[int, ...] | None = None,
+    codec: Codec | None = None,
+    cache: 'ResultCache | None' = None
 ) -> Path:
+    """
+    Downsample the `downsampled/half` array of the source store into
+    `downsampled/sam-native` of the target store.
+    If a memory budget in bytes is given, the volume is processed out-of-core
+    in z-slabs (optionally with parallel workers) instead of fully in memory.
+    The output is written with the given chunk shape and codec
+    (default: z-slab chunks, `woodtools.pipeline.storage.DEFAULT_CODEC`).
+    With a result cache, an unchanged source downsampled with the same
+    parameters before is materialized from the cache instead.
+    """
     if target.exists():
         raise FileExistsError(f'cannot write to: \'{target}\': would overwrite existing')
+    if cache is not None:
+        parameters = {
+            'version': DOWNSAMPLE_VERSION, 'in_plane_target': in_plane_target,
+            'chunks': chunks, 'codec': codec.asdict() if codec is not None else None
+        }
+        cache.materialize_or_compute(
+            source, 'downsampled/half', 'downsample', parameters, target,
+            lambda: downsample_zarr(source, target, in_plane_target, memory_budget,
+                                    workers=workers, chunks=chunks, codec=codec)
+        )
+        return target
     data = zarr.open(source)['downsampled/half']
-    volume = data[...]
-    ds_volume = downsample(volume, in_plane_target)
-    out = zarr.open(target)
-    out['downsampled/sam-native'] = np.asarray(ds_volume)
+    with instrumentation.span('downsample_zarr', source=str(source)):
+        if memory_budget is not None:
+            downsample_zarr_streaming(data, target, in_plane_target, memory_budget,
+                                      workers=workers, chunks=chunks, codec=codec)
+            return target
+        with instrumentation.span('downsample_zarr.read') as span:
+            volume = data[...]
+            span.add(bytes_read=volume.nbytes)
+        with instrumentation.span('downsample_zarr.compute'):
+            ds_volume = downsample(volume, in_plane_target)
+        with instrumentation.span('downsample_zarr.write', bytes_written=ds_volume.nbytes):
+            out = create_array(target, 'downsampled/sam-native', ds_volume.shape,
+                               ds_volume.dtype, chunks=chunks, codec=codec)
+            out[...] = ds_volume
+            out.attrs['in_plane_target'] = in_plane_target
     return target
 
 
 def datatransform(
-    image: torch.Tensor | np.ndarray,
+    image: 'torch.Tensor | np.ndarray',
     angle: float,
     mode: str
 ) -> np.ndarray:
     assert image.ndim == 2, 'expecting planar image'
     image = image[np.newaxis, ...]
-    mode = vtransforms.transforms.InterpolationMode(mode)
-    image = torch.tensor(image)
+    import torch
+    import torchvision.transforms as vtransforms
+
+    mode = vtransforms.InterpolationMode(mode)
+    image = torch.as_tensor(image)
     rotated_image = vtransforms.functional.rotate(
         image, angle=angle, interpolation=mode
     )
@@ -1,13 +1,29 @@
+from collections.abc import Sequence
+from pathlib import Path
+
 import matplotlib.pyplot as plt
 import numpy as np
 
+from woodtools.dataloading import load_preview
+from woodtools.dataloading.statistics import display_window
+
 def ucl_figure(
     volume: np.ndarray,
     vmin=None,
     vmax=None,
     figsize: tuple[float, float] = (12, 3),
-    ID: str = ''
+    ID: str = '',
+    statistics: dict | None = None
 ) -> tuple:
+    """
+    Show the upper, center and lower slice of the volume side by side.
+    Without explicit `vmin`/`vmax`, the display window is taken from the
+    precomputed `statistics` (see `woodtools.dataloading.statistics`), if given.
+    """
+    if statistics is not None:
+        lower, upper = display_window(statistics)
+        vmin = lower if vmin is None else vmin
+        vmax = upper if vmax is None else vmax
     D, H, W = volume.shape
     uidx, cidx, lidx = 0, D //2, D - 1
     fig, axes = plt.subplots(ncols=3, figsize=figsize)
@@ -36,4 +52,41 @@ def ucl_figure(
     
     fig.suptitle('Angle: 0 deg')
     fig.tight_layout()
-    return (fig, axes, mapping)
\ No newline at end of file
+    return (fig, axes, mapping)
+
+
+def gallery_figure(
+    basepath: Path,
+    classes: Sequence[str] = ('acer', 'pinus'),
+    preview: str = 'max/z',
+    percentiles: tuple[float, float] = (1.0, 99.0),
+    cellsize: float = 2.5
+) -> tuple:
+    """
+    Show a precomputed preview (see `woodtools.pipeline.previews.build_previews`)
+    of every '{class}-*.zarr' dataset in the base path, one row per class.
+    Only the small preview arrays are read. Every image is windowed between
+    the `percentiles` of its own intensities; datasets without previews
+    are marked as missing.
+    """
+    rows = {class_: sorted(basepath.glob(f'{class_}-*.zarr')) for class_ in classes}
+    ncols = max([len(paths) for paths in rows.values()] + [1])
+    fig, axes = plt.subplots(nrows=len(classes), ncols=ncols, squeeze=False,
+                             figsize=(cellsize * ncols, cellsize * len(classes)))
+    mapping = {}
+    for row, (class_, paths) in zip(axes, rows.items()):
+        for ax in row:
+            ax.set_axis_off()
+        for ax, path in zip(row, paths):
+            ID = path.name.removesuffix('.zarr')
+            ax.set_title(ID, fontsize='small')
+            data = load_preview(path, preview)
+            if data is None:
+                ax.text(0.5, 0.5, 'no previews', transform=ax.transAxes, ha='center', va='center')
+                continue
+            data = np.squeeze(data)
+            vmin, vmax = np.percentile(data, percentiles)
+            mapping[ID] = {'ax': ax, 'path': path, 'image': ax.imshow(data, vmin=vmin, vmax=vmax)}
+    fig.suptitle(f'Preview: {preview}')
+    fig.tight_layout()
+    return (fig, axes, mapping)
@@ -0,0 +1,68 @@
+import threading
+import time
+
+import numpy as np
+
+from woodtools.pipeline.jobs import JobRunner
+from woodtools.pipeline.state import StateManager, WorkItem
+
+
+def make_runner():
+    state_manager = StateManager(WorkItem(ID='initial', volume=np.zeros((2, 2, 2))))
+    return state_manager, JobRunner(state_manager, on_error=None)
+
+
+def blocking_job(proceed: threading.Event, returned: threading.Event, ID: str):
+    def fn(job):
+        proceed.wait(timeout=5)
+        returned.set()
+        return WorkItem(ID=ID, volume=np.ones((2, 2, 2)))
+    return fn
+
+
+def test_cancel_after_job_function_returned_discards_result():
+    state_manager, runner = make_runner()
+    proceed, returned = threading.Event(), threading.Event()
+    job = runner.submit('load', blocking_job(proceed, returned, 'stale'))
+    with runner._lock:
+        proceed.set()
+        assert returned.wait(timeout=5)
+        # the job function has returned, the result is not applied yet
+        time.sleep(0.05)
+        assert runner.jobs.get('load') is job
+        runner.cancel('load')
+    job.future.result(timeout=5)
+    assert state_manager.item.ID == 'initial'
+    assert 'load' not in runner.jobs
+    runner.shutdown()
+
+
+def test_superseding_submit_after_job_function_returned_wins():
+    state_manager, runner = make_runner()
+    proceed, returned = threading.Event(), threading.Event()
+    stale = runner.submit('load', blocking_job(proceed, returned, 'stale'))
+    with runner._lock:
+        proceed.set()
+        assert returned.wait(timeout=5)
+        time.sleep(0.05)
+        fresh = runner.submit('load', lambda job: WorkItem(ID='fresh', volume=np.ones((2, 2, 2))))
+    stale.future.result(timeout=5)
+    fresh.future.result(timeout=5)
+    assert stale.cancelled
+    assert state_manager.item.ID == 'fresh'
+    assert [item.ID for item in state_manager.undo_stack] == ['initial']
+    runner.shutdown()
+
+
+def test_failed_job_leaves_state_unchanged():
+    state_manager, runner = make_runner()
+    errors = []
+
+    def fail(job):
+        raise ValueError('boom')
+
+    job = runner.submit('load', fail, on_error=lambda job, error: errors.append(error))
+    job.future.result(timeout=5)
+    assert state_manager.item.ID == 'initial'
+    assert isinstance(job.error, ValueError) and errors == [job.error]
+    runner.shutdown()
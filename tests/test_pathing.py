@@ -0,0 +1,57 @@
+import functools
+
+import numpy as np
+import pytest
+import zarr
+
+from woodtools.dataloading.regex import match_reko_file
+from woodtools.pipeline.pathing import (
+    assemble_array, export_tiff_stack, generate_path_mapping, index_directory
+)
+
+
+@pytest.fixture
+def volume(tmp_path):
+    data = np.random.default_rng(0).integers(0, 2**16, size=(13, 24, 20), dtype=np.uint16)
+    group = zarr.open_group(tmp_path / 'source.zarr', mode='w')
+    array = group.create_array('metric/raw', shape=data.shape, dtype=data.dtype, chunks=(4, 24, 20))
+    array[...] = data
+    return tmp_path / 'source.zarr', data
+
+
+@pytest.mark.parametrize('compression', [None, 'zlib'])
+def test_export_round_trip(tmp_path, volume, compression):
+    source, data = volume
+    directory = tmp_path / 'slices'
+    export_tiff_stack(source, directory, compression=compression, workers=2, progress=False)
+
+    mapping = generate_path_mapping(sorted(directory.iterdir()), match_reko_file)
+    assert list(mapping) == list(range(data.shape[0]))
+    assert np.array_equal(assemble_array(mapping, progress=False), data)
+
+    index = index_directory(directory, match_reko_file, use_index=False)
+    assert index.is_complete
+    assert np.array_equal(assemble_array(index.mapping, progress=False), data)
+
+
+def test_export_round_trip_suffix_and_start(tmp_path, volume):
+    source, data = volume
+    directory = tmp_path / 'slices'
+    path_mapping = export_tiff_stack(source, directory, suffix='_rot', start=100, progress=False)
+    assert list(path_mapping) == list(range(100, 100 + data.shape[0]))
+
+    match_fun = functools.partial(match_reko_file, suffix='_rot')
+    mapping = generate_path_mapping(sorted(directory.iterdir()), match_fun)
+    assert mapping == path_mapping
+    assert np.array_equal(assemble_array(mapping, progress=False), data)
+
+    index = index_directory(directory, match_fun, use_index=False)
+    assert np.array_equal(assemble_array(index.mapping, progress=False), data)
+
+
+def test_export_refuses_overwrite(tmp_path, volume):
+    source, _ = volume
+    directory = tmp_path / 'slices'
+    export_tiff_stack(source, directory, progress=False)
+    with pytest.raises(FileExistsError):
+        export_tiff_stack(source, directory, progress=False)
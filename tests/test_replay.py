@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+import zarr
+
+from woodtools.pipeline.manifest import DONE, SKIPPED
+from woodtools.pipeline.replay import (
+    recorded_downsampling, replay_batch, replay_dataset, save_parameters
+)
+from woodtools.pipeline.roi import extract_roi
+from woodtools.pipeline.state import WorkItem
+from woodtools.pipeline.transforms import downsample, downsample_zarr_streaming
+
+
+ROI = {'top_left': [2, 4], 'top_right': [26, 4],
+       'bottom_left': [2, 28], 'bottom_right': [26, 28], 'z_range': [4, 28]}
+
+
+@pytest.fixture
+def source(tmp_path):
+    data = np.random.default_rng(0).integers(0, 2**16, size=(1, 32, 32, 32), dtype=np.uint16)
+    path = tmp_path / 'source.zarr'
+    root = zarr.open_group(path, mode='w')
+    root.create_array('metric/raw', shape=data.shape, dtype=data.dtype, chunks=(1, 8, 32, 32))[...] = data
+    downsample_zarr_streaming(root['metric/raw'], path, 16, 2**20, progress=False)
+    return path, data
+
+
+def test_replay_derives_recorded_downsampling(tmp_path, source):
+    path, data = source
+    assert recorded_downsampling(path) == {'in_plane_target': 16}
+    target = tmp_path / 'target.zarr'
+    replay_dataset(path, target, {'roi': ROI})
+
+    result = zarr.open_group(target, mode='r')
+    cropped = extract_roi(data, ROI)
+    assert np.array_equal(result['metric/raw'][...], cropped)
+    assert np.array_equal(result['downsampled/sam-native'][...], downsample(cropped, 16))
+    assert result.attrs['replay']['parameters']['downsample'] == {'in_plane_target': 16}
+
+
+def test_replay_without_recorded_downsampling(tmp_path, source):
+    path, _ = source
+    del zarr.open_group(path, mode='a')['downsampled/sam-native']
+    target = tmp_path / 'target.zarr'
+    replay_dataset(path, target, {'roi': ROI})
+    assert 'downsampled/sam-native' not in zarr.open_group(target, mode='r')
+
+
+@pytest.mark.parametrize('roispec', [
+    ROI,
+    # crosses the image border: clipped as by extract_roi
+    {'top_left': [20, 24], 'top_right': [40, 24], 'bottom_left': [20, 40], 'bottom_right': [40, 40]},
+])
+def test_replay_rotation_equals_interactive_rotate_then_crop(tmp_path, source, roispec):
+    from woodtools.pipeline.rotations import interpolation_mode, rotate_slab
+
+    path, data = source
+    target = tmp_path / 'target.zarr'
+    rotation = {'angle': 17.3, 'mode': 'InterpolationMode.BILINEAR'}
+    replay_dataset(path, target, {'rotation': rotation, 'roi': roispec})
+
+    expected = extract_roi(rotate_slab(data, 17.3, interpolation_mode('bilinear')), roispec)
+    result = zarr.open_group(target, mode='r')['metric/raw'][...]
+    assert result.dtype == expected.dtype
+    assert np.array_equal(result, expected)
+
+
+def test_replay_batch_skips_foreign_targets(tmp_path, source):
+    path, data = source
+    sourcedir, parameterdir, targetdir = (tmp_path / name for name in ('in', 'parameters', 'out'))
+    sourcedir.mkdir()
+    targetdir.mkdir()
+    path.rename(sourcedir / 'a.zarr')
+    (sourcedir / 'b.zarr').symlink_to(sourcedir / 'a.zarr')
+    for ID in ('a', 'b'):
+        save_parameters(WorkItem(ID=ID, parameters={'roi': ROI}), parameterdir)
+    # not written by a previous run of this batch
+    zarr.open_group(targetdir / 'b.zarr', mode='w').attrs['foreign'] = True
+
+    summary = replay_batch(sourcedir, parameterdir, targetdir)
+    assert summary['entries']['a']['status'] == DONE
+    assert summary['entries']['b']['status'] == SKIPPED
+    assert zarr.open_group(targetdir / 'b.zarr', mode='r').attrs['foreign']
+    result = zarr.open_group(targetdir / 'a.zarr', mode='r')['metric/raw'][...]
+    assert np.array_equal(result, extract_roi(data, ROI))
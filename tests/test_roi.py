@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+import zarr
+
+from woodtools.pipeline.pyramid import build_pyramid
+from woodtools.pipeline.roi import extract_roi, roi_slices, scale_roispec
+
+
+def box(x0, y0, x1, y1, z_range=None):
+    roispec = {'top_left': [x0, y0], 'top_right': [x1, y0],
+               'bottom_left': [x0, y1], 'bottom_right': [x1, y1]}
+    if z_range is not None:
+        roispec['z_range'] = z_range
+    return roispec
+
+
+@pytest.fixture
+def pyramid(tmp_path):
+    data = np.random.default_rng(0).random((129, 129, 129), dtype=np.float32)
+    root = zarr.open_group(tmp_path / 'source.zarr', mode='w')
+    root.create_array('metric/raw', shape=data.shape, dtype=data.dtype, chunks=(32, 129, 129))[...] = data
+    levels = build_pyramid(root, min_size=16, progress=False)
+    return root, data, {level['factor']: level for level in levels}
+
+
+def test_scale_roispec_maps_preview_pixels_to_factor_multiples():
+    scaled = scale_roispec(box(32, 8, 33, 16, z_range=[4, 6]), 4)
+    assert scaled == box(128, 32, 132, 64, z_range=[16, 24])
+    assert roi_slices(scaled) == (slice(16, 24), slice(32, 64), slice(128, 132))
+
+
+@pytest.mark.parametrize('factor', [2, 4])
+def test_preview_roi_covers_source_blocks(pyramid, factor):
+    root, data, levels = pyramid
+    level = np.asarray(root[levels[factor]['path']])
+    assert levels[factor]['scale'] == [factor] * 3
+    # the ROI touches the last, edge-padded preview pixel along y and x
+    H = level.shape[-1]
+    roispec = box(H - 3, H - 2, H, H, z_range=[1, 3])
+    preview = extract_roi(level, roispec)
+    source = extract_roi(data, scale_roispec(roispec, factor))
+
+    assert source.shape[0] == preview.shape[0] * factor
+    padded = np.pad(source, [(0, -size % factor) for size in source.shape], mode='edge')
+    blocks = padded.reshape(
+        *(n for size in padded.shape for n in (size // factor, factor))
+    ).mean(axis=(1, 3, 5))
+    assert np.allclose(preview, blocks, atol=1e-6)
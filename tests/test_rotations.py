@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+import zarr
+
+from woodtools.pipeline.roi import extract_roi
+from woodtools.pipeline.rotations import (
+    interpolation_mode, rotate_roi, rotate_roi_zarr, rotate_slab
+)
+
+
+def box(x0, y0, x1, y1, z_range=None):
+    roispec = {'top_left': [x0, y0], 'top_right': [x1, y0],
+               'bottom_left': [x0, y1], 'bottom_right': [x1, y1]}
+    if z_range is not None:
+        roispec['z_range'] = z_range
+    return roispec
+
+
+ROIS = [
+    box(5, 7, 35, 30, z_range=[2, 9]),
+    # reaches past the right and lower image border
+    box(30, 20, 60, 50, z_range=[6, 20]),
+    # completely outside of the image
+    box(50, 5, 60, 10),
+]
+
+
+@pytest.fixture
+def volume():
+    return np.random.default_rng(0).random((12, 40, 44), dtype=np.float32)
+
+
+@pytest.mark.parametrize('roispec', ROIS)
+def test_rotate_roi_equals_rotate_then_extract(volume, roispec):
+    mode = interpolation_mode('bilinear')
+    expected = extract_roi(rotate_slab(volume, 23.0, mode), roispec)
+    result = rotate_roi(volume, 23.0, roispec, mode=mode)
+    assert result.shape == expected.shape
+    # the sampling grid is computed in float64 instead of torchvision's float32
+    assert np.allclose(result, expected, atol=1e-4)
+
+
+@pytest.mark.parametrize('roispec', ROIS)
+def test_rotate_roi_zarr_clips_to_the_volume(tmp_path, volume, roispec):
+    root = zarr.open_group(tmp_path / 'source.zarr', mode='w')
+    root.create_array('metric/raw', shape=volume.shape, dtype=volume.dtype, chunks=(4, 40, 44))[...] = volume
+    result = rotate_roi_zarr(tmp_path / 'source.zarr', tmp_path / 'target.zarr', 23.0, roispec)
+    expected = rotate_roi(volume, 23.0, roispec)
+    assert result.shape == expected.shape
+    assert np.array_equal(result[...], expected)
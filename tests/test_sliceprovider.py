@@ -0,0 +1,55 @@
+import threading
+
+import numpy as np
+
+from woodtools.pipeline.sliceprovider import SliceProvider
+
+
+def test_cache_is_bounded_by_bytes():
+    volume = np.arange(16 * 8 * 8, dtype=np.float64).reshape(16, 8, 8)
+    slice_bytes = volume[0].nbytes
+    provider = SliceProvider(volume, cache_bytes=3 * slice_bytes, prefetch=0)
+    for index in range(len(provider)):
+        assert np.array_equal(provider[index], volume[index])
+    assert len(provider._cache) == 3
+    assert provider._cache.nbytes <= 3 * slice_bytes
+    assert np.array_equal(provider[15], volume[15])
+    assert provider.statistics['hits'] == 1
+    provider.close()
+
+
+def test_close_stops_prefetching():
+    volume = np.zeros((8, 4, 4), dtype=np.uint8)
+    provider = SliceProvider(volume, prefetch=2)
+    provider[0]
+    provider.close()
+    assert provider._executor._shutdown
+    # reads are still served, just without read-ahead
+    assert np.array_equal(provider[4], volume[4])
+    assert 5 not in provider._pending
+
+
+class GatedVolume:
+    """Volume whose reads beyond slice 0 block until released."""
+    def __init__(self, data):
+        self.data = data
+        self.shape = data.shape
+        self.release = threading.Event()
+
+    def __getitem__(self, index):
+        if index != 0:
+            self.release.wait(timeout=5)
+        return self.data[index]
+
+
+def test_wait_on_inflight_prefetch_is_not_a_hit():
+    volume = GatedVolume(np.arange(4 * 2 * 2, dtype=np.uint8).reshape(4, 2, 2))
+    provider = SliceProvider(volume, prefetch=1)
+    provider[0]
+    assert 1 in provider._pending
+    threading.Timer(0.05, volume.release.set).start()
+    assert np.array_equal(provider[1], volume.data[1])
+    statistics = provider.statistics
+    assert (statistics['hits'], statistics['misses'], statistics['waits']) == (0, 1, 1)
+    assert statistics['hit_rate'] == 0.0
+    provider.close()
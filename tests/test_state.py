@@ -0,0 +1,81 @@
+import numpy as np
+
+from woodtools.pipeline.state import StateManager, WorkItem
+
+
+def test_copy_leaves_original_writable_and_isolates_writes():
+    item = WorkItem(ID='a', volume=np.zeros((2, 3, 4)), parameters={'angle': 1.0})
+    copied = item.copy()
+    assert item.volume.flags.writeable
+    assert not copied.volume.flags.writeable
+    assert np.shares_memory(item.volume, copied.volume)
+
+    item.mutable_volume()[0] = 1
+    copied.mutable_volume()[1] = 2
+    assert item.volume[0].min() == 1 and item.volume[1].max() == 0
+    assert copied.volume[0].max() == 0 and copied.volume[1].min() == 2
+    copied.parameters['angle'] = 2.0
+    assert item.parameters == {'angle': 1.0}
+
+
+def make_manager(**kwargs):
+    return StateManager(WorkItem(ID='initial', volume=np.zeros(1000, dtype=np.uint8)), **kwargs)
+
+
+def test_history_budget_keeps_items_sharing_the_current_buffer():
+    manager = make_manager(history_bytes=1500)
+    initial = manager.item
+    manager.update(WorkItem(ID='rotated', volume=np.ones(1000, dtype=np.uint8)))
+    # back to the initial buffer: its history entry costs nothing
+    manager.update(initial.copy())
+    assert [item.ID for item in manager.undo_stack] == ['initial', 'rotated']
+
+    manager.history_bytes = 500
+    manager.enforce_history_budget()
+    assert [item.ID for item in manager.undo_stack] == ['initial']
+    assert manager.history_nbytes() == 0
+
+
+def test_history_budget_drops_all_holders_of_a_buffer_together():
+    manager = make_manager(history_bytes=500)
+    manager.update(WorkItem(ID='rotated', volume=np.ones(1000, dtype=np.uint8)))
+    # parameter-only steps share the buffer of the current item
+    for angle in range(3):
+        item = manager.item.copy()
+        item.parameters['angle'] = angle
+        manager.update(item)
+    assert [item.ID for item in manager.undo_stack] == ['rotated'] * 3
+    assert manager.history_nbytes() == 0
+
+    manager.update(WorkItem(ID='cropped', volume=np.full(1000, 2, dtype=np.uint8)))
+    assert manager.undo_stack == []
+    assert manager.history_nbytes() == 0
+
+
+def test_history_budget_spills_every_holder_of_a_buffer(tmp_path):
+    manager = make_manager(history_bytes=0, spill_dir=tmp_path)
+    first = WorkItem(ID='first', volume=np.ones((10, 100), dtype=np.uint8))
+    manager.update(first)
+    second = first.copy()
+    second.volume = second.volume[:5]
+    manager.update(second)
+    manager.update(WorkItem(ID='third', volume=np.zeros(10, dtype=np.uint8)))
+    assert len(manager.undo_stack) == 3
+    assert all(item.is_spilled for item in manager.undo_stack)
+    assert manager.history_nbytes() == 0
+
+
+def test_ram_budget_spilling_does_not_enable_history_spilling():
+    manager = make_manager(history_bytes=1500, ram_budget=2500)
+    manager.update(WorkItem(ID='large', volume=np.ones(2000, dtype=np.uint8)))
+    # over the RAM budget: the initial volume went to a temporary directory
+    assert manager.undo_stack[0].is_spilled
+    assert manager.spill_dir is None
+
+    manager.update(WorkItem(ID='small', volume=np.zeros(100, dtype=np.uint8)))
+    # over the history budget without a spill_dir: dropped, not spilled
+    assert [item.ID for item in manager.undo_stack] == ['initial']
+    spill_directory = manager.spill_directory()
+    assert len(list(spill_directory.iterdir())) == 1
+    manager.close()
+    assert not spill_directory.exists()
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import zarr
+
+from woodtools.pipeline.transforms import downsample, downsample_zarr_streaming
+
+
+@pytest.mark.parametrize('shape, in_plane_target', [
+    ((32, 64, 64), 16),       # integer factor: block mean
+    ((30, 64, 48), 32),       # integer factor, anisotropic in-plane size
+    ((33, 61, 47), 20),       # odd shape, non-integer factor: trilinear
+    ((2, 17, 40, 40), 15),    # leading channel axis, non-integer factor
+])
+@pytest.mark.parametrize('dtype', [np.uint16, np.float32])
+def test_streaming_equals_in_memory(tmp_path, shape, in_plane_target, dtype):
+    rng = np.random.default_rng(0)
+    volume = (rng.random(shape) * 1000).astype(dtype)
+    root = zarr.open_group(tmp_path / 'source.zarr', mode='w')
+    chunks = (*shape[:-3], 8, *shape[-2:])
+    root.create_array('metric/raw', shape=shape, dtype=dtype, chunks=chunks)[...] = volume
+
+    expected = downsample(volume, in_plane_target)
+    # a small budget forces several slabs, processed by parallel workers
+    array = downsample_zarr_streaming(
+        root['metric/raw'], tmp_path / 'target.zarr', in_plane_target,
+        memory_budget=64 * 2**10, workers=2, progress=False
+    )
+    assert array.shape == expected.shape
+    assert array.dtype == expected.dtype
+    assert np.array_equal(array[...], expected)
+    assert array.attrs['in_plane_target'] == in_plane_target